@@ -19,14 +19,20 @@ and temperature.
     pure_water_vol_intgrt :
         Calculates integrated change in the volume of pure water from P_0 to P
         at fixed T.
+    pure_water_vol_intgrt_dT :
+        Calculates temperature derivative of 'pure_water_vol_intgrt'.
     pure_water_vol :
         Calculates volume of pure water at P and T.
     dielectric_const :
         Calculates dielectric constant of pure water at P and T.
+    dielectric_const_derivs :
+        Calculates temperature and pressure derivatives of dielectric constant.
     molality :
         Calculates molality of each solute in the aqueous phase.
     solute_vol_integrated:
         Calculates volume of each component as a solute.
+    solute_vol_integrated_derivs:
+        Calculates temperature and pressure derivatives of 'solute_vol_integrated'.
 """
 
 import numpy as np
@@ -101,6 +107,45 @@ def pure_water_vol_intgrt(T, P):
            + (a13 * P + a23 * P ** 2 / 2 + a33 * P ** 3 / 3 + a43 * P ** 4 / 4) * T ** 3)
     return v_w
 
+def pure_water_vol_intgrt_dT(T, P):
+    """Temperature derivative of volume of pure water integrated wrt pressure.
+
+    Parameters
+    ----------
+    T : float
+        Temperature in Kelvin.
+    P : float
+        Pressure in bar.
+
+    Returns
+    ----------
+    dv_w : float
+        Derivative of 'pure_water_vol_intgrt' in cm^3 - bar / K.
+    """
+    dv_w = ((a11 * P + a21 * P ** 2 / 2 + a31 * P ** 3 / 3 + a41 * P ** 4 / 4)
+            + 2 * (a12 * P + a22 * P ** 2 / 2 + a32 * P ** 3 / 3 + a42 * P ** 4 / 4) * T
+            + 3 * (a13 * P + a23 * P ** 2 / 2 + a33 * P ** 3 / 3 + a43 * P ** 4 / 4) * T ** 2)
+    return dv_w
+
+def pure_water_vol_intgrt_dT2(T, P):
+    """Second temperature derivative of 'pure_water_vol_intgrt'.
+
+    Parameters
+    ----------
+    T : float
+        Temperature in Kelvin.
+    P : float
+        Pressure in bar.
+
+    Returns
+    ----------
+    d2v_w : float
+        Second derivative of 'pure_water_vol_intgrt' in cm^3 - bar / K^2.
+    """
+    d2v_w = (2 * (a12 * P + a22 * P ** 2 / 2 + a32 * P ** 3 / 3 + a42 * P ** 4 / 4)
+             + 6 * (a13 * P + a23 * P ** 2 / 2 + a33 * P ** 3 / 3 + a43 * P ** 4 / 4) * T)
+    return d2v_w
+
 def pure_water_vol(T, P):
     """Volume of pure water.
 
@@ -144,6 +189,32 @@ def dielectric_const(T, P):
     return eps
 
 
+def dielectric_const_derivs(T, P):
+    """Temperature and pressure derivatives of dielectric constant of pure water.
+
+    Parameters
+    ----------
+    T : float
+        Temperature in Kelvin.
+    P : float
+        Pressure in bar.
+
+    Returns
+    ----------
+    derivs : tuple
+        derivs[0] : float
+            Derivative of dielectric constant wrt temperature in 1/K.
+        derivs[1] : float
+            Derivative of dielectric constant wrt pressure in 1/bar.
+    """
+    deps_dT = ((s11 + s21 * P + s31 * P ** 2)
+               + 2 * (s12 + s22 * P + s32 * P ** 2) * T)
+    deps_dP = ((s20 + 2 * s30 * P)
+               + (s21 + 2 * s31 * P) * T
+               + (s22 + 2 * s32 * P) * T ** 2)
+    return deps_dT, deps_dP
+
+
 def molality(xc, xw):
     """Calculates molality of each solute in the aqueous phase.
 
@@ -196,6 +267,102 @@ def solute_vol_integrated(comp, T, P):
     return v_ast_P
 
 
+def solute_vol_integrated_derivs(comp, T, P):
+    """Temperature and pressure derivatives of 'solute_vol_integrated'.
+
+    Parameters
+    ----------
+    comp : object
+        Instance of Component class for each component
+    T : float
+        Temperature in Kelvin.
+    P : float
+        Pressure in bar.
+
+    Returns
+    ----------
+    derivs : tuple
+        derivs[0] : float
+            Derivative wrt temperature in cm^3 - bar / J
+        derivs[1] : float
+            Derivative wrt pressure in cm^3 / J
+    """
+    omega = comp.AqHB['omega_born']
+    v1 = comp.AqHB['v']['v1']
+    v2 = comp.AqHB['v']['v2']
+    v3 = comp.AqHB['v']['v3']
+    v4 = comp.AqHB['v']['v4']
+    exp_term = np.exp((T - 273.15) / 5.0)
+    tau = ((5.0 / 6.0) * T - theta) / (1.0 + exp_term)
+    dtau_dT = ((5.0 / 6.0) / (1.0 + exp_term)
+               - ((5.0 / 6.0) * T - theta) * exp_term / (5.0 * (1.0 + exp_term) ** 2))
+    eps = dielectric_const(T, P)
+    deps_dT, deps_dP = dielectric_const_derivs(T, P)
+
+    numerator = (v1 * P + v2 * np.log(psi + P)
+                 + (v3 * P + v4 * np.log(psi + P)) * (1.0 / (T - theta - tau))
+                 + omega / eps)
+    dv_ast_dT = (
+        (-(v3 * P + v4 * np.log(psi + P)) * (1.0 - dtau_dT) / (T - theta - tau) ** 2
+         - omega * deps_dT / eps ** 2) / (R * T)
+        - numerator / (R * T ** 2)
+    )
+    dv_ast_dP = (
+        (v1 + v2 / (psi + P)
+         + (v3 + v4 / (psi + P)) * (1.0 / (T - theta - tau))
+         - omega * deps_dP / eps ** 2) / (R * T)
+    )
+    return dv_ast_dT, dv_ast_dP
+
+
+def solute_vol_integrated_dT2(comp, T, P):
+    """Second temperature derivative of 'solute_vol_integrated'.
+
+    Parameters
+    ----------
+    comp : object
+        Instance of Component class for each component
+    T : float
+        Temperature in Kelvin.
+    P : float
+        Pressure in bar.
+
+    Returns
+    ----------
+    d2v_ast_dT2 : float
+        Second derivative wrt temperature in cm^3 - bar / (J - K)
+    """
+    omega = comp.AqHB['omega_born']
+    v1 = comp.AqHB['v']['v1']
+    v2 = comp.AqHB['v']['v2']
+    v3 = comp.AqHB['v']['v3']
+    v4 = comp.AqHB['v']['v4']
+    exp_term = np.exp((T - 273.15) / 5.0)
+    u = (5.0 / 6.0) * T - theta
+    q = 1.0 + exp_term
+    tau = u / q
+    dtau_dT = (5.0 / 6.0) / q - u * exp_term / (5.0 * q ** 2)
+    d2tau_dT2 = (-2.0 * (5.0 / 6.0) * exp_term / (5.0 * q ** 2)
+                 - u * exp_term / (25.0 * q ** 2)
+                 + 2.0 * u * exp_term ** 2 / (25.0 * q ** 3))
+    eps = dielectric_const(T, P)
+    deps_dT = dielectric_const_derivs(T, P)[0]
+    d2eps_dT2 = 2 * (s12 + s22 * P + s32 * P ** 2)
+
+    c_term = v3 * P + v4 * np.log(psi + P)
+    denom = T - theta - tau
+    numerator = v1 * P + v2 * np.log(psi + P) + c_term / denom + omega / eps
+    dnumerator = -c_term * (1.0 - dtau_dT) / denom ** 2 - omega * deps_dT / eps ** 2
+    d2numerator = (c_term * d2tau_dT2 / denom ** 2
+                   + 2.0 * c_term * (1.0 - dtau_dT) ** 2 / denom ** 3
+                   - omega * d2eps_dT2 / eps ** 2
+                   + 2.0 * omega * deps_dT ** 2 / eps ** 3)
+    d2v_ast_dT2 = (d2numerator / (R * T)
+                   - 2.0 * dnumerator / (R * T ** 2)
+                   + 2.0 * numerator / (R * T ** 3))
+    return d2v_ast_dT2
+
+
 class HegBromEos(object):
     """The main class for this EOS that perform various calculations.
 
@@ -205,8 +372,24 @@ class HegBromEos(object):
         Performs calculations that only depend on pressure and temperature.
     fugacity :
         Calculates fugacity of each component in the aqueous phase.
+    make_derivative_mats :
+        Performs derivative calculations that only depend on pressure and temperature.
+    dlnf_dx :
+        Calculates composition derivatives of log fugacity.
+    dlnf_dT :
+        Calculates temperature derivatives of log fugacity.
+    dlnf_dP :
+        Calculates pressure derivatives of log fugacity.
+    partial_enthalpy :
+        Calculates partial molar enthalpy of each component.
+    enthalpy :
+        Calculates molar enthalpy of phase.
+    heat_capacity :
+        Calculates molar heat capacity of phase.
     calc:
         Main calculation for aqueous phase EOS.
+    calc_derivatives :
+        Fugacities and their derivatives for one or many states.
     """
 
     def __init__(self, comps, T, P):
@@ -249,6 +432,17 @@ class HegBromEos(object):
             component in Bromley activity model.
         mu_ik_RT_vec : numpy array
             Pre-allocated array chemical potential of each component.
+        dmu_dT_vec : numpy array
+            Pre-allocated array for temperature derivative of the
+            composition independent part of log fugacity.
+        dmu_dP_vec : numpy array
+            Pre-allocated array for pressure derivative of the
+            composition independent part of log fugacity.
+        dgamma_p1_dT_vec : numpy array
+            Pre-allocated array for temperature derivative of gamma_{p1}.
+        d2mu_dT2_vec : numpy array
+            Pre-allocated array for second temperature derivative of the
+            composition independent part of log fugacity.
         """
         try:
             self.water_ind = [ii for ii, x in enumerate(comps)
@@ -267,6 +461,11 @@ class HegBromEos(object):
         self.activity_vec = np.zeros(self.num_comps)
         self.gamma_p1_vec = np.zeros(self.num_comps)
         self.mu_ik_rt_cons = np.zeros(self.num_comps)
+        self.dmu_dT_vec = np.zeros(self.num_comps)
+        self.dmu_dP_vec = np.zeros(self.num_comps)
+        self.dgamma_p1_dT_vec = np.zeros(self.num_comps)
+        self.d2mu_dT2_vec = np.zeros(self.num_comps)
+        self.derivative_TP = None
         self.make_constant_mats(comps, T, P)
 
     def make_constant_mats(self, comps, T, P):
@@ -336,6 +535,91 @@ class HegBromEos(object):
                        - pure_water_vol_intgrt(T, P_0)) * 1e-1 / (R * T)
                 )
 
+    def make_derivative_mats(self, comps, T, P):
+        """Portion of derivative calculation that only depends on P and T.
+
+        Parameters
+        ----------
+        comps : list
+            List of components as 'Component' objects created with
+            'component_properties.py'.
+        T : float
+            Temperature in Kelvin.
+        P : float
+            Pressure in bar.
+
+        Notes
+        ----------
+        Only called when derivatives are requested. Temperature
+        derivatives of the gibbs energy terms follow from
+        d(g/RT)/dT = -h/(R*T**2).
+        """
+        self.derivative_TP = (T, P)
+        for ii, comp in enumerate(comps):
+            h_io = comp.enthalpy_ideal(T)
+            dg_io_dT = -h_io / (R * T ** 2)
+            d2g_io_dT2 = (-comp.heat_capacity_ideal(T) / (R * T ** 2)
+                          + 2 * h_io / (R * T ** 3))
+            if comp.compname != 'h2o':
+                c1 = comp.AqHB['cp']['c1']
+                c2 = comp.AqHB['cp']['c2']
+                omega = comp.AqHB['omega_born']
+                h_io_ast = comp.h_io_ast
+
+                # Derivative of the output of symbolic integration.
+                dh_ast_dT = ((f1 * c1 + f2 * omega) / (f1 * R * T)
+                             - (f3 * omega) / (f4 * R)
+                             - 2 * f5 * c2 / (f4 * R * T ** 3)
+                             + (f4 * c2 + f4 * T_0 * h_io_ast - f4 * T_0 ** 2 * c1
+                                - f6 * T_0 ** 2 * omega + f3 * T_0 ** 3 * omega)
+                             / (f4 * R * T ** 2 * T_0))
+                dv_dT, dv_dP = solute_vol_integrated_derivs(comp, T, P)
+                dv0_dT, dv0_dP = solute_vol_integrated_derivs(comp, T, P_0)
+                self.dmu_dT_vec[ii] = -dh_ast_dT + dv_dT - dv0_dT - dg_io_dT
+                self.dmu_dP_vec[ii] = dv_dP
+
+                d2h_ast_dT2 = (-(f1 * c1 + f2 * omega) / (f1 * R * T ** 2)
+                               + 6 * f5 * c2 / (f4 * R * T ** 4)
+                               - 2 * (f4 * c2 + f4 * T_0 * h_io_ast
+                                      - f4 * T_0 ** 2 * c1
+                                      - f6 * T_0 ** 2 * omega
+                                      + f3 * T_0 ** 3 * omega)
+                               / (f4 * R * T ** 3 * T_0))
+                self.d2mu_dT2_vec[ii] = (-d2h_ast_dT2
+                                         + solute_vol_integrated_dT2(comp, T, P)
+                                         - solute_vol_integrated_dT2(comp, T, P_0)
+                                         - d2g_io_dT2)
+
+                if comp.compname == 'co2':
+                    self.dgamma_p1_dT_vec[ii] = -4.5e-4
+            else:
+                hw = (hw_pure + cp_a0 * (T - T_0)
+                      + cp_a1 * (T ** 2 - T_0 ** 2) / 2
+                      + cp_a2 * (T ** 3 - T_0 ** 3) / 3
+                      + cp_a3 * (T ** 4 - T_0 ** 4) / 4)
+                vol_intgrt = (pure_water_vol_intgrt(T, P)
+                              - pure_water_vol_intgrt(T, P_0)) * 1e-1
+                self.dmu_dT_vec[ii] = (
+                    -hw / (R * T ** 2)
+                    + (pure_water_vol_intgrt_dT(T, P)
+                       - pure_water_vol_intgrt_dT(T, P_0)) * 1e-1 / (R * T)
+                    - vol_intgrt / (R * T ** 2)
+                    - dg_io_dT
+                )
+                self.dmu_dP_vec[ii] = pure_water_vol(T, P) * 1e-1 / (R * T)
+
+                cpw = cp_a0 + cp_a1 * T + cp_a2 * T ** 2 + cp_a3 * T ** 3
+                dvol_intgrt = (pure_water_vol_intgrt_dT(T, P)
+                               - pure_water_vol_intgrt_dT(T, P_0)) * 1e-1
+                self.d2mu_dT2_vec[ii] = (
+                    -cpw / (R * T ** 2) + 2 * hw / (R * T ** 3)
+                    + (pure_water_vol_intgrt_dT2(T, P)
+                       - pure_water_vol_intgrt_dT2(T, P_0)) * 1e-1 / (R * T)
+                    - 2 * dvol_intgrt / (R * T ** 2)
+                    + 2 * vol_intgrt / (R * T ** 3)
+                    - d2g_io_dT2
+                )
+
     def fugacity(self, comps, x):
         """Fugacity of each component in aqueous phase for molar fractions 'x'.
 
@@ -371,6 +655,152 @@ class HegBromEos(object):
         fug = np.exp(mu_ik_RT - self.g_io_vec)
         return fug
 
+    def dlnf_dx(self, x):
+        """Derivative of log fugacity of each component wrt molar fractions 'x'.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of component i (rows) wrt molar
+            fraction of component k (columns) with size Nc x Nc.
+
+        Notes
+        ----------
+        Molar fractions are treated as independent variables. Only the
+        molality terms depend on composition, with dm_i/dx_i = 1/(x_w*M_w)
+        and dm_i/dx_w = -m_i/x_w.
+        """
+        xw = x[self.water_ind]
+        solute = np.array([ii for ii in range(self.num_comps)
+                           if ii != self.water_ind], dtype=int)
+        m = self.molality_vec[solute]
+        gamma = self.gamma_p1_vec[solute]
+        dm_dx = 1.0 / (xw * 0.018015)
+        dlnf = np.zeros([self.num_comps, self.num_comps])
+
+        # Solutes: ln(m_i) + 2*m_i*gamma_i
+        dact_dm = 1.0 / m + 2.0 * gamma
+        dlnf[solute, solute] = dact_dm * dm_dx
+        dlnf[solute, self.water_ind] = -dact_dm * m / xw
+
+        # Water: -0.018015*sum(m_i**2*gamma_i + m_i)
+        dw_dm = -0.018015 * (2.0 * m * gamma + 1.0)
+        dlnf[self.water_ind, solute] = dw_dm * dm_dx
+        dlnf[self.water_ind, self.water_ind] = -np.sum(dw_dm * m) / xw
+        return dlnf
+
+    def dlnf_dT(self, x):
+        """Derivative of log fugacity of each component wrt temperature.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of each component wrt temperature
+            in 1/K with size Nc.
+        """
+        if self.derivative_TP != (self.T, self.P):
+            self.make_derivative_mats(self.comps, self.T, self.P)
+        dlnf = self.dmu_dT_vec + 2.0 * self.molality_vec * self.dgamma_p1_dT_vec
+        dlnf[self.water_ind] = (self.dmu_dT_vec[self.water_ind]
+                                - 0.018015 * np.sum(self.molality_vec ** 2
+                                                    * self.dgamma_p1_dT_vec))
+        return dlnf
+
+    def dlnf_dP(self, x):
+        """Derivative of log fugacity of each component wrt pressure.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of each component wrt pressure
+            in 1/bar with size Nc.
+        """
+        if self.derivative_TP != (self.T, self.P):
+            self.make_derivative_mats(self.comps, self.T, self.P)
+        return self.dmu_dP_vec.copy()
+
+    def partial_enthalpy(self, x):
+        """Partial molar enthalpy of each component.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        h : numpy array
+            Partial molar enthalpy of each component in J/mol, relative
+            to the same reference as 'Component.enthalpy_ideal'.
+
+        Notes
+        ----------
+        Follows from h_i = h_io - R*T**2*dln(f_i)/dT at fixed P and x.
+        """
+        h_io = np.array([comp.enthalpy_ideal(self.T) for comp in self.comps])
+        h = h_io - R * self.T ** 2 * self.dlnf_dT(x)
+        return h
+
+    def enthalpy(self, x):
+        """Molar enthalpy of phase.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        h : float
+            Molar enthalpy of phase in J/mol.
+        """
+        return np.dot(x, self.partial_enthalpy(x))
+
+    def heat_capacity(self, x):
+        """Molar heat capacity of phase at constant pressure.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        cp : float
+            Molar heat capacity of phase in J/mol-K.
+
+        Notes
+        ----------
+        gamma_{p1} is linear in temperature, so only the composition
+        independent part contributes a second temperature derivative.
+        """
+        T = self.T
+        dlnf = self.dlnf_dT(x)
+        cp_io = np.array([comp.heat_capacity_ideal(T) for comp in self.comps])
+        cp_i = cp_io - 2.0 * R * T * dlnf - R * T ** 2 * self.d2mu_dT2_vec
+        return np.dot(x, cp_i)
+
     def calc(self, comps, T, P, x):
         """Main calculation for the EOS which returns array of fugacities
 
@@ -412,3 +842,59 @@ class HegBromEos(object):
 
             fug = self.fugacity(comps, x)
         return fug
+
+    def calc_derivatives(self, comps, T, P, x):
+        """Fugacities and their derivatives for one or many states
+
+        Parameters
+        ----------
+        comps : list
+            List of components as 'Component' classes.
+        T : float, numpy array
+            Temperature in Kelvin, either a single value or one per state.
+        P : float, numpy array
+            Pressure in bar, either a single value or one per state.
+        x : list, numpy array
+            Molar fractions of each components with size Nc, or with
+            size m x Nc for m states.
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Fugacity of each component with size (m x) Nc
+            values[1] : numpy array
+                Derivative of log fugacity wrt molar fractions
+                with size (m x) Nc x Nc
+            values[2] : numpy array
+                Derivative of log fugacity wrt temperature with size (m x) Nc
+            values[3] : numpy array
+                Derivative of log fugacity wrt pressure with size (m x) Nc
+
+        Notes
+        ----------
+        States are evaluated in order of temperature and pressure, such
+        that 'make_constant_mats' and 'make_derivative_mats' are called
+        once per distinct pair.
+        """
+        x = np.asarray(x, dtype=float)
+        single = (x.ndim == 1)
+        x = np.atleast_2d(x)
+        n_states = x.shape[0]
+        T_vec = np.broadcast_to(np.asarray(T, dtype=float), [n_states])
+        P_vec = np.broadcast_to(np.asarray(P, dtype=float), [n_states])
+
+        fug = np.zeros([n_states, self.num_comps])
+        dlnf_dx = np.zeros([n_states, self.num_comps, self.num_comps])
+        dlnf_dT = np.zeros([n_states, self.num_comps])
+        dlnf_dP = np.zeros([n_states, self.num_comps])
+        for ii in np.lexsort((P_vec, T_vec)):
+            fug[ii] = self.calc(comps, T_vec[ii], P_vec[ii], x[ii])
+            dlnf_dx[ii] = self.dlnf_dx(x[ii])
+            dlnf_dT[ii] = self.dlnf_dT(x[ii])
+            dlnf_dP[ii] = self.dlnf_dP(x[ii])
+
+        values = [fug, dlnf_dx, dlnf_dT, dlnf_dP]
+        if single:
+            values = [value[0] for value in values]
+        return values
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Per-cell flash state for repeated flashes of simulation grid cells
+
+A coupled simulator flashes the same grid cells at every time step with
+small changes in pressure, temperature and composition. The class
+'CellFlashState' keeps the partition coefficients, phase fractions,
+stabilities, reference phase and phase assemblage of every cell in
+contiguous arrays, so that each step starts from the previous solution
+of the cell. A full flash from scratch is only run for cells whose
+phase assemblage changed or whose warm start did not converge.
+
+The active set of 'main_handler' is rebuilt during every flash and
+frozen phases are released again before convergence, so the phase set
+kept per cell is the assemblage of present phases.
+"""
+import numpy as np
+import time
+
+import flashalgorithm as fc
+import composition_diagram as cd
+
+
+class CellFlashState(object):
+    """Flash state of many cells sharing one set of components and phases
+
+    Methods
+    ----------
+    update :
+        Flash all cells at new conditions starting from their last solution
+    warm_flash :
+        Flash a single cell from its stored solution
+    full_flash :
+        Flash a single cell from scratch
+    store :
+        Copy the result of the controller into the arrays of a cell
+    assemblage_of :
+        Phases present in a solution
+    accepted :
+        Whether the last flash of the controller can be stored
+    """
+    def __init__(self, flash, N, alpha_min=1e-8, tol=1e-6):
+        """Flash state store for N cells
+
+        Parameters
+        ----------
+        flash : FlashController
+            Controller used for every flash of the cells
+        N : int
+            Number of cells
+        alpha_min : float
+            Phase fraction above which a phase counts as present
+        tol : float
+            Error below which a flash counts as converged
+
+        Attributes
+        ----------
+        T : numpy array
+            Temperature in Kelvin of each cell with size N
+        P : numpy array
+            Pressure in bar of each cell with size N
+        z : numpy array
+            Total composition of each cell with size N x Nc
+        K : numpy array
+            Partition coefficients of each cell with size N x Nc x Np
+        x : numpy array
+            Compositions of each cell with size N x Nc x Np
+        alpha : numpy array
+            Molar phase fractions of each cell with size N x Np
+        theta : numpy array
+            Phase stabilities of each cell with size N x Np
+        ref_ind : numpy array
+            Index of the reference phase of each cell with size N
+        assemblage : numpy array
+            Boolean array of present phases of each cell with size N x Np
+        error : numpy array
+            Error of the last flash of each cell with size N
+        initialized : numpy array
+            Boolean array of cells that have a solution with size N
+        step_stats : list
+            Statistics of each call to 'update'
+        """
+        self.flash = flash
+        self.N = N
+        self.Nc = flash.Nc
+        self.Np = flash.Np
+        self.alpha_min = alpha_min
+        self.tol = tol
+        self.T = np.full(N, np.nan)
+        self.P = np.full(N, np.nan)
+        self.z = np.full((N, self.Nc), np.nan)
+        self.K = np.ones((N, self.Nc, self.Np))
+        self.x = np.zeros((N, self.Nc, self.Np))
+        self.alpha = np.zeros((N, self.Np))
+        self.theta = np.zeros((N, self.Np))
+        self.ref_ind = np.zeros(N, dtype=int)
+        self.assemblage = np.zeros((N, self.Np), dtype=bool)
+        self.error = np.full(N, np.inf)
+        self.initialized = np.zeros(N, dtype=bool)
+        self.step_stats = []
+
+    def update(self, T, P, z, cells=None):
+        """Flash all cells at new conditions starting from their last solution
+
+        Parameters
+        ----------
+        T : float, numpy array
+            Temperature in Kelvin, scalar or one per cell
+        P : float, numpy array
+            Pressure in bar, scalar or one per cell
+        z : numpy array
+            Total composition with size Nc or one row per cell
+        cells : numpy array, optional
+            Indices of the cells to update, all cells by default
+
+        Returns
+        ----------
+        stats : dict
+            Statistics of the step: number of cells that were unchanged,
+            updated from their previous solution, flashed from scratch
+            because they were new, changed assemblage or did not converge
+            from the warm start, and that did not converge at all,
+            together with the total number of iterations and time.
+
+        Notes
+        ----------
+        Cells whose conditions are identical to their last flash are
+        skipped. A cell whose full flash raised, did not converge or
+        ended on a trivial solution keeps its previous solution and is
+        marked as unconverged with an infinite error.
+        """
+        tstart = time.time()
+        if cells is None:
+            cells = np.arange(self.N)
+        cells = np.atleast_1d(cells)
+        T = np.broadcast_to(np.asarray(T, dtype=float), cells.shape)
+        P = np.broadcast_to(np.asarray(P, dtype=float), cells.shape)
+        z = np.broadcast_to(np.asarray(z, dtype=float),
+                            cells.shape + (self.Nc,))
+
+        stats = {'cells': len(cells), 'unchanged': 0, 'incremental': 0,
+                 'new': 0, 'changed': 0, 'unconverged_warm': 0,
+                 'failed': 0, 'iterations': 0, 'time': 0.0}
+        for ii, cell in enumerate(cells):
+            if (self.initialized[cell] and (T[ii] == self.T[cell])
+                    and (P[ii] == self.P[cell])
+                    and (z[ii] == self.z[cell]).all()
+                    and (self.error[cell] <= self.tol)):
+                stats['unchanged'] += 1
+                continue
+
+            if self.initialized[cell]:
+                out = self.warm_flash(cell, T[ii], P[ii], z[ii])
+                if out is not None:
+                    stats['iterations'] += out[3]
+                if self.accepted(out):
+                    assemblage = self.assemblage_of(out[1])
+                    if (assemblage == self.assemblage[cell]).all():
+                        stats['incremental'] += 1
+                        self.store(cell, T[ii], P[ii], z[ii], out)
+                        continue
+                    stats['changed'] += 1
+                else:
+                    stats['unconverged_warm'] += 1
+            else:
+                stats['new'] += 1
+
+            # New assemblage, so a warm start may sit in the wrong
+            # minimum, or no previous solution exists.
+            out = self.full_flash(T[ii], P[ii], z[ii])
+            if out is not None:
+                stats['iterations'] += out[3]
+            if self.accepted(out):
+                self.store(cell, T[ii], P[ii], z[ii], out)
+            else:
+                stats['failed'] += 1
+                self.error[cell] = np.inf
+
+        stats['time'] = time.time() - tstart
+        self.step_stats.append(stats)
+        return stats
+
+    def warm_flash(self, cell, T, P, z):
+        """Flash a single cell from its stored solution
+
+        Parameters
+        ----------
+        cell : int
+            Index of the cell
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+        z : numpy array
+            Total composition with size Nc
+
+        Returns
+        ----------
+        values : list or None
+            Output of 'main_handler', or None if the flash raised
+        """
+        flash = self.flash
+        try:
+            values = flash.main_handler(
+                flash.compobjs, z, T, P, K_init=self.K[cell],
+                alpha_init=self.alpha[cell], theta_init=self.theta[cell],
+                ref_phase=flash.phases[self.ref_ind[cell]], stall_iter=20)
+        except (ValueError, FloatingPointError, np.linalg.LinAlgError):
+            values = None
+        return values
+
+    def full_flash(self, T, P, z):
+        """Flash a single cell from scratch
+
+        Parameters
+        ----------
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+        z : numpy array
+            Total composition with size Nc
+
+        Returns
+        ----------
+        values : list or None
+            Output of 'robust_flash' with ideal starts and every
+            reference phase, or None if the flash raised
+        """
+        flash = self.flash
+        try:
+            values = flash.robust_flash(flash.compobjs, z, T, P,
+                                        strategies=('ideal', 'ref'),
+                                        tol=self.tol)
+        except (ValueError, FloatingPointError, np.linalg.LinAlgError):
+            values = None
+        return values
+
+    def store(self, cell, T, P, z, out):
+        """Copy the result of the controller into the arrays of a cell
+
+        Parameters
+        ----------
+        cell : int
+            Index of the cell
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+        z : numpy array
+            Total composition with size Nc
+        out : list
+            Output of the flash of the cell
+        """
+        flash = self.flash
+        self.T[cell] = T
+        self.P[cell] = P
+        self.z[cell] = z
+        self.K[cell] = flash.K_calc
+        self.x[cell] = flash.x_calc
+        self.alpha[cell] = flash.alpha_calc
+        self.theta[cell] = flash.theta_calc
+        self.ref_ind[cell] = flash.ref_ind
+        self.assemblage[cell] = self.assemblage_of(flash.alpha_calc)
+        self.error[cell] = out[4]
+        self.initialized[cell] = True
+
+    def assemblage_of(self, alpha):
+        """Phases present in a solution
+
+        Parameters
+        ----------
+        alpha : numpy array
+            Molar phase fractions with size Np
+
+        Returns
+        ----------
+        present : numpy array
+            Boolean array of phases with alpha above 'alpha_min'
+        """
+        present = np.asarray(alpha) > self.alpha_min
+        return present
+
+    def accepted(self, out):
+        """Whether the last flash of the controller can be stored
+
+        Parameters
+        ----------
+        out : list or None
+            Output of 'warm_flash' or 'full_flash'
+
+        Returns
+        ----------
+        accept : bool
+            True if the flash completed, converged to within 'tol' and
+            did not end on a trivial solution, see 'trivial_state'
+        """
+        accept = ((out is not None) and (out[4] <= self.tol)
+                  and not cd.trivial_state(self.flash,
+                                           self.flash.calc_state(),
+                                           self.alpha_min))
+        return accept
@@ -31,6 +31,10 @@ class Component(object):
     ----------
     gibbs_ideal :
         Gibbs free energy of component in ideal gas state.
+    enthalpy_ideal :
+        Enthalpy of component in ideal gas state.
+    heat_capacity_ideal :
+        Heat capacity of component in ideal gas state.
     """
     menu = dict(h2o=('h2o', 'h_2o', 'h20', 'h_20', 'water'),
                 ch4=('ch4', 'ch_4', 'c1', 'methane'),
@@ -598,3 +602,43 @@ class Component(object):
                )/(12*R*T*T_0)
         )
         return g_io_RT
+
+    def enthalpy_ideal(self, T):
+        """Enthalpy in ideal gas state.
+
+         Parameters
+         ----------
+         T : float
+            Temperature in Kelvin.
+
+         Returns
+         ----------
+         h_io : float
+            Enthalpy of component in ideal gas state in J/mol.
+
+        Notes
+        ----------
+        Consistent with 'gibbs_ideal' through d(g_io_RT)/dT = -h_io/(R*T**2).
+        """
+        h_io = (self.h_io + self.cp['a0']*(T - T_0)
+                + self.cp['a1']*(T**2 - T_0**2)/2
+                + self.cp['a2']*(T**3 - T_0**3)/3
+                + self.cp['a3']*(T**4 - T_0**4)/4)
+        return h_io
+
+    def heat_capacity_ideal(self, T):
+        """Heat capacity in ideal gas state.
+
+         Parameters
+         ----------
+         T : float
+            Temperature in Kelvin.
+
+         Returns
+         ----------
+         cp_io : float
+            Heat capacity of component in ideal gas state in J/mol-K.
+        """
+        cp_io = (self.cp['a0'] + self.cp['a1']*T
+                 + self.cp['a2']*T**2 + self.cp['a3']*T**3)
+        return cp_io
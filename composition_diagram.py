@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Ternary and quaternary composition diagrams at fixed T and P
+
+The composition simplex of three or four components, e.g. the guest gases
+of a mixed hydrate with a fixed amount of water, is sampled on a regular
+lattice. Lattice points are flashed in a snake order, such that each
+flash is warm started from a neighbouring composition, and the ordered
+points are split into contiguous chunks that can run on a worker pool.
+Lattice edges whose ends have different phase assemblages are bisected
+to locate the boundary, and for ternary diagrams the boundary crossings
+are joined into polylines.
+
+Phase assemblages are stored as integer labels, in which bit j is set
+when phase j of 'FlashController.phases' is present, and label 0 marks
+a point where no flash converged.
+
+    Functions
+    ----------
+    simplex_lattice :
+        Integer lattice points of the simplex in warm-start order
+    lattice_edges :
+        Pairs of neighbouring lattice points
+    assemblage_label :
+        Integer label of a set of present phases
+    trivial_state :
+        Whether an absent phase of a flash result copies a present phase
+    warm_flash :
+        Flash from a nearby converged state with a robust fallback
+    flash_sequence :
+        Flash a sequence of compositions, each warm started from the last
+    bisect_edges :
+        Locate phase boundaries on lattice edges by bisection
+    boundary_polylines :
+        Join boundary crossings of a ternary lattice into polylines
+    composition_diagram :
+        Phase diagram over the composition simplex at one or more T and P
+"""
+import numpy as np
+from itertools import combinations
+
+import flashalgorithm as fc
+
+
+def simplex_lattice(dim, n):
+    """Integer lattice points of the simplex in warm-start order
+
+    Parameters
+    ----------
+    dim : int
+        Number of components spanning the simplex
+    n : int
+        Number of lattice steps along each edge
+
+    Returns
+    ----------
+    points : numpy array
+        Lattice points with non-negative integer entries summing to n,
+        with size m x dim
+
+    Notes
+    ----------
+    Points are ordered like a snake, reversing the direction of each
+    coordinate when the sum of the preceding coordinates is odd, so that
+    consecutive points are mostly lattice neighbours.
+    """
+    def compositions(total, parts):
+        if parts == 1:
+            yield (total,)
+            return
+        for first in range(total + 1):
+            for rest in compositions(total - first, parts - 1):
+                yield (first,) + rest
+
+    points = np.array(list(compositions(n, dim)), dtype=int)
+
+    def snake_key(point):
+        key = []
+        flip = False
+        for coord in point[:-1]:
+            key.append(-coord if flip else coord)
+            flip ^= bool(coord % 2)
+        return tuple(key)
+
+    order = sorted(range(len(points)), key=lambda ii: snake_key(points[ii]))
+    return points[order]
+
+
+def lattice_edges(points):
+    """Pairs of neighbouring lattice points
+
+    Parameters
+    ----------
+    points : numpy array
+        Output of 'simplex_lattice'
+
+    Returns
+    ----------
+    edges : numpy array
+        Indices into 'points' of both ends of each edge, with size
+        number of edges x 2. Neighbours differ by one step in two
+        coordinates.
+    """
+    index = {tuple(point): ii for ii, point in enumerate(points)}
+    dim = points.shape[1]
+    edges = []
+    for ii, point in enumerate(points):
+        for jj, kk in combinations(range(dim), 2):
+            if point[kk] == 0:
+                continue
+            neighbour = point.copy()
+            neighbour[jj] += 1
+            neighbour[kk] -= 1
+            edges.append((ii, index[tuple(neighbour)]))
+    edges = np.array(edges, dtype=int).reshape(-1, 2)
+    return edges
+
+
+def assemblage_label(present):
+    """Integer label of a set of present phases
+
+    Parameters
+    ----------
+    present : numpy array
+        Boolean array of present phases with size (m x) Np
+
+    Returns
+    ----------
+    label : int, numpy array
+        Sum of 2**j over present phases j
+    """
+    present = np.asarray(present, dtype=bool)
+    label = np.sum(present * 2**np.arange(present.shape[-1]), axis=-1)
+    return label
+
+
+def trivial_state(flash, state, alpha_min=1e-8):
+    """Whether an absent phase of a flash result copies a present phase
+
+    Parameters
+    ----------
+    flash : FlashController
+        Controller of the flash
+    state : dict
+        Output of 'calc_state'
+    alpha_min : float
+        Phase fraction above which a phase counts as present
+
+    Returns
+    ----------
+    trivial : bool
+        True if an absent phase has the eos type and composition of a
+        present phase, in which case its stability was not tested
+
+    Notes
+    ----------
+    Vapor and lhc of equal composition are one phase that
+    'merge_hc_phases' assigns to either label, so they are not counted.
+    """
+    x = state['x_calc']
+    present = np.flatnonzero(state['alpha_calc'] > alpha_min)
+    absent = np.flatnonzero(state['alpha_calc'] <= alpha_min)
+    for ii in absent:
+        for jj in present:
+            if {flash.phases[ii], flash.phases[jj]} == {'vapor', 'lhc'}:
+                continue
+            if ((type(flash.fug_list[ii]) is type(flash.fug_list[jj]))
+                    and (np.max(np.abs(x[:, ii] - x[:, jj])) < 1e-6)):
+                return True
+    return False
+
+
+def warm_flash(flash, z, T, P, start=None, tol=1e-6):
+    """Flash from a nearby converged state with a robust fallback
+
+    Parameters
+    ----------
+    flash : FlashController
+        Controller used for the flash
+    z : numpy array
+        Total composition with size Nc
+    T : float
+        Temperature in Kelvin
+    P : float
+        Pressure in bar
+    start : dict, optional
+        Output of 'calc_state' of a nearby flash
+    tol : float
+        Error below which a flash counts as converged
+
+    Returns
+    ----------
+    values : list
+        values[0] : dict or None
+            Output of 'calc_state', or None if no flash completed
+        values[1] : float
+            Error of the flash
+
+    Notes
+    ----------
+    A warm start may stay on a trivial solution, in which an absent
+    phase copies a present one, and miss a phase split. Trivial starts
+    are therefore not used, and trivial results are repeated with
+    'robust_flash'.
+    """
+    out = None
+    if (start is not None) and trivial_state(flash, start):
+        start = None
+    if start is not None:
+        try:
+            out = flash.main_handler(flash.compobjs, z, T, P,
+                                     K_init=start['K_calc'],
+                                     alpha_init=start['alpha_calc'],
+                                     theta_init=start['theta_calc'],
+                                     ref_phase=start['ref_phase'],
+                                     stall_iter=20)
+        except (ValueError, FloatingPointError, np.linalg.LinAlgError):
+            out = None
+    if ((out is None) or not (out[4] <= tol)
+            or trivial_state(flash, flash.calc_state())):
+        try:
+            out = flash.robust_flash(flash.compobjs, z, T, P,
+                                     strategies=('ideal', 'ref'), tol=tol)
+        except (ValueError, FloatingPointError, np.linalg.LinAlgError):
+            return [None, np.inf]
+    values = [flash.calc_state(), out[4]]
+    return values
+
+
+def flash_sequence(data, Z, T, P, alpha_min=1e-8, tol=1e-6):
+    """Flash a sequence of compositions, each warm started from the last
+
+    Parameters
+    ----------
+    data : bytes, FlashController
+        Output of 'FlashController.snapshot', or the controller itself
+    Z : numpy array
+        Total compositions with size m x Nc
+    T : float
+        Temperature in Kelvin
+    P : float
+        Pressure in bar
+    alpha_min : float
+        Phase fraction above which a phase counts as present
+    tol : float
+        Error below which a flash counts as converged
+
+    Returns
+    ----------
+    values : list
+        values[0] : numpy array
+            Assemblage label of each composition with size m
+        values[1] : numpy array
+            Molar phase fractions with size m x Np
+        values[2] : numpy array
+            Error of each flash with size m
+        values[3] : list
+            Output of 'calc_state' of each flash, or None
+
+    Notes
+    ----------
+    Module level so that it can be submitted to a process pool.
+    """
+    if isinstance(data, bytes):
+        flash = fc.FlashController.from_snapshot(data)
+    else:
+        flash = data
+    labels = np.zeros(len(Z), dtype=int)
+    alpha = np.zeros([len(Z), flash.Np])
+    error = np.full(len(Z), np.inf)
+    states = []
+    start = None
+    for ii, z in enumerate(Z):
+        state, error[ii] = warm_flash(flash, z, T, P, start, tol)
+        states.append(state)
+        if state is not None and error[ii] <= tol:
+            alpha[ii] = state['alpha_calc']
+            labels[ii] = assemblage_label(alpha[ii] > alpha_min)
+            start = state
+    values = [labels, alpha, error, states]
+    return values
+
+
+def bisect_edges(data, edges, T, P, n_bisect=3, alpha_min=1e-8, tol=1e-6):
+    """Locate phase boundaries on lattice edges by bisection
+
+    Parameters
+    ----------
+    data : bytes, FlashController
+        Output of 'FlashController.snapshot', or the controller itself
+    edges : list
+        Composition at both ends, their 'calc_state' outputs and the
+        label at the first end of each edge
+    T : float
+        Temperature in Kelvin
+    P : float
+        Pressure in bar
+    n_bisect : int
+        Number of bisections of each edge
+    alpha_min : float
+        Phase fraction above which a phase counts as present
+    tol : float
+        Error below which a flash counts as converged
+
+    Returns
+    ----------
+    t_cross : numpy array
+        Position of the boundary on each edge as a fraction from the
+        first end
+
+    Notes
+    ----------
+    Each flash is warm started from the end of the bracket closest to
+    it. A flash that does not converge ends the bisection of its edge.
+    """
+    if isinstance(data, bytes):
+        flash = fc.FlashController.from_snapshot(data)
+    else:
+        flash = data
+    t_cross = np.zeros(len(edges))
+    for ii, (z_a, z_b, state_a, state_b, label_a) in enumerate(edges):
+        t_lo, t_hi = 0.0, 1.0
+        for jj in range(n_bisect):
+            t_mid = 0.5*(t_lo + t_hi)
+            start = state_a if (t_mid - t_lo <= t_hi - t_mid) else state_b
+            state, error = warm_flash(flash, (1.0 - t_mid)*z_a + t_mid*z_b,
+                                      T, P, start, tol)
+            if (state is None) or (error > tol):
+                break
+            if assemblage_label(state['alpha_calc'] > alpha_min) == label_a:
+                t_lo, state_a = t_mid, state
+            else:
+                t_hi, state_b = t_mid, state
+        t_cross[ii] = 0.5*(t_lo + t_hi)
+    return t_cross
+
+
+def boundary_polylines(points, labels, crossings):
+    """Join boundary crossings of a ternary lattice into polylines
+
+    Parameters
+    ----------
+    points : numpy array
+        Output of 'simplex_lattice' with 3 coordinates
+    labels : numpy array
+        Assemblage label of each lattice point
+    crossings : dict
+        Position of the boundary (values) on each edge given as a sorted
+        tuple of point indices (keys), in lattice coordinates
+
+    Returns
+    ----------
+    values : list
+        values[0] : list
+            Vertices in lattice coordinates of each polyline as numpy
+            arrays with size vertices x 3
+        values[1] : list
+            Labels on both sides of each polyline as tuples
+
+    Notes
+    ----------
+    Boundaries are followed through the small triangles of the lattice.
+    A triangle with two labels contains one segment between its two
+    crossed edges, and one with three labels contains a segment from
+    each crossed edge to the mean of the crossings, a triple point.
+    """
+    index = {tuple(point): ii for ii, point in enumerate(points)}
+    n = int(points[0].sum())
+    triangles = []
+    for a in range(n):
+        for b in range(n - a):
+            up = [(a, b, n - a - b), (a + 1, b, n - a - b - 1),
+                  (a, b + 1, n - a - b - 1)]
+            triangles.append([index[p] for p in up])
+            if a + b <= n - 2:
+                down = [(a + 1, b, n - a - b - 1), (a, b + 1, n - a - b - 1),
+                        (a + 1, b + 1, n - a - b - 2)]
+                triangles.append([index[p] for p in down])
+
+    # Segments between nodes, which are crossed edges or triple points.
+    segments = {}
+    nodes = dict(crossings)
+    for tri in triangles:
+        crossed = [tuple(sorted(pair)) for pair in combinations(tri, 2)
+                   if labels[pair[0]] != labels[pair[1]]]
+        if len(crossed) == 2:
+            pair = tuple(sorted({labels[ii] for ii in tri}))
+            segments.setdefault(pair, []).append((crossed[0], crossed[1]))
+        elif len(crossed) == 3:
+            triple = ('triple',) + tuple(tri)
+            nodes[triple] = np.mean([crossings[edge] for edge in crossed],
+                                    axis=0)
+            for edge in crossed:
+                pair = tuple(sorted((labels[edge[0]], labels[edge[1]])))
+                segments.setdefault(pair, []).append((edge, triple))
+
+    lines = []
+    pairs = []
+    for pair, segs in segments.items():
+        neighbours = {}
+        for node_a, node_b in segs:
+            neighbours.setdefault(node_a, []).append(node_b)
+            neighbours.setdefault(node_b, []).append(node_a)
+        visited = set()
+        # Start at line ends first, then close the remaining loops.
+        ends = [node for node, nb in neighbours.items() if len(nb) == 1]
+        for start in ends + list(neighbours):
+            if start in visited:
+                continue
+            line = [start]
+            visited.add(start)
+            current = start
+            while True:
+                nxt = [node for node in neighbours[current]
+                       if node not in visited]
+                if not nxt:
+                    break
+                current = nxt[0]
+                visited.add(current)
+                line.append(current)
+            lines.append(np.array([nodes[node] for node in line]))
+            pairs.append(pair)
+    values = [lines, pairs]
+    return values
+
+
+def composition_diagram(flash, n, T, P, free=None, z_fixed=None, n_bisect=3,
+                        executor=None, n_chunks=8, alpha_min=1e-8, tol=1e-6,
+                        z_min=1e-6):
+    """Phase diagram over the composition simplex at one or more T and P
+
+    Parameters
+    ----------
+    flash : FlashController
+        Controller used for every flash
+    n : int
+        Number of lattice steps along each edge of the simplex
+    T : float, list, numpy array
+        Temperature in Kelvin of each diagram
+    P : float, list, numpy array
+        Pressure in bar of each diagram, with the same size as T
+    free : list, optional
+        Indices of the three or four components spanning the simplex,
+        all components by default
+    z_fixed : list, numpy array, optional
+        Total composition with size Nc, whose entries of the components
+        not in 'free' are held fixed, e.g. the water fraction
+    n_bisect : int
+        Number of bisections of each lattice edge crossing a boundary
+    executor : concurrent.futures.Executor, optional
+        If given, chunks of lattice points and of boundary edges are run
+        concurrently on the executor from a snapshot of 'flash'
+    n_chunks : int
+        Number of contiguous chunks of the lattice for the executor
+    alpha_min : float
+        Phase fraction above which a phase counts as present
+    tol : float
+        Error below which a flash counts as converged
+    z_min : float
+        Smallest fraction of a free component, which keeps the corners
+        and edges of the simplex away from absent components
+
+    Returns
+    ----------
+    diagram : dict
+        Arrays that can be stored with 'numpy.savez':
+        'phases' names of the phases of the label bits,
+        'T' and 'P' of each of the L diagrams,
+        'lattice' integer lattice points with size m x len(free),
+        'z' total compositions with size m x Nc,
+        'labels' and 'error' of each flash with size L x m,
+        'alpha' phase fractions with size L x m x Np,
+        'boundary_z' boundary crossings with size K x Nc together with
+        'boundary_layer' their diagram index and 'boundary_pairs' the
+        labels on both sides with size K x 2,
+        and for ternary diagrams the polylines as 'polyline_z' vertices
+        with size V x Nc, 'polyline_offsets' start of each polyline in
+        the vertices and the total with size lines + 1,
+        'polyline_layer' and 'polyline_pairs'.
+    """
+    Nc = flash.Nc
+    free = list(range(Nc)) if free is None else list(free)
+    dim = len(free)
+    z_base = np.zeros(Nc)
+    if z_fixed is not None:
+        fixed = [ii for ii in range(Nc) if ii not in free]
+        z_base[fixed] = np.asarray(z_fixed, dtype=float)[fixed]
+    z_free_total = 1.0 - np.sum(z_base)
+    T = np.atleast_1d(np.asarray(T, dtype=float))
+    P = np.atleast_1d(np.asarray(P, dtype=float))
+
+    lattice = simplex_lattice(dim, n)
+    frac = z_min + (1.0 - dim*z_min)*lattice/float(n)
+    Z = np.tile(z_base, (len(lattice), 1))
+    Z[:, free] = z_free_total*frac
+    edges = lattice_edges(lattice)
+    data = flash.snapshot() if executor is not None else None
+
+    def run(func, items, *args):
+        # Contiguous chunks keep neighbouring points on the same worker.
+        if executor is None:
+            return [func(flash, items, *args)]
+        chunks = [chunk for chunk in np.array_split(np.arange(len(items)),
+                                                    n_chunks) if len(chunk)]
+        futures = [executor.submit(func, data, [items[ii] for ii in chunk]
+                                   if isinstance(items, list)
+                                   else items[chunk], *args)
+                   for chunk in chunks]
+        return [future.result() for future in futures]
+
+    labels = np.zeros([len(T), len(lattice)], dtype=int)
+    alpha = np.zeros([len(T), len(lattice), flash.Np])
+    error = np.zeros([len(T), len(lattice)])
+    boundary = []
+    lines = []
+    for layer in range(len(T)):
+        results = run(flash_sequence, Z, T[layer], P[layer], alpha_min, tol)
+        labels[layer] = np.concatenate([res[0] for res in results])
+        alpha[layer] = np.concatenate([res[1] for res in results])
+        error[layer] = np.concatenate([res[2] for res in results])
+        states = sum([res[3] for res in results], [])
+
+        lab = labels[layer]
+        crossed = [(ii, jj) for ii, jj in edges
+                   if (lab[ii] != lab[jj]) and lab[ii] and lab[jj]]
+        items = [(Z[ii], Z[jj], states[ii], states[jj], lab[ii])
+                 for ii, jj in crossed]
+        t_cross = np.concatenate(
+            [np.zeros(0)] + run(bisect_edges, items, T[layer], P[layer],
+                                n_bisect, alpha_min, tol))
+        crossings = {}
+        for (ii, jj), t in zip(crossed, t_cross):
+            boundary.append((layer, (1.0 - t)*Z[ii] + t*Z[jj],
+                             sorted((lab[ii], lab[jj]))))
+            crossings[tuple(sorted((ii, jj)))] = ((1.0 - t)*lattice[ii]
+                                                  + t*lattice[jj])
+        if dim == 3:
+            # Failed points are left out of the boundary polylines.
+            lab_lines = np.where(lab > 0, lab, -1 - np.arange(len(lab)))
+            for edge in [tuple(sorted(pair)) for pair in edges
+                         if lab_lines[pair[0]] != lab_lines[pair[1]]]:
+                if edge not in crossings:
+                    crossings[edge] = 0.5*(lattice[edge[0]]
+                                           + lattice[edge[1]])
+            for line, pair in zip(*boundary_polylines(lattice, lab_lines,
+                                                      crossings)):
+                if min(pair) <= 0:
+                    continue
+                z_line = np.tile(z_base, (len(line), 1))
+                z_line[:, free] = z_free_total*(z_min + (1.0 - dim*z_min)
+                                                * line/float(n))
+                lines.append((layer, z_line, pair))
+
+    diagram = {'phases': np.array(flash.phases),
+               'T': T,
+               'P': P,
+               'lattice': lattice,
+               'z': Z,
+               'labels': labels,
+               'alpha': alpha,
+               'error': error,
+               'boundary_z': np.array([b[1] for b in boundary]).reshape(-1, Nc),
+               'boundary_layer': np.array([b[0] for b in boundary], dtype=int),
+               'boundary_pairs': np.array([b[2] for b in boundary],
+                                          dtype=int).reshape(-1, 2)}
+    if dim == 3:
+        offsets = np.cumsum([0] + [len(line[1]) for line in lines])
+        diagram.update({
+            'polyline_z': (np.concatenate([line[1] for line in lines])
+                           if lines else np.zeros([0, Nc])),
+            'polyline_offsets': offsets,
+            'polyline_layer': np.array([line[0] for line in lines],
+                                       dtype=int),
+            'polyline_pairs': np.array([line[2] for line in lines],
+                                       dtype=int).reshape(-1, 2)})
+    return diagram
@@ -0,0 +1,696 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Local flash service with request batching over a Unix or TCP socket
+
+Every simulator or notebook that builds its own 'FlashController' pays
+for the initialization of the equations of state and starts with empty
+caches. The class 'FlashServer' owns one warm controller per configured
+set of components and phases and answers flash requests from any number
+of local clients. Concurrent requests for the same system are coalesced
+into batches, which run on a thread or on a pool of worker processes
+that restore the controllers once from snapshots. Converged solutions
+are shared between batches and workers, so that each request can start
+from the nearest solution of any earlier request.
+
+Requests and responses are single lines of JSON. A flash request is
+
+    {"id": 1, "system": "name", "T": 280.0, "P": 70.0, "z": [0.9, 0.1]}
+
+with optional "strategies" passed to 'robust_flash'. The response holds
+the same id together with "phases", "alpha", "x", "error",
+"iterations", "strategy" and "converged", or "error_message" if the
+request failed. Responses of a connection may arrive out of order. The
+requests {"id": 1, "command": "systems"} and {"id": 1, "command":
+"stats"} list the configured systems and the server statistics.
+
+The server only listens on a Unix socket or on localhost, and requests
+are plain JSON, so no client can run code in the server.
+
+    Functions
+    ----------
+    init_worker :
+        Restore the controllers of all systems in a worker process
+    flash_batch :
+        Flash a batch of requests of one system
+    flash_request :
+        Flash a single request with a controller
+"""
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import flashalgorithm as fc
+import composition_diagram as cd
+
+
+"""Controllers of the systems in a worker process, keyed by system name"""
+worker_controllers = {}
+
+
+def init_worker(snapshots):
+    """Restore the controllers of all systems in a worker process
+
+    Parameters
+    ----------
+    snapshots : dict
+        Output of 'FlashController.snapshot' (values) of each system (keys)
+    """
+    for name, data in snapshots.items():
+        worker_controllers[name] = fc.FlashController.from_snapshot(data)
+
+
+def flash_batch(name, requests, cache, strategies, tol, flash=None):
+    """Flash a batch of requests of one system
+
+    Parameters
+    ----------
+    name : str
+        Name of the system
+    requests : list
+        Decoded flash requests
+    cache : list
+        Shared converged solutions, in the format of the solution cache
+        of 'FlashController', that serve as starts
+    strategies : tuple
+        Default strategies of 'robust_flash'
+    tol : float
+        Error below which a flash counts as converged
+    flash : FlashController, optional
+        Controller to use instead of the one of the worker process
+
+    Returns
+    ----------
+    values : list
+        values[0] : list
+            Response of each request
+        values[1] : list
+            Solutions converged in this batch
+
+    Notes
+    ----------
+    Module level so that it can be submitted to a process pool.
+    """
+    if flash is None:
+        flash = worker_controllers[name]
+    flash._solution_cache = list(cache)
+    n_cache = len(flash._solution_cache)
+    responses = [flash_request(flash, request, strategies, tol)
+                 for request in requests]
+    new_solutions = flash._solution_cache[n_cache:]
+    values = [responses, new_solutions]
+    return values
+
+
+def flash_request(flash, request, strategies, tol):
+    """Flash a single request with a controller
+
+    Parameters
+    ----------
+    flash : FlashController
+        Controller of the system of the request
+    request : dict
+        Decoded flash request with 'T', 'P' and 'z'
+    strategies : tuple
+        Strategies of 'robust_flash' if the request has none
+    tol : float
+        Error below which a flash counts as converged
+
+    Returns
+    ----------
+    response : dict
+        Result of the flash, or 'error_message' if it failed
+
+    Notes
+    ----------
+    A start from a previous solution that ends on a trivial solution
+    is repeated without the previous solutions, see 'trivial_state'.
+    """
+    response = {'id': request.get('id')}
+    try:
+        T = float(request['T'])
+        P = float(request['P'])
+        z = np.asarray(request['z'], dtype=float)
+        if z.shape != (flash.Nc,):
+            raise ValueError("""'z' must have one entry per component.""")
+        strategy_list = tuple(request.get('strategies', strategies))
+        out = flash.robust_flash(flash.compobjs, z, T, P,
+                                 strategies=strategy_list, tol=tol)
+        if (out[5] == 'nearest') and cd.trivial_state(flash,
+                                                      flash.calc_state()):
+            out = flash.robust_flash(flash.compobjs, z, T, P,
+                                     strategies=tuple(
+                                         s for s in strategy_list
+                                         if s != 'nearest'),
+                                     tol=tol)
+    except (KeyError, TypeError, ValueError, FloatingPointError,
+            np.linalg.LinAlgError) as err:
+        response['error_message'] = '{}: {}'.format(type(err).__name__, err)
+        return response
+
+    response.update({'phases': list(flash.phases),
+                     'alpha': out[1].tolist(),
+                     'x': out[0].tolist(),
+                     'error': float(out[4]),
+                     'iterations': int(out[3]),
+                     'strategy': out[5],
+                     'converged': out[5] is not None})
+    return response
+
+
+class FlashServer(object):
+    """Asyncio server that batches flash requests of local clients
+
+    Methods
+    ----------
+    start :
+        Listen on a Unix socket or a localhost TCP port
+    close :
+        Stop listening, remove the Unix socket and shut down the workers
+    serve_forever :
+        Start the server and handle requests until cancelled
+    start_thread :
+        Run the server on an event loop in a background thread
+    stop_thread :
+        Stop a server started with 'start_thread'
+    handle_client :
+        Read requests of a connection and write their responses
+    respond :
+        Response to a single decoded request
+    submit :
+        Queue a flash request and wait for its response
+    batcher :
+        Coalesce queued requests of a system into batches
+    run_batch :
+        Flash a batch on the executor and resolve its requests
+    """
+    def __init__(self, systems, n_workers=0, max_batch=16, batch_delay=0.002,
+                 strategies=('nearest', 'ideal', 'ref'), tol=1e-6,
+                 cache_size=256):
+        """Flash server of a set of configured systems
+
+        Parameters
+        ----------
+        systems : dict
+            Systems (values) by name (keys), each a FlashController or a
+            dict with 'components' and optionally 'phases'
+        n_workers : int
+            Number of worker processes. With 0, batches run on one thread
+            per system with the controllers of the server.
+        max_batch : int
+            Largest number of requests in a batch
+        batch_delay : float
+            Time in seconds that a batch waits for more requests after
+            its first one
+        strategies : tuple
+            Strategies of 'robust_flash' for requests without their own
+        tol : float
+            Error below which a flash counts as converged
+        cache_size : int
+            Number of shared converged solutions kept per system
+
+        Attributes
+        ----------
+        controllers : dict
+            FlashController of each system
+        caches : dict
+            Shared converged solutions of each system
+        executor : concurrent.futures.Executor
+            Executor on which the batches run, created by 'start'
+        stats : dict
+            Number of requests, flash requests, batches, failed requests
+            and the time spent in batches
+        """
+        self.controllers = {}
+        for name, system in systems.items():
+            if isinstance(system, fc.FlashController):
+                self.controllers[name] = system
+            else:
+                kwargs = {key: system[key] for key in ('phases', 'eos')
+                          if key in system}
+                self.controllers[name] = fc.FlashController(
+                    system['components'], **kwargs)
+        self.n_workers = n_workers
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.strategies = tuple(strategies)
+        self.tol = tol
+        self.cache_size = cache_size
+        self.caches = {name: [] for name in self.controllers}
+        self.executor = None
+        self.stats = {'requests': 0, 'flashes': 0, 'batches': 0,
+                      'failed': 0, 'time_batches': 0.0}
+        self._queues = {}
+        self._tasks = []
+        self._server = None
+        self._path = None
+        self._slots = None
+        self._loop = None
+        self._thread = None
+
+    async def start(self, path=None, host='127.0.0.1', port=0):
+        """Listen on a Unix socket or a localhost TCP port
+
+        Parameters
+        ----------
+        path : str, optional
+            Path of the Unix socket. If not given, the server listens on
+            TCP instead.
+        host : str
+            Local address for TCP
+        port : int
+            TCP port, 0 for any free port
+
+        Returns
+        ----------
+        address : str or tuple
+            Path of the Unix socket, or host and port for TCP
+        """
+        if host not in ('127.0.0.1', 'localhost', '::1'):
+            raise ValueError(host + """ is not a local address.""")
+        if self.n_workers > 0:
+            snapshots = {name: flash.snapshot()
+                         for name, flash in self.controllers.items()}
+            self.executor = ProcessPoolExecutor(self.n_workers,
+                                                initializer=init_worker,
+                                                initargs=(snapshots,))
+            slots = self.n_workers
+        else:
+            self.executor = ThreadPoolExecutor(len(self.controllers))
+            slots = 1
+        # Batches of a system in flight at once; a controller of the
+        # server is never used by two threads.
+        self._slots = {name: asyncio.Semaphore(slots)
+                       for name in self.controllers}
+        self._queues = {name: asyncio.Queue() for name in self.controllers}
+        self._tasks = [asyncio.ensure_future(self.batcher(name))
+                       for name in self.controllers]
+
+        if path is not None:
+            self._server = await asyncio.start_unix_server(
+                self.handle_client, path=path)
+            self._path = path
+            address = path
+        else:
+            self._server = await asyncio.start_server(
+                self.handle_client, host=host, port=port)
+            address = self._server.sockets[0].getsockname()[:2]
+        return address
+
+    async def close(self):
+        """Stop listening, remove the Unix socket and shut down the workers"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._path is not None:
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+            self._path = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def serve_forever(self, path=None, host='127.0.0.1', port=0):
+        """Start the server and handle requests until cancelled
+
+        Parameters
+        ----------
+        path : str, optional
+            Path of the Unix socket, see 'start'
+        host : str
+            Local address for TCP
+        port : int
+            TCP port
+        """
+        await self.start(path, host, port)
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    def start_thread(self, path=None, host='127.0.0.1', port=0,
+                     timeout=60.0):
+        """Run the server on an event loop in a background thread
+
+        Parameters
+        ----------
+        path : str, optional
+            Path of the Unix socket, see 'start'
+        host : str
+            Local address for TCP
+        port : int
+            TCP port
+        timeout : float
+            Time in seconds to wait for the server to start
+
+        Returns
+        ----------
+        address : str or tuple
+            Output of 'start'
+
+        Notes
+        ----------
+        Meant for notebooks and tests, in which the clients run in the
+        same process as the server.
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+        future = asyncio.run_coroutine_threadsafe(
+            self.start(path, host, port), self._loop)
+        return future.result(timeout)
+
+    def stop_thread(self, timeout=60.0):
+        """Stop a server started with 'start_thread'
+
+        Parameters
+        ----------
+        timeout : float
+            Time in seconds to wait for the server to close
+        """
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.close(),
+                                         self._loop).result(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+
+    async def handle_client(self, reader, writer):
+        """Read requests of a connection and write their responses
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+            Stream of request lines
+        writer : asyncio.StreamWriter
+            Stream of response lines
+
+        Notes
+        ----------
+        Each request is answered as soon as it is done, so that the
+        requests of one connection can share batches. A line longer than
+        the limit of the stream is answered with an error, after which
+        the connection is closed.
+        """
+        lock = asyncio.Lock()
+        pending = set()
+
+        async def send(response):
+            async with lock:
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+
+        async def answer(line):
+            await send(await self.respond(line))
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError) as err:
+                    self.stats['requests'] += 1
+                    self.stats['failed'] += 1
+                    await send({'id': None,
+                                'error_message': '{}: {}'.format(
+                                    type(err).__name__, err)})
+                    break
+                if not line:
+                    break
+                task = asyncio.ensure_future(answer(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for task in pending:
+                task.cancel()
+            writer.close()
+
+    async def respond(self, line):
+        """Response to a single decoded request
+
+        Parameters
+        ----------
+        line : bytes
+            One line of JSON
+
+        Returns
+        ----------
+        response : dict
+            Response of the request
+        """
+        self.stats['requests'] += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("""A request must be a JSON object.""")
+        except ValueError as err:
+            self.stats['failed'] += 1
+            return {'id': None, 'error_message': 'ValueError: ' + str(err)}
+
+        command = request.get('command', 'flash')
+        if command == 'systems':
+            response = {'id': request.get('id'),
+                        'systems': {name: {'components': list(flash.compname),
+                                           'phases': list(flash.phases)}
+                                    for name, flash
+                                    in self.controllers.items()}}
+        elif command == 'stats':
+            response = {'id': request.get('id'), 'stats': dict(self.stats)}
+        elif command != 'flash':
+            response = {'id': request.get('id'),
+                        'error_message': ('ValueError: ' + str(command)
+                                          + ' is not a valid command.')}
+        elif request.get('system') not in self.controllers:
+            response = {'id': request.get('id'),
+                        'error_message': ('ValueError: '
+                                          + str(request.get('system'))
+                                          + ' is not a configured system.')}
+        else:
+            response = await self.submit(request)
+        if 'error_message' in response:
+            self.stats['failed'] += 1
+        return response
+
+    async def submit(self, request):
+        """Queue a flash request and wait for its response
+
+        Parameters
+        ----------
+        request : dict
+            Decoded flash request with a configured 'system'
+
+        Returns
+        ----------
+        response : dict
+            Output of 'flash_request'
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[request['system']].put((request, future))
+        response = await future
+        return response
+
+    async def batcher(self, name):
+        """Coalesce queued requests of a system into batches
+
+        Parameters
+        ----------
+        name : str
+            Name of the system
+        """
+        queue = self._queues[name]
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0 and queue.empty():
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(
+                        queue.get(), max(remaining, 0)))
+                except asyncio.TimeoutError:
+                    break
+            await self._slots[name].acquire()
+            task = asyncio.ensure_future(self.run_batch(name, batch))
+            task.add_done_callback(lambda t: self._slots[name].release())
+
+    async def run_batch(self, name, batch):
+        """Flash a batch on the executor and resolve its requests
+
+        Parameters
+        ----------
+        name : str
+            Name of the system
+        batch : list
+            Requests and the futures of their responses
+        """
+        tstart = time.time()
+        requests = [request for request, future in batch]
+        flash = self.controllers[name] if self.n_workers == 0 else None
+        loop = asyncio.get_running_loop()
+        try:
+            responses, solutions = await loop.run_in_executor(
+                self.executor, flash_batch, name, requests,
+                list(self.caches[name]), self.strategies, self.tol, flash)
+        except Exception as err:
+            responses = [{'id': request.get('id'),
+                          'error_message': '{}: {}'.format(
+                              type(err).__name__, err)}
+                         for request in requests]
+            solutions = []
+        cache = self.caches[name]
+        cache.extend(solutions)
+        del cache[:max(len(cache) - self.cache_size, 0)]
+        self.stats['flashes'] += len(requests)
+        self.stats['batches'] += 1
+        self.stats['time_batches'] += time.time() - tstart
+        for (request, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
+
+
+class FlashClient(object):
+    """Blocking client of a 'FlashServer'
+
+    Methods
+    ----------
+    flash :
+        Flash a single point
+    flash_many :
+        Send many requests at once and collect their responses
+    command :
+        Send a command request
+    close :
+        Close the connection
+    """
+    def __init__(self, path=None, host='127.0.0.1', port=None, timeout=300.0):
+        """Connection to a flash server
+
+        Parameters
+        ----------
+        path : str, optional
+            Path of the Unix socket of the server
+        host : str
+            Local address of the server for TCP
+        port : int, optional
+            TCP port of the server, used if no path is given
+        timeout : float
+            Time in seconds to wait for a response
+        """
+        if path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(path)
+        else:
+            self.sock = socket.create_connection((host, port), timeout)
+        self.stream = self.sock.makefile('rwb')
+        self.next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def flash(self, system, T, P, z, **kwargs):
+        """Flash a single point
+
+        Parameters
+        ----------
+        system : str
+            Name of the system
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+        z : list, numpy array
+            Total composition with size Nc
+        kwargs : dict
+            Further fields of the request, e.g. 'strategies'
+
+        Returns
+        ----------
+        response : dict
+            Response of the server
+        """
+        request = dict(kwargs, system=system, T=T, P=P, z=z)
+        return self.flash_many([request])[0]
+
+    def flash_many(self, requests):
+        """Send many requests at once and collect their responses
+
+        Parameters
+        ----------
+        requests : list
+            Requests as dicts with 'system', 'T', 'P' and 'z', or
+            commands
+
+        Returns
+        ----------
+        responses : list
+            Response of each request in the order of the requests
+
+        Notes
+        ----------
+        All requests are sent before any response is read, so that the
+        server can batch them.
+        """
+        ids = []
+        for request in requests:
+            request = dict(request, id=self.next_id)
+            if 'z' in request:
+                request['z'] = np.asarray(request['z'], dtype=float).tolist()
+            ids.append(self.next_id)
+            self.next_id += 1
+            self.stream.write((json.dumps(request) + '\n').encode())
+        self.stream.flush()
+        received = {}
+        while len(received) < len(ids):
+            line = self.stream.readline()
+            if not line:
+                raise ConnectionError("""The server closed the
+                                      connection.""")
+            response = json.loads(line)
+            received[response.get('id')] = response
+        responses = [received[ii] for ii in ids]
+        return responses
+
+    def command(self, command):
+        """Send a command request
+
+        Parameters
+        ----------
+        command : str
+            'systems' or 'stats'
+
+        Returns
+        ----------
+        response : dict
+            Response of the server
+        """
+        return self.flash_many([{'command': command}])[0]
+
+    def close(self):
+        """Close the connection"""
+        self.stream.close()
+        self.sock.close()
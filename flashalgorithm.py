@@ -11,10 +11,16 @@ of CSMGem.
     ----------
     stability func :
         Calculation of phase stability compatibility
+    phase_split_terms :
+        Intermediate quantities shared by the objective function and jacobian
     objective :
         Calculation to determine objective function that must be minimized
     jacobian :
         Calculation to determine jacobian of objective function that must be minimized
+    schur_step :
+        Newton step of the alpha/theta system with the stability rows eliminated
+    schur_inverse :
+        Inverse of the alpha/theta jacobian for reuse across iterations
     ideal_LV :
         Calculation of ideal partition coefficients between liquid and vapor phases
     ideal_VAq :
@@ -27,16 +33,32 @@ of CSMGem.
         Calculation of ideal partition coefficients between vapor and structure 2 hydrate phases
     make_ideal_K_allmat :
         Use ideal partition coefficient functions to construct a matrix of coefficients
+    ideal_params :
+        Cached per-component constants of the ideal partition coefficient correlations
+    ideal_arrays :
+        Broadcast temperature, pressure and component constants together
+    correlation_sum :
+        Sum of correlation coefficients times temperature/pressure terms
+    water_VAq :
+        Ideal partition coefficient of water between vapor and aqueous phases
+    water_IceAq :
+        Ideal partition coefficient of water between ice and aqueous phases
+    compile_K_transform :
+        Compile 'K_transform' into column exponents of the ideal coefficient matrix
+    flash_attempt :
+        Restore a controller snapshot and run one flash attempt
 
 """
 import numpy as np
+import pickle
 import time
+from concurrent.futures import as_completed
 
 import component_properties as cp
 import aq_hb_eos as aq
 import h_vdwpm_eos as h
 import vlhc_srk_eos as hc
-import pdb
+import rachford_rice as rr
 
 """Mapping from columns of K_all_mat to corresponding partition coefficient
 First phase is numerator, second phase is denominator"""
@@ -92,6 +114,35 @@ def stability_func(alpha, theta):
     """
     return alpha * theta / (alpha + theta)
 
+def phase_split_terms(z, alpha, theta, K):
+    """Intermediate quantities shared by the objective and jacobian
+
+    Parameters
+    ----------
+    z : numpy array
+        Total composition of each component with size Nc
+    alpha : numpy array
+        Molar phase fractions with size Np
+    theta : numpy array
+        Stability of phases with size Np
+    K : numpy array
+        Partition coefficients for each component
+        in each phase with size Nc x Np
+
+    Returns
+    ----------
+    K_exp : numpy array
+        Stability-scaled partition coefficients, K*exp(theta), with size Nc x Np
+    stability_mat : numpy array
+        K*exp(theta) - 1 with size Nc x Np
+    denominator : numpy array
+        Rachford-Rice denominator of each component with size Nc
+    """
+    K_exp = K * np.exp(theta[np.newaxis, :])
+    stability_mat = K_exp - 1.0
+    denominator = 1.0 + np.matmul(stability_mat, alpha)
+    return K_exp, stability_mat, denominator
+
 def objective(z, alpha, theta, K):
     """Objective function to be minimized
 
@@ -121,17 +172,13 @@ def objective(z, alpha, theta, K):
     if type(K) != np.ndarray:
         K = np.asarray(K)
 
-    numerator = z[:, np.newaxis] * (K * np.exp(theta[np.newaxis, :]) - 1)
-    denominator = 1 + np.sum(
-        alpha[np.newaxis, :]
-        * (K * np.exp(theta[np.newaxis, :]) - 1),
-        axis=1)
-    e_cost = np.sum(numerator / denominator[:, np.newaxis], axis=0)
+    K_exp, stability_mat, denominator = phase_split_terms(z, alpha, theta, K)
+    e_cost = np.matmul(z / denominator, stability_mat)
     y_cost = stability_func(alpha, theta)
     cost = np.concatenate((e_cost, y_cost))
     return cost
 
-def jacobian(z, alpha, theta, K):
+def jacobian(z, alpha, theta, K, blocks=False):
     """Jacobian of objective function to be minimized
 
     Parameters
@@ -145,11 +192,24 @@ def jacobian(z, alpha, theta, K):
     K : list, numpy array
         Partition coefficients for each component
         in each phase with size Nc x Np
+    blocks : bool
+        Flag for returning the four blocks of the jacobian instead
+        of the assembled matrix
 
     Returns
     ----------
     jacobian : numpy array
         Jacobian matrix of objective function of size 2*Np x 2 *Np
+        If 'blocks' is True, a tuple of the dense Np x Np blocks
+        (jac_alpha, jac_theta) and the diagonals of size Np of the
+        stability rows (jac_alpha_y, jac_theta_y)
+
+    Notes
+    ----------
+    The dense blocks are formed as matrix products over components,
+    jac_alpha = -S^T W S and jac_theta = -S^T W K_exp diag(alpha) + diag(d),
+    where W = diag(z/denominator^2), so no Nc x Np x Np intermediates
+    are needed. The stability rows are purely diagonal.
     """
     if type(z) != np.ndarray:
         z = np.asarray(z)
@@ -160,49 +220,201 @@ def jacobian(z, alpha, theta, K):
     if type(K) != np.ndarray:
         K = np.asarray(K)
 
+    K_exp, stability_mat, denominator = phase_split_terms(z, alpha, theta, K)
+    weighted_mat = stability_mat * (z / denominator**2)[:, np.newaxis]
+    jac_alpha = -np.matmul(weighted_mat.T, stability_mat)
+    jac_theta = -np.matmul(weighted_mat.T, K_exp) * alpha[np.newaxis, :]
+    jac_theta[np.diag_indices_from(jac_theta)] += np.matmul(
+        z / denominator, K_exp)
+    jac_alpha_y = theta**2 / (alpha + theta)**2
+    jac_theta_y = alpha**2 / (alpha + theta)**2
+    if blocks:
+        return jac_alpha, jac_theta, jac_alpha_y, jac_theta_y
 
-    stability_mat = (K*np.exp(theta[np.newaxis, :]) - 1.0)
-    alpha_numerator = (
-        z[:, np.newaxis, np.newaxis]
-        * stability_mat[:, :, np.newaxis]
-        * stability_mat[:, np.newaxis, :])
-    theta_numerator = (
-        z[:, np.newaxis, np.newaxis]
-        * stability_mat[:, :, np.newaxis]
-        * K[:, np.newaxis,:]
-        * alpha[np.newaxis, np.newaxis, :]
-        * np.exp(theta[np.newaxis, np.newaxis, :]))
-    denominator = (
-        1.0 + (np.sum(alpha[np.newaxis, :]
-                      * stability_mat,
-                      axis=1))
-        )**2
-    jac_alpha = -np.sum(
-        alpha_numerator / denominator[:, np.newaxis, np.newaxis],
-        axis = 0)
-    jac_theta = -np.sum(
-        theta_numerator / denominator[:, np.newaxis, np.newaxis],
-        axis = 0)
-    diag_denom = 1.0 + np.sum((K * np.exp(theta[np.newaxis, :]) - 1.0)
-                               * alpha[np.newaxis, :],
-                              axis=1)
-    diag = np.sum(z[:, np.newaxis] * K * np.exp(theta[np.newaxis, :])
-                  / diag_denom[:, np.newaxis],
-                  axis=0)
-    jac_theta += np.diag(diag)
     jac_cost = np.concatenate((jac_alpha, jac_theta), axis=1)
-    jac_alpha_y = (theta/(alpha + theta)
-                          - alpha*theta/(alpha + theta)**2)
-    jac_theta_y = (alpha/(alpha + theta)
-                          - alpha*theta/(alpha + theta)**2)
     jac_stability = np.concatenate((np.diag(jac_alpha_y),
                                     np.diag(jac_theta_y)),
                                     axis=1)
     jacobian = np.concatenate((jac_cost, jac_stability), axis=0)
     return jacobian
 
+def schur_step(jac_alpha, jac_theta, jac_alpha_y, jac_theta_y,
+               e_cost, y_cost):
+    """Newton step of the alpha/theta system via a Schur complement
+
+    Parameters
+    ----------
+    jac_alpha : numpy array
+        Derivative of the phase-split residual wrt alpha with size n x n
+    jac_theta : numpy array
+        Derivative of the phase-split residual wrt theta with size n x n
+    jac_alpha_y : numpy array
+        Diagonal derivative of the stability residual wrt alpha with size n
+    jac_theta_y : numpy array
+        Diagonal derivative of the stability residual wrt theta with size n
+    e_cost : numpy array
+        Phase-split residual with size n, or n x m for m right-hand sides
+    y_cost : numpy array
+        Stability residual with size n, or n x m for m right-hand sides
+
+    Returns
+    ----------
+    step : list
+        step[0] : numpy array
+            Change in alpha with size n (or n x m)
+        step[1] : numpy array
+            Change in theta with size n (or n x m)
+
+    Notes
+    ----------
+    The stability rows only couple alpha_j and theta_j of the same phase,
+    so each phase keeps one unknown, whichever of alpha_j or theta_j has
+    the larger diagonal, and the other is eliminated. This leaves an
+    n x n dense system instead of a 2n x 2n one. The pseudo-inverse is
+    kept so that coincident phases (e.g., vapor and lhc on the trivial
+    solution) still produce a minimum-norm step.
+    """
+    keep_alpha = jac_theta_y >= jac_alpha_y
+    pivot = np.where(keep_alpha, jac_theta_y, jac_alpha_y)
+    coupling = np.where(keep_alpha, jac_alpha_y, jac_theta_y) / pivot
+
+    # d_alpha = a_const + a_coef*v and d_theta = t_const + t_coef*v
+    a_coef = np.where(keep_alpha, 1.0, -coupling)
+    t_coef = np.where(keep_alpha, -coupling, 1.0)
+    schur_mat = jac_alpha * a_coef[np.newaxis, :] + jac_theta * t_coef[np.newaxis, :]
+
+    if np.ndim(y_cost) > 1:
+        keep_alpha = keep_alpha[:, np.newaxis]
+        pivot = pivot[:, np.newaxis]
+        a_coef = a_coef[:, np.newaxis]
+        t_coef = t_coef[:, np.newaxis]
+    offset = -y_cost / pivot
+    a_const = np.where(keep_alpha, 0.0, offset)
+    t_const = np.where(keep_alpha, offset, 0.0)
+    rhs = -e_cost - np.matmul(jac_alpha, a_const) - np.matmul(jac_theta, t_const)
+    v = np.matmul(np.linalg.pinv(schur_mat), rhs)
+    step = [a_const + a_coef * v, t_const + t_coef * v]
+    return step
+
+def schur_inverse(jac_alpha, jac_theta, jac_alpha_y, jac_theta_y):
+    """Inverse of the alpha/theta jacobian formed through 'schur_step'
+
+    Parameters
+    ----------
+    jac_alpha : numpy array
+        Derivative of the phase-split residual wrt alpha with size n x n
+    jac_theta : numpy array
+        Derivative of the phase-split residual wrt theta with size n x n
+    jac_alpha_y : numpy array
+        Diagonal derivative of the stability residual wrt alpha with size n
+    jac_theta_y : numpy array
+        Diagonal derivative of the stability residual wrt theta with size n
+
+    Returns
+    ----------
+    jac_inv : numpy array
+        Inverse jacobian with size 2n x 2n, ordered as (alpha, theta) for
+        rows and (phase-split, stability) residuals for columns, such
+        that the Newton step is -jac_inv.dot(residual)
+    """
+    n = len(jac_alpha_y)
+    identity = np.eye(n)
+    zeros = np.zeros([n, n])
+    da_e, dt_e = schur_step(jac_alpha, jac_theta, jac_alpha_y, jac_theta_y,
+                            identity, zeros)
+    da_y, dt_y = schur_step(jac_alpha, jac_theta, jac_alpha_y, jac_theta_y,
+                            zeros, identity)
+    jac_inv = -np.block([[da_e, da_y], [dt_e, dt_y]])
+    return jac_inv
+
 
 #TODO: Convert all the ideal stuff into a separate class.
+"""Per-component constants of the ideal partition coefficient correlations,
+cached by component names"""
+ideal_param_cache = {}
+
+"""Exponents of the columns of K_all_mat for each phase, compiled from
+K_transform and cached by reference phase and phases"""
+K_exponent_cache = {}
+
+
+def ideal_params(compobjs, ndim=0):
+    """Constants of the ideal partition coefficient correlations as arrays
+
+    Parameters
+    ----------
+    compobjs : list, tuple
+        List of components
+    ndim : int
+        Number of trailing axes of length 1 added to each array so that
+        it broadcasts against temperature and pressure arrays
+
+    Returns
+    ----------
+    params : dict
+        Arrays over components of the constants used by the ideal
+        partition coefficient correlations. 'Hs1' and 'Hs2' hold the
+        hydrate coefficients with size 13 x Nc and 19 x Nc.
+    """
+    key = (tuple(comp.compname for comp in compobjs), ndim)
+    if key not in ideal_param_cache and ndim > 0:
+        new_axes = (1,) * ndim
+        ideal_param_cache[key] = {
+            name: value.reshape(value.shape + new_axes)
+            for name, value in ideal_params(compobjs).items()}
+    elif key not in ideal_param_cache:
+        water = np.array([comp.compname == 'h2o' for comp in compobjs])
+        params = {'water': water,
+                  'Pc': np.array([comp.Pc for comp in compobjs]),
+                  'Tc': np.array([comp.Tc for comp in compobjs]),
+                  'omega': np.array([comp.SRK['omega'] for comp in compobjs]),
+                  'N_carb': np.array([comp.N_carb for comp in compobjs],
+                                     dtype=float)}
+        for hyd, n_coef in (('Hs1', 13), ('Hs2', 19)):
+            params[hyd] = np.array(
+                [[np.nan if is_water else comp.ideal[hyd]['a' + str(jj)]
+                  for comp, is_water in zip(compobjs, water)]
+                 for jj in range(1, n_coef + 1)])
+        ideal_param_cache[key] = params
+    return ideal_param_cache[key]
+
+
+def ideal_arrays(compobjs, T, P):
+    """Broadcast temperature, pressure and component constants together
+
+    Parameters
+    ----------
+    compobjs : list, tuple
+        List of components
+    T : float, numpy array
+        Temperature in Kelvin
+    P : float, numpy array
+        Pressure in bar
+
+    Returns
+    ----------
+    values : list
+        values[0] : float, numpy array
+            Temperature, with size 1 x S for arrays, where S is the
+            broadcast shape of T and P
+        values[1] : float, numpy array
+            Pressure, with size 1 x S for arrays
+        values[2] : dict
+            Output of 'ideal_params' with each array shaped to
+            broadcast against T and P
+    """
+    if not hasattr(compobjs, '__iter__'):
+        compobjs = [compobjs]
+    if np.ndim(T) == 0 and np.ndim(P) == 0:
+        values = [float(T), float(P), ideal_params(compobjs)]
+    else:
+        T, P = np.broadcast_arrays(np.asarray(T, dtype=float),
+                                   np.asarray(P, dtype=float))
+        values = [T[np.newaxis], P[np.newaxis],
+                  ideal_params(compobjs, T.ndim)]
+    return values
+
+
 def ideal_LV(compobjs, T, P):
     """Ideal partition coefficients for liquid and vapor phases
 
@@ -210,29 +422,59 @@ def ideal_LV(compobjs, T, P):
     ----------
     compobjs : list, tuple
         List of components
-    T : float
+    T : float, numpy array
         Temperature in Kelvin
-    P : float
+    P : float, numpy array
         Pressure in bar
 
     Returns
     ----------
     K : numpy array
-        Array of partition coefficients for each component
+        Array of partition coefficients for each component with size Nc,
+        or Nc x S for arrays of T and P with broadcast shape S
     """
+    T, P, prm = ideal_arrays(compobjs, T, P)
+    K = np.where(prm['water'],
+                 (-133.67 + 0.63288*T)/P + 3.19211e-3*P,
+                 (prm['Pc']/P)
+                 * np.exp(5.373*(1.0 + prm['omega'])*(1 - prm['Tc']/T)))
+    return K
 
-    if not hasattr(compobjs, '__iter__'):
-        compobjs = [compobjs]
 
-    K = np.ones([len(compobjs)])
-    for ii, comp in enumerate(compobjs):
-        if comp.compname != 'h2o':
-            K[ii] = ((comp.Pc/P)
-                     * np.exp(5.373*(1.0 + comp.SRK['omega'])
-                              *(1 - comp.Tc/T)))
-        else:
-            K[ii] = (-133.67 + 0.63288*T)/P + 3.19211e-3*P
-    return K
+def correlation_sum(coefs, terms):
+    """Sum of correlation coefficients times temperature/pressure terms
+
+    Parameters
+    ----------
+    coefs : numpy array
+        Coefficients with size Nt x Nc, with trailing axes of length 1
+        when 'terms' comes from arrays of T and P
+    terms : numpy array
+        Terms of the correlation with size Nt, or Nt x 1 x S for arrays
+        of T and P with broadcast shape S
+
+    Returns
+    ----------
+    total : numpy array
+        Sum over terms with size Nc, or Nc x S
+    """
+    if terms.ndim == 1:
+        return np.dot(terms, coefs)
+    return np.sum(coefs * terms, axis=0)
+
+
+def water_VAq(T, P):
+    """Ideal partition coefficient of water between vapor and aqueous phases"""
+    return np.exp(12.048399 - 4030.18425/(T + -38.15))/P
+
+
+def water_IceAq(T, P):
+    """Ideal partition coefficient of water between ice and aqueous phases"""
+    T_0 = 273.1576
+    P_0 = 6.11457e-3
+    T_ice = T_0 - 7.404e-3*(P - P_0) - 1.461e-6*(P - P_0)**2
+    xw_aq = 1 + 8.33076e-3*(T - T_ice) + 3.91416e-5*(T - T_ice)**2
+    return 1.0/xw_aq
 
 
 def ideal_VAq(compobjs, T, P):
@@ -242,34 +484,24 @@ def ideal_VAq(compobjs, T, P):
     ----------
     compobjs : list, tuple
         List of components
-    T : float
+    T : float, numpy array
         Temperature in Kelvin
-    P : float
+    P : float, numpy array
         Pressure in bar
 
     Returns
     ----------
     K : numpy array
-        Array of partition coefficients for each component
+        Array of partition coefficients for each component with size Nc,
+        or Nc x S for arrays of T and P with broadcast shape S
     """
-    if not hasattr(compobjs, '__iter__'):
-        compobjs = [compobjs]
-
-    K = np.ones([len(compobjs)])
-
-    for ii, comp in enumerate(compobjs):
-        if comp.compname != 'h2o':
-            gamma_inf = np.exp(0.688 - 0.642*comp.N_carb)
-            a1 = (5.927140 - 6.096480*(comp.Tc/T)
-                  - 1.288620*np.log(T/comp.Tc) + 0.169347*T**6/comp.Tc**6)
-
-            a2 = (15.25180 - 15.68750*(comp.Tc/T)
-                  - 13.47210*np.log(T/comp.Tc) + 0.43577*T**6/comp.Tc**6)
-            P_sat = comp.Pc*np.exp(a1 + comp.SRK['omega']*a2)
-        else:
-            gamma_inf = 1.0
-            P_sat = np.exp(12.048399 - 4030.18425/(T + -38.15))
-        K[ii] = (P_sat/P)*gamma_inf
+    T, P, prm = ideal_arrays(compobjs, T, P)
+    Tr = T/prm['Tc']
+    gamma_inf = np.exp(0.688 - 0.642*prm['N_carb'])
+    a1 = 5.927140 - 6.096480/Tr - 1.288620*np.log(Tr) + 0.169347*Tr**6
+    a2 = 15.25180 - 15.68750/Tr - 13.47210*np.log(Tr) + 0.43577*Tr**6
+    P_sat = prm['Pc']*np.exp(a1 + prm['omega']*a2)
+    K = np.where(prm['water'], water_VAq(T, P), (P_sat/P)*gamma_inf)
     return K
 
 
@@ -280,29 +512,19 @@ def ideal_IceAq(compobjs, T, P):
     ----------
     compobjs : list, tuple
         List of components
-    T : float
+    T : float, numpy array
         Temperature in Kelvin
-    P : float
+    P : float, numpy array
         Pressure in bar
 
     Returns
     ----------
     K : numpy array
-        Array of partition coefficients for each component
+        Array of partition coefficients for each component with size Nc,
+        or Nc x S for arrays of T and P with broadcast shape S
     """
-    if not hasattr(compobjs, '__iter__'):
-        compobjs = [compobjs]
-
-    K = np.ones([len(compobjs)])
-    for ii, comp in enumerate(compobjs):
-        if comp.compname != 'h2o':
-            K[ii] = 0
-        else:
-            T_0 = 273.1576
-            P_0 = 6.11457e-3
-            T_ice = T_0 - 7.404e-3*(P - P_0) - 1.461e-6*(P - P_0)**2
-            xw_aq = 1 + 8.33076e-3*(T - T_ice) + 3.91416e-5*(T - T_ice)**2
-            K[ii] = 1.0/xw_aq
+    T, P, prm = ideal_arrays(compobjs, T, P)
+    K = np.where(prm['water'], water_IceAq(T, P), 0.0)
     return K
 
 
@@ -313,33 +535,28 @@ def ideal_VHs1(compobjs, T, P):
     ----------
     compobjs : list, tuple
         List of components
-    T : float
+    T : float, numpy array
         Temperature in Kelvin
-    P : float
+    P : float, numpy array
         Pressure in bar
 
     Returns
     ----------
     K : numpy array
-        Array of partition coefficients for each component
+        Array of partition coefficients for each component with size Nc,
+        or Nc x S for arrays of T and P with broadcast shape S
     """
-    if not hasattr(compobjs, '__iter__'):
-        compobjs = [compobjs]
-
-    K = np.ones([len(compobjs)])
-    for ii, comp in enumerate(compobjs):
-        if comp.compname != 'h2o':
-            s = comp.ideal['Hs1']
-            K_wf = np.exp(
-                    s['a1'] + s['a2']*np.log(P) + s['a3']*np.log(P)**2
-                    - (s['a4'] + s['a5']*np.log(P) + s['a6']*np.log(P)**2
-                       + s['a7']*np.log(P)**3)/T
-                    + s['a8']/P + s['a9']/P**2 + s['a10']*T + s['a11']*P
-                    + s['a12']*np.log(P/T**2) + s['a13']/T**2)
-            K[ii] = K_wf/(1 - 0.88)
-        else:
-            K[ii] = (ideal_VAq(comp, T, P)
-                     / (0.88 * ideal_IceAq(comp, T, P)))
+    T, P, prm = ideal_arrays(compobjs, T, P)
+    lnP = np.log(P)
+    one = np.ones_like(T)
+    terms = np.array([one, lnP, lnP**2,
+                      -one/T, -lnP/T, -lnP**2/T, -lnP**3/T,
+                      one/P, one/P**2, T, P,
+                      np.log(P/T**2), one/T**2])
+    K_wf = np.exp(correlation_sum(prm['Hs1'], terms))
+    K = np.where(prm['water'],
+                 water_VAq(T, P)/(0.88*water_IceAq(T, P)),
+                 K_wf/(1 - 0.88))
     return np.abs(K)
 
 
@@ -350,37 +567,33 @@ def ideal_VHs2(compobjs, T, P):
     ----------
     compobjs : list, tuple
         List of components
-    T : float
+    T : float, numpy array
         Temperature in Kelvin
-    P : float
+    P : float, numpy array
         Pressure in bar
 
     Returns
     ----------
     K : numpy array
-        Array of partition coefficients for each component
+        Array of partition coefficients for each component with size Nc,
+        or Nc x S for arrays of T and P with broadcast shape S
     """
-    if not hasattr(compobjs, '__iter__'):
-        compobjs = [compobjs]
-
-    K = np.ones([len(compobjs)])
-    T_Kelvin = T
-    T = T*9.0/5.0 - 459.67
-    for ii, comp in enumerate(compobjs):
-        if comp.compname != 'h2o':
-            s = comp.ideal['Hs2']
-            K_wf = np.exp(
-                    s['a1'] + s['a2']*T + s['a3']*P + s['a4']/T
-                    + s['a5']/P + s['a6']*T*P + s['a6']*T**2
-                    + s['a8']*P**2 + s['a9']*P/T + s['a10']*np.log(P/T)
-                    + s['a11']/P**2 + s['a12']*T/P + s['a13']*T**2/P
-                    + s['a14']*P/T**2 + s['a15']*T/P**3 + s['a16']*T**3
-                    + s['a17']*P**3/T**2 + s['a18']*T**4
-                    + s['a19']*np.log(P))
-            K[ii] = K_wf/(1 - 0.90)
-        else:
-            K[ii] = (ideal_VAq(comp, T_Kelvin, P)
-                     / (0.90 * ideal_IceAq(comp, T_Kelvin, P)))
+    T_Kelvin, P, prm = ideal_arrays(compobjs, T, P)
+    T = T_Kelvin*9.0/5.0 - 459.67
+    one = np.ones_like(T)
+    # The sixth coefficient multiplies both T*P and T**2 and the seventh
+    # is unused, as in the original correlation code.
+    terms = np.array([one, T, P, one/T,
+                      one/P, T*P + T**2, 0*one,
+                      P**2, P/T, np.log(P/T),
+                      one/P**2, T/P, T**2/P,
+                      P/T**2, T/P**3, T**3,
+                      P**3/T**2, T**4,
+                      np.log(P)])
+    K_wf = np.exp(correlation_sum(prm['Hs2'], terms))
+    K = np.where(prm['water'],
+                 water_VAq(T_Kelvin, P)/(0.90*water_IceAq(T_Kelvin, P)),
+                 K_wf/(1 - 0.90))
     return K
 
 
@@ -391,27 +604,108 @@ def make_ideal_K_allmat(compobjs, T, P):
     ----------
     compobjs : list, tuple
         List of components
-    T : float
+    T : float, numpy array
         Temperature in Kelvin
-    P : float
+    P : float, numpy array
         Pressure in bar
 
     Returns
     ----------
     K_all_mat : numpy array
         Matrix of all possible partition coefficients for each component
+        with size Nc x 5, or Nc x 5 x S for arrays of T and P with
+        broadcast shape S
     """
     if not hasattr(compobjs, '__iter__'):
         compobjs = [compobjs]
-    K_all_mat = np.zeros([len(compobjs), 5])
-    K_all_mat[:, 0] = ideal_LV(compobjs, T, P)
-    K_all_mat[:, 1] = ideal_VAq(compobjs, T, P)
-    K_all_mat[:, 2] = ideal_VHs1(compobjs, T, P)
-    K_all_mat[:, 3] = ideal_VHs2(compobjs, T, P)
-    K_all_mat[:, 4] = ideal_IceAq(compobjs, T, P)
+    K_all_mat = np.stack([ideal_LV(compobjs, T, P),
+                          ideal_VAq(compobjs, T, P),
+                          ideal_VHs1(compobjs, T, P),
+                          ideal_VHs2(compobjs, T, P),
+                          ideal_IceAq(compobjs, T, P)], axis=1)
     return K_all_mat
 
 
+def compile_K_transform(ref_phase, phases):
+    """Exponents that turn K_all_mat into partition coefficients
+
+    Parameters
+    ----------
+    ref_phase : str
+        Name of the reference phase
+    phases : list, tuple
+        Phases of the returned partition coefficient matrix
+
+    Returns
+    ----------
+    exponents : numpy array
+        Exponent of each column of K_all_mat for each phase with
+        size 5 x Np, such that K_j = prod(K_all_mat**exponents[:, j])
+
+    Notes
+    ----------
+    'K_transform' tuples are a numerator and a denominator, each either
+    a column, a tuple of columns that are multiplied, or 9 for the value
+    1. The result is cached per reference phase and phases.
+    """
+    key = (ref_phase, tuple(phases))
+    if key not in K_exponent_cache:
+        def add_term(exponent, term, sign):
+            if type(term) is int:
+                if term != 9:
+                    exponent[term] += sign
+            else:
+                for col in term:
+                    add_term(exponent, col, sign)
+
+        exponents = np.zeros([len(K_dict), len(phases)])
+        for ii, phase in enumerate(phases):
+            trans_tuple = K_transform[ref_phase][phase]
+            if type(trans_tuple) is int:
+                add_term(exponents[:, ii], trans_tuple, 1)
+            else:
+                add_term(exponents[:, ii], trans_tuple[0], 1)
+                add_term(exponents[:, ii], trans_tuple[1], -1)
+        exponents.setflags(write=False)
+        K_exponent_cache[key] = exponents
+    return K_exponent_cache[key]
+
+
+def flash_attempt(data, z, T, P, kwargs):
+    """Restore a controller snapshot and run one flash attempt
+
+    Parameters
+    ----------
+    data : bytes
+        Output of 'FlashController.snapshot'
+    z : list, tuple, numpy array
+        Molar composition of each component
+    T : float
+        Temperature in Kelvin
+    P : float
+        Pressure in bar
+    kwargs : dict
+        Passed to 'main_handler'
+
+    Returns
+    ----------
+    values : list
+        values[0] : list
+            Output of 'main_handler'
+        values[1] : dict
+            Output of 'calc_state' after the attempt
+
+    Notes
+    ----------
+    Module level so that it can be submitted to a process pool by
+    'FlashController.robust_flash'.
+    """
+    flash = FlashController.from_snapshot(data)
+    out = flash.main_handler(flash.compobjs, z, T, P, **kwargs)
+    values = [out, flash.calc_state()]
+    return values
+
+
 class FlashController(object):
     """Flash calculation and auxiliary components
 
@@ -426,6 +720,8 @@ class FlashController(object):
     eos_default : dict
         Dictionary setting default eos (values) for each possible
         phase (key).
+    snapshot_version : int
+        Format version of the output of 'snapshot'.
     """
     phase_menu = {'aqueous': ('aqueous', 'aq', 'water', 'liquid'),
                   'vapor': ('vapor', 'v', 'gas', 'vaporhc', 'hc'),
@@ -452,6 +748,8 @@ class FlashController(object):
                  's2': 'hvdwpm',
                  'ice': 'ice'}
 
+    snapshot_version = 2
+
 
     def __init__(self,
                  components,
@@ -518,30 +816,95 @@ class FlashController(object):
             Array of molar phase fraction of each phase with size Np
         theta_calc : numpy array
             Array of phase stability of each phase with size Np
+        T_calc : float
+            Temperature in Kelvin of the last flash
+        active_phases : numpy array
+            Boolean array with size Np of phases that are not frozen
+        K_frozen : numpy array
+            Partition coefficients held fixed for frozen phases with size Nc x Np
+        eos_current : numpy array
+            Boolean array with size Np of phases whose eos state matches 'x_calc'
+        robust_info : dict
+            Winning strategy and record of attempts of the last
+            'robust_flash' or 'multistart_flash'
 
         Methods
         ----------
         set_feed :
             Take a list or array of size Nc and set the
             total composition such sum(z) == 1
+        snapshot :
+            Serialize the initialized controller for fast restoring
+        from_snapshot :
+            Restore a controller from the output of 'snapshot'
         set_ref_index :
             Determine the index within self.phases of the new reference phases
         set_phases :
             Re-assign phases from a list based argument of phase types
         change_ref_phase :
-            Cycles through possible unused reference phases
+            Switches to the most abundant unused reference phase and re-bases K, alpha and theta
+        merge_hc_phases :
+            Combine vapor and liquid hydrocarbon phases of equal composition
         main_handler :
             Primary method for calculation logic
+        ph_flash :
+            Flash at fixed pressure and enthalpy
+        robust_flash :
+            Flash that retries alternative starts until one converges
+        multistart_flash :
+            Flash from several starts that keeps the lowest gibbs energy
+        flash_attempts :
+            Starting points of 'robust_flash' and 'multistart_flash'
+        run_attempts :
+            Run flash attempts sequentially or on an executor
+        cache_solution :
+            Store the last converged flash as a start for later attempts
+        gibbs_energy :
+            Gibbs energy of the mixture from a flash result
+        hydrate_stability :
+            Stability margin of each hydrate phase without a full flash
+        locate_boundary :
+            Phase boundary on the line between two states
+        invariant_point :
+            Temperature and pressure at which a set of phases coexists
+        calc_state :
+            Copy of the result of the last flash
+        restore_calc_state :
+            Set the result of a flash from the output of 'calc_state'
         calc_x :
             Calculation of composition for auxiliary variables
         calc_K :
             Calculation of partition coefficients using output of fugacity calculations
         calc_fugacity :
             Calculation of fugacity of each component in each phase
+        ref_masks :
+            Cached masks that exclude the reference phase from the alpha/theta system
+        freeze_phases :
+            Remove clearly unstable phases from the active set
+        recheck_frozen :
+            Update frozen phases and release those that may become stable
+        phase_fugacity :
+            Calculation of fugacity of each component in a single phase
         find_alphatheta_min :
             Calculation that performs minimization of objective function at fixed x and K
+        fixed_K_split :
+            Phase split at fixed K without a starting point from 'rachford_rice'
+        newton_system :
+            Residual and jacobian of the simultaneous alpha, theta and ln K system
+        newton_flash_step :
+            Simultaneous Newton update of alpha, theta and K
+        sensitivities :
+            Derivatives of a converged flash wrt temperature, pressure and feed
+        calc_enthalpy :
+            Enthalpy and heat capacity of each phase after a flash
+        mixture_enthalpy :
+            Enthalpy and heat capacity of the mixture from the current eos states
+        dlnK_dT :
+            Temperature derivative of log partition coefficients at fixed x
         make_ideal_K_mat :
             Determine initial partition coefficients independent of composition
+        ideal_K_from_allmat :
+            Ideal partition coefficients relative to the reference phase
         """
 
         self.T = T
@@ -683,12 +1046,68 @@ class FlashController(object):
         self.ref_phases_tried = []
         self.ref_comp = np.zeros([len(self.compobjs)])
         self.ref_fug = np.zeros([len(self.compobjs)])
+        self._ref_mask_cache = {}
+        self._ideal_K_cache = {}
+        self.active_phases = np.ones([self.Np], dtype=bool)
+        self.K_frozen = np.ones([self.Nc, self.Np])
+        self.eos_current = np.zeros([self.Np], dtype=bool)
+        self._solution_cache = []
+        self._fluid_flash = None
+        self.robust_info = {}
         self.set_ref_index()
         self.ref_phase_iter = 0
         self.K_calc = np.zeros([len(self.compobjs), len(self.phases)])
         self.x_calc = np.zeros([len(self.compobjs), len(self.phases)])
         self.alpha_calc = np.zeros([len(self.phases)])
         self.theta_calc = np.zeros([len(self.phases)])
+        self.T_calc = self.T
+
+    def snapshot(self):
+        """Serialize the initialized controller for fast restoring
+
+        Returns
+        ----------
+        data : bytes
+            Pickled state of the controller, including its components,
+            eos objects with their constants, caches and the result of the
+            last flash, which 'from_snapshot' restores without repeating
+            the eos initialization.
+
+        Notes
+        ----------
+        Diagnostic output in 'monitor' and 'iter_output' is not kept.
+        Only restore snapshots from trusted sources, as unpickling can
+        execute arbitrary code.
+        """
+        state = self.__dict__.copy()
+        state['monitor'] = []
+        state['iter_output'] = {}
+        data = pickle.dumps({'version': self.snapshot_version,
+                             'state': state},
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        return data
+
+    @classmethod
+    def from_snapshot(cls, data):
+        """Restore a controller from the output of 'snapshot'
+
+        Parameters
+        ----------
+        data : bytes
+            Output of 'snapshot'
+
+        Returns
+        ----------
+        flash : FlashController
+            Controller in the same state as when the snapshot was taken
+        """
+        snap = pickle.loads(data)
+        if snap.get('version') != cls.snapshot_version:
+            raise ValueError("""Snapshot version does not match
+                             FlashController.snapshot_version.""")
+        flash = cls.__new__(cls)
+        flash.__dict__.update(snap['state'])
+        return flash
 
     def set_feed(self, z, setref=True):
         """Utility for setting the feed and reference phase based on feed
@@ -742,39 +1161,283 @@ class FlashController(object):
         self.ref_ind = [ii for ii, phase in enumerate(self.phases)
                         if phase == self.ref_phase].pop()
 
-    # TODO: Make this more robust, it is possibility of breaking!
-    def change_ref_phase(self):
-        """Utility to change reference phase on calculation stall"""
+    def ref_masks(self):
+        """Utility to retrieve masks that exclude the reference phase
+
+        Returns
+        ----------
+        masks : tuple
+            masks[0] : numpy array
+                Mask of non-reference alpha entries in an array of size 2*Np
+            masks[1] : numpy array
+                Mask of non-reference theta entries in an array of size 2*Np
+            masks[2] : numpy array
+                Mask of non-reference phases in an array of size Np
+            masks[3] : numpy array
+                Mask of non-reference alpha and theta entries in an
+                array of size 2*Np
+
+        Notes
+        ----------
+        Masks are built once per reference index, number of phases and
+        set of frozen phases and are cached for subsequent calls. Frozen
+        phases are masked in the same way as the reference phase.
+        """
+        frozen = tuple(np.flatnonzero(~self.active_phases))
+        key = (self.ref_ind, self.Np, frozen)
+        if key not in self._ref_mask_cache:
+            arr_mask = self.active_phases.copy()
+            arr_mask[self.ref_ind] = False
+            alf_mask = np.concatenate((arr_mask, np.zeros([self.Np], dtype=bool)))
+            theta_mask = np.concatenate((np.zeros([self.Np], dtype=bool), arr_mask))
+            arrdbl_mask = alf_mask | theta_mask
+            for mask in (alf_mask, theta_mask, arr_mask, arrdbl_mask):
+                mask.setflags(write=False)
+            self._ref_mask_cache[key] = (alf_mask, theta_mask,
+                                         arr_mask, arrdbl_mask)
+        return self._ref_mask_cache[key]
+
+    def freeze_phases(self, K, theta, freeze):
+        """Utility to remove clearly unstable phases from the active set
+
+        Parameters
+        ----------
+        K : numpy array
+            Partition coefficient matrix with size Nc x Np
+        theta : numpy array
+            Phase stabilities with size Np
+        freeze : numpy array
+            Boolean array with size Np of phases that should be frozen
+
+        Notes
+        ----------
+        The partition coefficients of a frozen phase are held at their
+        values in 'K_frozen' and its eos is no longer called. The reference
+        phase is never frozen, and the least unstable phase is kept active
+        if every other phase would be frozen.
+        """
+        freeze = freeze & self.active_phases
+        freeze[self.ref_ind] = False
+        remaining = self.active_phases & ~freeze
+        remaining[self.ref_ind] = False
+        if freeze.any() and not remaining.any():
+            candidates = np.flatnonzero(freeze)
+            freeze[candidates[np.argmin(theta[candidates])]] = False
+        if freeze.any():
+            self.K_frozen[:, freeze] = K[:, freeze]
+            self.active_phases = self.active_phases & ~freeze
+
+    def recheck_frozen(self, z, alpha, theta, K, x, T, P, freeze_theta):
+        """Utility to update frozen phases and release those that may be stable
+
+        Parameters
+        ----------
+        z : numpy array
+            Molar fraction of each component with size Nc
+        alpha : numpy array
+            Molar phase fractions with size Np, updated in place
+        theta : numpy array
+            Phase stabilities with size Np, updated in place
+        K : numpy array
+            Partition coefficient matrix with size Nc x Np, updated in place
+        x : numpy array
+            Composition of each component in each phase with size Nc x Np,
+            updated in place
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+        freeze_theta : float
+            Stability below which a frozen phase is released
+
+        Returns
+        ----------
+        released : numpy array
+            Boolean array with size Np of phases that were released
+
+        Notes
+        ----------
+        Only the eos of the frozen phases is called, using the current
+        reference phase fugacity. Since alpha = 0 for a frozen phase, the
+        denominator of the objective function does not depend on it and
+        its stability follows directly from the objective function,
+        exp(theta_j) = sum(z/E) / sum(z*K_j/E).
+        """
+        frozen = np.flatnonzero(~self.active_phases)
+        denominator = 1.0 + np.matmul(K * np.exp(theta) - 1.0, alpha)
+        for ii in frozen:
+            theta[ii] = max(0.0, np.log(np.sum(z / denominator))
+                            - np.log(np.sum(z * K[:, ii] / denominator)))
+            if ii in self.hyd_phases.values():
+                fug = self.phase_fugacity(ii, T, P, x[:, ii])
+                x[:, ii] = self.fug_list[ii].hyd_comp()
+            else:
+                x_tmp = np.abs(z * K[:, ii] * np.exp(theta[ii]) / denominator)
+                x[:, ii] = x_tmp / np.sum(x_tmp)
+                fug = self.phase_fugacity(ii, T, P, x[:, ii])
+            K[:, ii] = np.real(np.abs(
+                self.ref_fug / fug * x[:, ii] / self.ref_comp))
+            theta[ii] = max(0.0, np.log(np.sum(z / denominator))
+                            - np.log(np.sum(z * K[:, ii] / denominator)))
+        released = ~self.active_phases & (theta <= freeze_theta)
+        # Released phases start on the Gupta floor so that the stability
+        # function alpha*theta/(alpha + theta) stays differentiable.
+        floor = released & (alpha < 1e-10) & (theta < 1e-10)
+        alpha[floor] = 1e-10
+        theta[floor] = 1e-10
+        self.K_frozen[:, frozen] = K[:, frozen]
+        self.active_phases = self.active_phases | released
+        return released
+
+    def change_ref_phase(self, K=None, alpha=None, theta=None):
+        """Utility to change reference phase on calculation stall
+
+        Parameters
+        ----------
+        K : numpy array, optional
+            Partition coefficient matrix relative to the current
+            reference phase with size Nc x Np
+        alpha : numpy array, optional
+            Current molar phase fractions with size Np
+        theta : numpy array, optional
+            Current phase stabilities with size Np
+
+        Returns
+        ----------
+        values : list or None
+            If K, alpha and theta are given, the same quantities
+            re-based onto the new reference phase
+            values[0] : numpy array
+                Partition coefficient matrix with size Nc x Np
+            values[1] : numpy array
+                Molar phase fractions with size Np
+            values[2] : numpy array
+                Phase stabilities with size Np
+
+        Notes
+        ----------
+        The new reference is the non-hydrate phase, other than the current
+        one, with the largest phase amount. Ties are broken by preferring
+        phases that have been tried as reference least often and then by
+        the smallest stability. If no other non-hydrate phase is present,
+        e.g. when a hydrate holds all of the feed, the current reference
+        is first restarted with the technique of Gupta and replaced by the
+        candidate with the smallest stability on the next stall.
+
+        Because x_j is invariant to scaling K_ij*exp(theta_j) by a
+        per-component factor, dividing K by the new reference column and
+        shifting theta by the new reference stability re-bases the state
+        exactly, as 'K_transform' does for ideal partition coefficients.
+        """
         self.ref_phases_tried.append(self.ref_phase)
-        self.ref_phase_list = [
-            phase for phase in self.phases
-            if (phase not in self.ref_phases_tried)
-            and (phase not in ['s1', 's2'])
-        ]
-        if self.ref_phase_list == []:
-            self.ref_phase = self.ref_phases_tried[
-                np.mod(self.ref_phase_iter,
-                       len(self.ref_phases_tried))
-            ]
-            self.ref_phase_iter += 1
-        else:
+        candidates = [ii for ii, phase in enumerate(self.phases)
+                      if (phase != self.ref_phase)
+                      and (phase not in ['s1', 's2'])]
+        if not candidates:
+            # The reference is the only non-hydrate phase and stays.
+            candidates = [self.ref_ind]
+        self.ref_phase_list = [self.phases[ii] for ii in candidates
+                               if self.phases[ii] not in self.ref_phases_tried]
+        if self.ref_phase_list:
             self.ref_phase_iter = 0
-            if len(self.ref_phase_list) > 1:
-                if self.ref_phase == 'vapor':
-                    self.ref_phase = 'lhc'
-                elif self.ref_phase == 'lhc':
-                    self.ref_phase = 'vapor'
-                elif self.ref_phase == 'aqueous':
-                    self.ref_phase == 'lhc'
+        else:
+            self.ref_phase_iter += 1
+
+        def tried(ii):
+            return self.ref_phases_tried.count(self.phases[ii])
+
+        if alpha is not None and theta is not None:
+            # Amounts on the Gupta floor count as absent.
+            amount = np.where(alpha > 1e-8, alpha, 0.0)
+            if amount[candidates].max() > 0:
+                new_ind = min(candidates,
+                              key=lambda ii: (-amount[ii], tried(ii),
+                                              theta[ii]))
+            elif self.ref_phases_tried.count(self.ref_phase) < 2:
+                # Restart once with the current reference before moving
+                # to a phase that is absent as well.
+                new_ind = self.ref_ind
             else:
-                self.ref_phase = self.ref_phase_list[0]
+                new_ind = min(candidates,
+                              key=lambda ii: (theta[ii], tried(ii)))
+        else:
+            new_ind = min(candidates, key=tried)
+        self.ref_phase = self.phases[new_ind]
         self.set_ref_index()
-        
+
+        if K is None or alpha is None or theta is None:
+            return None
+
+        K_ref = K / K[:, self.ref_ind][:, np.newaxis]
+        alpha_ref = alpha.copy()
+        theta_ref = np.maximum(0, theta - theta[self.ref_ind])
+        # Same treatment as the technique of Gupta so that no phase
+        # is left with alpha = theta = 0.
+        change_ind = (alpha_ref < 1e-10) & (theta_ref < 1e-10)
+        alpha_ref[change_ind] = 1e-10
+        theta_ref[change_ind] = 1e-10
+        theta_ref[self.ref_ind] = 0.0
+        values = [K_ref, alpha_ref, theta_ref]
+        return values
+
+    def merge_hc_phases(self, x, alpha, T, tol=1e-6):
+        """Combine vapor and liquid hydrocarbon phases of equal composition
+
+        Parameters
+        ----------
+        x : numpy array
+            Composition of each phase with size Nc x Np
+        alpha : numpy array
+            Molar phase fractions with size Np
+        T : float
+            Temperature in Kelvin
+        tol : float
+            Largest difference in mole fraction of two equal phases
+
+        Returns
+        ----------
+        alpha : numpy array
+            Molar phase fractions with the combined amount in one phase
+
+        Notes
+        ----------
+        Where the cubic of the SRK equation of state has a single real
+        root, the vapor and lhc phases are the same phase and the split of
+        its amount between the two is arbitrary. The combined phase is
+        labelled vapor if T is above the pseudo-critical temperature of
+        Kay's rule, sum_i x_i Tc_i, and lhc otherwise, so that the same
+        state always has the same phase assemblage. The reference phase
+        follows the combined phase, which leaves K unchanged.
+        """
+        if ('vapor' not in self.phases) or ('lhc' not in self.phases):
+            return alpha
+        v_ind = self.phases.index('vapor')
+        l_ind = self.phases.index('lhc')
+        if np.max(np.abs(x[:, v_ind] - x[:, l_ind])) > tol:
+            return alpha
+        Tc = np.array([comp.Tc for comp in self.compobjs])
+        if T > np.sum(x[:, v_ind] * Tc):
+            keep_ind, drop_ind = v_ind, l_ind
+        else:
+            keep_ind, drop_ind = l_ind, v_ind
+        alpha = alpha.copy()
+        alpha[keep_ind] += alpha[drop_ind]
+        alpha[drop_ind] = 0.0
+        if self.ref_ind == drop_ind:
+            self.ref_phase = self.phases[keep_ind]
+            self.set_ref_index()
+        return alpha
+
     def main_handler(self, compobjs, z, T, P,
                      K_init=[], verbose=False,
                      initialize=True, run_diagnostics=False,
                      incipient_calc=False, monitor_calc=False,
-                     **kwargs):
+                     active_set=True, freeze_theta=0.01, freeze_iter=3,
+                     recheck_iter=10, jac_update='newton',
+                     solver='ss', newton_switch=1e-3, H=None, dT_max=10.0,
+                     ref_phase=None, iterlim=100, stall_iter=None,
+                     alpha_init=None, theta_init=None, ref_switch_iter=25,
+                     freeze_init=(), **kwargs):
         """Primary logical utility for performing flash calculation
 
         Parameters
@@ -795,6 +1458,53 @@ class FlashController(object):
             Flag for initializing the calculation using ideal partition coefficients
         run_diagnostics : bool
             Flag for doing debugging
+        active_set : bool
+            Flag for freezing clearly unstable phases, such that their
+            eos is not called and they are dropped from the alpha/theta system
+        freeze_theta : float
+            Stability above which a phase with alpha = 0 counts as unstable
+        freeze_iter : int
+            Number of consecutive unstable iterations before a phase is frozen
+        recheck_iter : int
+            Frozen phases are released every 'recheck_iter' iterations
+            and before convergence is accepted, so they can re-enter
+        jac_update : str
+            Jacobian strategy of the inner alpha/theta minimization, see
+            'find_alphatheta_min'
+        solver : str
+            'ss' alternates the alpha/theta minimization with successive
+            substitution of x and K. 'newton' switches to a simultaneous
+            Newton iteration on alpha, theta and ln K once the error is
+            below 'newton_switch', and falls back to successive
+            substitution if a Newton iteration increases the error
+        newton_switch : float
+            Error below which the 'newton' solver takes over
+        H : float
+            Enthalpy of the mixture in J per mol of feed. If given,
+            'T' is only the initial temperature and is updated inside the
+            solver loop until the mixture enthalpy matches 'H'. The final
+            temperature is stored in 'self.T_calc'
+        dT_max : float
+            Largest temperature step in Kelvin when 'H' is given
+        ref_phase : str
+            Initial reference phase instead of the one chosen from the feed
+        iterlim : int
+            Maximum number of iterations
+        stall_iter : int
+            If given, the calculation stops early when the error has not
+            reached a new minimum within this many iterations
+        alpha_init : numpy array
+            Molar phase fractions to start from with size Np, e.g. of a
+            previous solution together with 'K_init' and 'ref_phase'
+        theta_init : numpy array
+            Phase stabilities to start from with size Np
+        ref_switch_iter : int
+            Number of iterations after which an absent reference phase is
+            replaced before convergence; otherwise it is only replaced
+            once the flash converged without it, or on NaN
+        freeze_init : list, tuple
+            Phases that start frozen at alpha = 0 with ideal partition
+            coefficients, until 'recheck_frozen' releases them
 
         Returns
         ----------
@@ -814,7 +1524,17 @@ class FlashController(object):
         """
         # z = np.asarray(z)
         self.set_feed(z)
+        if ref_phase is not None:
+            if ((ref_phase not in self.phases)
+                    or (ref_phase in self.hyd_phases)):
+                raise ValueError(ref_phase + """ is not a valid reference
+                                 phase.""")
+            self.ref_phase = ref_phase
         self.set_ref_index()
+        self.active_phases = np.ones([self.Np], dtype=bool)
+        frozen_init = np.array([phase in freeze_init
+                                for phase in self.phases], dtype=bool)
+        frozen_init[self.ref_ind] = False
         if type(z) != np.ndarray:
             z = np.asarray(z)
 
@@ -826,11 +1546,16 @@ class FlashController(object):
             self.iter_output = {}
 
         if initialize or not self.completed:
-            alpha_0 = np.ones([self.Np]) / self.Np
-            theta_0 = np.zeros([self.Np])
-            # TODO: Rewrite so that ideal K doesn't have to be re-calculated!
+            if alpha_init is None:
+                alpha_0 = np.ones([self.Np]) / self.Np
+            else:
+                alpha_0 = np.array(alpha_init, dtype=float)
+            if theta_init is None:
+                theta_0 = np.zeros([self.Np])
+            else:
+                theta_0 = np.array(theta_init, dtype=float)
             if not incipient_calc:
-                if K_init == []:
+                if len(K_init) == 0:
                     K_0 = self.make_ideal_K_mat(compobjs, T, P)
                 else:
                     # Add more code to allow the specification of a partition coefficient
@@ -840,6 +1565,11 @@ class FlashController(object):
                         print('K is not the default')
             else:
                 K_0 = self.incipient_calc(T, P)
+            if frozen_init.any():
+                alpha_0[frozen_init] = 0.0
+                theta_0[frozen_init] = np.maximum(theta_0[frozen_init],
+                                                  freeze_theta)
+                self.freeze_phases(K_0, theta_0, frozen_init)
 
             if monitor_calc:
                 self.monitor.append([{'alpha': alpha_0,
@@ -850,9 +1580,17 @@ class FlashController(object):
                                       'inner': [],
                                       'error': []}])
 
-            alpha_new, theta_new = self.find_alphatheta_min(z, alpha_0,
-                                                            theta_0, K_0,
-                                                            monitor_calc=monitor_calc)
+            split = None
+            if ((alpha_init is None) and (theta_init is None)
+                    and not frozen_init.any()):
+                # Without a starting point the fixed K split is solved
+                # directly.
+                split = self.fixed_K_split(z, K_0)
+            if split is None:
+                split = self.find_alphatheta_min(z, alpha_0, theta_0, K_0,
+                                                 monitor_calc=monitor_calc,
+                                                 jac_update=jac_update)
+            alpha_new, theta_new = split
             x_new = self.calc_x(z, alpha_new, theta_new, K_0, T, P)
             fug_new = self.calc_fugacity(T, P, x_new)
             x_new = self.calc_x(z, alpha_new, theta_new, K_0, T, P)
@@ -881,7 +1619,8 @@ class FlashController(object):
             theta_0 = np.zeros([self.Np])
             alpha_new, theta_new = self.find_alphatheta_min(z, alpha_0,
                                                             theta_0, K_0,
-                                                            monitor_calc=monitor_calc)
+                                                            monitor_calc=monitor_calc,
+                                                            jac_update=jac_update)
             x_new = self.calc_x(z, alpha_new, theta_new, K_0, T, P)
             fug_new = self.calc_fugacity(T, P, x_new)
             x_new = self.calc_x(z, alpha_new, theta_new, K_0, T, P)
@@ -906,42 +1645,65 @@ class FlashController(object):
         TOL = 1e-6
         itercount = 0
         refphase_itercount = 0
-        iterlim = 100
-        
+        best_error = error
+        best_iter = 0
+
         alpha_old = alpha_new.copy()
         theta_old = theta_new.copy()
         x_old = x_new.copy()
         K_old = K_new.copy()
-        
+        unstable_count = np.zeros([self.Np], dtype=int)
+        if solver not in ('ss', 'newton'):
+            raise ValueError(solver + """ is not a valid solver.
+                             Use 'ss' or 'newton'.""")
+        use_newton = False
+        newton_failed = False
+        # Temperature iteration state when enthalpy is specified.
+        ph_switch = 1e-5
+        T_old = None
+        H_err_old = None
+
         while error > TOL and itercount < iterlim:
-            # Perform newton iteration to update alpha and theta at
-            # a fixed x and K
             self.iter_output = {}
-            alpha_new, theta_new = self.find_alphatheta_min(z, alpha_old, 
-                                                            theta_old, K_new,
-                                                            monitor_calc=monitor_calc)
-
-            phase_diff = np.linalg.norm(alpha_new - alpha_old) + np.linalg.norm(theta_new - theta_old)
-            # Perform one iteration of successive substitution to update
-            # x and K at the new alpha and theta.
-            x_error = 1e6
-            x_counter = 0
-            if (itercount == 0) or (phase_diff > TOL / 10):
-                x_counter_lim = 1
-            else:
-                x_counter_lim = 1
-
             if monitor_calc:
                 x_iter_out = []
 
-            while (x_error > TOL) and (x_counter < x_counter_lim):
-                x_new = self.calc_x(z, alpha_new, theta_new, K_new, T, P)
-                K_new = self.calc_K(T, P, x_new)
+            if use_newton:
+                # Simultaneous Newton iteration on alpha, theta and ln K
+                # from the state of the previous iteration.
+                x_new = self.calc_x(z, alpha_old, theta_old, K_old, T, P)
+                K_fix = self.calc_K(T, P, x_new)
                 x_error = np.linalg.norm(x_new - x_old)
-                x_counter += 1
+                alpha_new, theta_new, K_new = self.newton_flash_step(
+                    z, alpha_old, theta_old, K_old, x_new, K_fix)
                 if monitor_calc:
-                    x_iter_out.append([x_counter, {'x': x_new, 'K': K_new}])
-            
+                    x_iter_out.append([1, {'x': x_new, 'K': K_fix}])
+            else:
+                # Perform newton iteration to update alpha and theta at
+                # a fixed x and K
+                alpha_new, theta_new = self.find_alphatheta_min(z, alpha_old,
+                                                                theta_old, K_new,
+                                                                monitor_calc=monitor_calc,
+                                                                jac_update=jac_update)
+
+                phase_diff = np.linalg.norm(alpha_new - alpha_old) + np.linalg.norm(theta_new - theta_old)
+                # Perform one iteration of successive substitution to update
+                # x and K at the new alpha and theta.
+                x_error = 1e6
+                x_counter = 0
+                if (itercount == 0) or (phase_diff > TOL / 10):
+                    x_counter_lim = 1
+                else:
+                    x_counter_lim = 1
+
+                while (x_error > TOL) and (x_counter < x_counter_lim):
+                    x_new = self.calc_x(z, alpha_new, theta_new, K_new, T, P)
+                    K_new = self.calc_K(T, P, x_new)
+                    x_error = np.linalg.norm(x_new - x_old)
+                    x_counter += 1
+                    if monitor_calc:
+                        x_iter_out.append([x_counter, {'x': x_new, 'K': K_new}])
+
             if run_diagnostics:
                 print('Iter K:\n', K_new)
                 print('Iter x:\n', x_new)
@@ -952,10 +1714,47 @@ class FlashController(object):
 
             # Determine error associated new x and K and change in x
             # Set iteration error to the maximum of the two.
-            Obj_error = np.linalg.norm(objective(z, alpha_new,
-                                         theta_new, K_new))
+            active = self.active_phases
+            Obj_error = np.linalg.norm(objective(z, alpha_new[active],
+                                                 theta_new[active],
+                                                 K_new[:, active]))
+            if use_newton and (error < 1e5) and (max(Obj_error, x_error) > error):
+                # Newton iteration did not reduce the error.
+                use_newton = False
+                newton_failed = True
             error = max(Obj_error, x_error)
 
+            if (H is not None) and (error < ph_switch):
+                # Temperature step once phase amounts are settled. The
+                # secant through previous steps carries latent heat that
+                # the heat capacity at fixed phase amounts misses.
+                H_mix, C_mix = self.mixture_enthalpy(alpha_new, x_new)
+                H_err = H_mix - H
+                slope = C_mix
+                if T_old is not None and T != T_old:
+                    secant = (H_err - H_err_old) / (T - T_old)
+                    if secant > slope:
+                        slope = secant
+                T_old = T
+                H_err_old = H_err
+                dT = -H_err / slope
+                error = max(error, abs(dT) / T)
+                dT = np.clip(dT, -dT_max, dT_max)
+                # Move K along with T so the next iteration starts warm.
+                K_new = K_new * np.exp(self.dlnK_dT(x_new) * dT)
+                T = T + dT
+                unstable_count[:] = 0
+                if not self.active_phases.all():
+                    # Phases frozen at the old temperature may be stable now.
+                    self.ref_fug = self.ref_fug * np.exp(
+                        self.fug_list[self.ref_ind].dlnf_dT(
+                            x_new[:, self.ref_ind]) * dT)
+                    self.recheck_frozen(z, alpha_new, theta_new, K_new, x_new,
+                                        T, P, freeze_theta)
+            elif H is not None:
+                # Not yet close enough to update temperature.
+                error = max(error, 10 * TOL)
+
 
             if monitor_calc:
                 self.iter_output['comp'] = x_iter_out
@@ -965,6 +1764,7 @@ class FlashController(object):
                                       'step': itercount,
                                       'x': x_new,
                                       'inner': self.iter_output,
+                                      'active': self.active_phases.copy(),
                                       'error': {'Obj': Obj_error, 'max': error}}])
             
             itercount += 1
@@ -979,25 +1779,62 @@ class FlashController(object):
             #     or nan_occur
             # ):
             if (
-                    (((refphase_itercount > 25) or (error > TOL))
+                    (((refphase_itercount > ref_switch_iter) or (error < TOL))
                      and (alpha_new[self.ref_ind] < 0.0001))
                 or nan_occur
             ):
                 error = 1e6
-                # alpha_new = np.ones([self.Np]) / (1 - self.Np)
-                # alpha_new[self.ref_ind] = 0.0
-                # theta_new = np.zeros([self.Np])
-                # theta_new[self.ref_ind] = 2.0
-                self.change_ref_phase() 
+                if nan_occur:
+                    # Nothing to carry over, so restart from ideal values
+                    # relative to the new reference phase.
+                    self.change_ref_phase()
+                    K_new = self.make_ideal_K_mat(compobjs, T, P)
+                    alpha_new = np.ones([self.Np]) / self.Np
+                    theta_new = np.zeros([self.Np])
+                    x_new = np.nan_to_num(x_new)
+                else:
+                    K_new, alpha_new, theta_new = self.change_ref_phase(
+                        K_new, alpha_new, theta_new)
                 refphase_itercount = 0
-                # TODO change these 3 lines to investigate the effect of changing the reference phase
-                # K_new = self.make_ideal_K_mat(compobjs, T, P)
-                # alpha_new = np.ones([self.Np])/self.Np
-                # theta_new = np.zeros([self.Np])
-                # K_new = self.calc_K(T, P, x_new)
+                use_newton = False
+                self.active_phases = np.ones([self.Np], dtype=bool)
+                unstable_count[:] = 0
                 if verbose:
                     print('Changed reference phase')
-                
+            elif active_set:
+                unstable_count = np.where(
+                    (alpha_new == 0) & (theta_new > freeze_theta),
+                    unstable_count + 1, 0)
+                if (not self.active_phases.all()
+                        and ((error <= TOL)
+                             or (np.mod(itercount, recheck_iter) == 0))):
+                    # Never accept convergence without re-checking frozen
+                    # phases against the current reference phase.
+                    released = self.recheck_frozen(z, alpha_new, theta_new,
+                                                   K_new, x_new, T, P,
+                                                   freeze_theta)
+                    if released.any():
+                        unstable_count[released] = 0
+                        error = max(error, 10 * TOL)
+                        if verbose:
+                            print('Released frozen phases')
+                elif error > TOL:
+                    self.freeze_phases(K_new, theta_new,
+                                       unstable_count >= freeze_iter)
+
+            if ((solver == 'newton') and not newton_failed
+                    and (error < newton_switch)):
+                use_newton = True
+
+            if error < best_error:
+                best_error = error
+                best_iter = itercount
+            elif (stall_iter is not None) and (itercount - best_iter >= stall_iter):
+                # Stagnating or cycling through reference phases.
+                if verbose:
+                    print('Stopped on stalled error')
+                break
+
             # Set old values using copy 
             # (NOT direct assignment due to 
             # Python quirkiness of memory indexing)
@@ -1019,7 +1856,13 @@ class FlashController(object):
 
         if verbose:
             print('\nElapsed time =', time.time() - tstart, '\n')
-        
+
+        alpha_new = self.merge_hc_phases(x_new, alpha_new, T)
+
+        # Frozen phases were not evaluated at the final compositions.
+        self.eos_current = self.active_phases.copy()
+        self.active_phases = np.ones([self.Np], dtype=bool)
+        self.T_calc = T
         self.K_calc = K_new.copy()
         self.x_calc = x_new.copy()
         self.alpha_calc = alpha_new.copy()
@@ -1030,20 +1873,864 @@ class FlashController(object):
         return values
 
 
-    def calc_x(self, z, alpha, theta, K, T, P):
-        """Composition of each component in each phases
+    def ph_flash(self, compobjs, z, H, P, T0, **kwargs):
+        """Flash calculation at fixed pressure and enthalpy
 
         Parameters
         ----------
-        z : list, numpy array
-            Total composition of each component with size Nc
-        alpha : list, numpy array
-            Molar phase fractions with size Np
-        theta : list, numpy array
-            Stability of phases with size Np
-        K : list, numpy array
-            Partition coefficients for each component
-            in each phase with size Nc x Np
+        compobjs : list, tuple
+            List of components
+        z : list, tuple, numpy array
+            Molar composition of each component
+        H : float
+            Enthalpy of the mixture in J per mol of feed, on the same
+            basis as 'calc_enthalpy'
+        P : float
+            Pressure in bar
+        T0 : float
+            Initial temperature in Kelvin
+        kwargs : dict
+            Passed to 'main_handler'
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Composition (x) with size Nc x Np
+            values[1] : numpy array
+                Molar phase fraction (\alpha) with size Np
+            values[2] : numpy array
+                Partition coefficient matrix of each component
+                in each phase (K) with size Nc x Np
+            values[3] : float
+                Temperature in Kelvin
+            values[4] : int
+                Number of iterations required for convergence
+            values[5] : float
+                Maximum error on any variable from minimization calculation
+        """
+        x, alpha, K, itercount, error = self.main_handler(compobjs, z, T0, P,
+                                                          H=H, **kwargs)
+        values = [x, alpha, K, self.T_calc, itercount, error]
+        return values
+
+    def robust_flash(self, compobjs, z, T, P,
+                     strategies=('ideal', 'incipient', 'nearest', 'ref',
+                                 'frozen'),
+                     stall_iter=20, tol=1e-6, executor=None, **kwargs):
+        """Flash that retries alternative starts until one converges
+
+        Parameters
+        ----------
+        compobjs : list, tuple
+            List of components
+        z : list, tuple, numpy array
+            Molar composition of each component
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+        strategies : list, tuple
+            Starts in the order they are tried, see 'flash_attempts'
+        stall_iter : int
+            Passed to 'main_handler' so that stagnating attempts end early
+        tol : float
+            Error below which an attempt counts as converged
+        executor : concurrent.futures.Executor
+            If given, attempts are run concurrently on the executor from
+            a snapshot of this controller, and the first converged attempt
+            is used. Attempts that already started run to completion in
+            the background, see 'run_attempts'.
+        kwargs : dict
+            Passed to 'main_handler'
+
+        Returns
+        ----------
+        values : list
+            Output of 'main_handler' followed by
+            values[5] : str or None
+                Winning strategy, or None if no attempt converged, in
+                which case the attempt with the smallest error is returned
+
+        Notes
+        ----------
+        Each attempt is recorded in 'self.robust_info' with its error,
+        number of iterations and time. Attempts that raise a numerical
+        error are recorded with the exception in place of the error.
+        """
+        z = np.asarray(z)
+        attempts = self.flash_attempts(z, T, P, strategies)
+        results = self.run_attempts(compobjs, z, T, P, attempts, stall_iter,
+                                    tol, executor, True, kwargs)
+        winner = None
+        best = None
+        for strategy, out, state, converged, entry in results:
+            if converged:
+                winner = strategy
+                best = (out, state)
+            elif (winner is None) and ((best is None) or (out[4] < best[0][4])):
+                best = (out, state)
+        self.robust_info['strategy'] = winner
+        if best is None:
+            raise ValueError("""No flash attempt completed, see
+                             'robust_info'.""")
+
+        out, state = best
+        if (executor is not None) or (winner is None):
+            self.restore_calc_state(state)
+        if winner is not None:
+            self.cache_solution(z, P)
+        values = list(out) + [winner]
+        return values
+
+    def multistart_flash(self, compobjs, z, T, P,
+                         strategies=('ideal', 'incipient', 'nearest', 'ref',
+                                     'frozen'),
+                         stall_iter=20, tol=1e-6, executor=None,
+                         gibbs_tol=1e-2, **kwargs):
+        """Flash from several starts that keeps the lowest gibbs energy
+
+        Parameters
+        ----------
+        compobjs : list, tuple
+            List of components
+        z : list, tuple, numpy array
+            Molar composition of each component
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+        strategies : list, tuple
+            Starts that are all run, see 'flash_attempts'
+        stall_iter : int
+            Passed to 'main_handler' so that stagnating attempts end early
+        tol : float
+            Error below which an attempt counts as converged
+        executor : concurrent.futures.Executor
+            If given, attempts are run concurrently on the executor from
+            a snapshot of this controller
+        gibbs_tol : float
+            Gibbs energy in J per mol of feed by which a later strategy
+            must improve on an earlier one, so that the choice between
+            equivalent solutions does not depend on convergence noise
+        kwargs : dict
+            Passed to 'main_handler'
+
+        Returns
+        ----------
+        values : list
+            Output of 'main_handler' followed by
+            values[5] : str or None
+                Strategy of the converged result with the lowest gibbs
+                energy, or None if no attempt converged, in which case
+                the attempt with the smallest error is returned
+            values[6] : float
+                Gibbs energy of the result in J per mol of feed
+
+        Notes
+        ----------
+        Each attempt is recorded in 'self.robust_info' together with the
+        gibbs energy of converged attempts, so that different phase
+        assemblages reached from different starts can be compared.
+        """
+        z = np.asarray(z)
+        attempts = self.flash_attempts(z, T, P, strategies)
+        results = self.run_attempts(compobjs, z, T, P, attempts, stall_iter,
+                                    tol, executor, False, kwargs)
+        winner = None
+        best = None
+        G_best = np.inf
+        for strategy, out, state, converged, entry in results:
+            if converged:
+                self.restore_calc_state(state)
+                G = self.gibbs_energy(P)[0]
+                entry['gibbs'] = G
+                if G < G_best - gibbs_tol:
+                    winner, best, G_best = strategy, (out, state), G
+            elif (winner is None) and ((best is None) or (out[4] < best[0][4])):
+                best = (out, state)
+        self.robust_info['strategy'] = winner
+        if best is None:
+            raise ValueError("""No flash attempt completed, see
+                             'robust_info'.""")
+
+        out, state = best
+        self.restore_calc_state(state)
+        if winner is not None:
+            self.cache_solution(z, P)
+        else:
+            G_best = self.gibbs_energy(P)[0]
+        values = list(out) + [winner, G_best]
+        return values
+
+    def flash_attempts(self, z, T, P, strategies):
+        """Starting points of 'robust_flash' and 'multistart_flash'
+
+        Parameters
+        ----------
+        z : numpy array
+            Molar composition of each component
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+        strategies : list, tuple
+            'ideal' uses ideal partition coefficients, 'incipient' uses
+            'incipient_calc', 'nearest' starts from the partition
+            coefficients and reference phase of the closest previously
+            converged solution, 'ref' tries every other non-hydrate
+            reference phase, 'ref:<phase>' a specific one, and 'frozen'
+            starts from the aqueous reference phase with the hydrate
+            phases frozen, so that the fluid phases converge before a
+            hydrate can take up the whole feed
+
+        Returns
+        ----------
+        attempts : list of tuples
+            Name of each attempt and the arguments it passes to
+            'main_handler'
+        """
+        self.set_feed(z)
+        attempts = []
+        for strategy in strategies:
+            if strategy == 'ideal':
+                attempts.append((strategy, {}))
+            elif strategy == 'incipient':
+                attempts.append((strategy, {'incipient_calc': True}))
+            elif strategy == 'nearest':
+                if self._solution_cache:
+                    dist = [abs(T - T_c)/T + abs(P - P_c)/P + np.sum(abs(z - z_c))
+                            for T_c, P_c, z_c, K_c, ref_c in self._solution_cache]
+                    T_c, P_c, z_c, K_c, ref_c = self._solution_cache[int(np.argmin(dist))]
+                    attempts.append((strategy, {'K_init': K_c,
+                                                'ref_phase': ref_c}))
+            elif strategy == 'ref':
+                for ii in self.nonhyd_phases:
+                    if self.phases[ii] != self.ref_phase:
+                        attempts.append(('ref:' + self.phases[ii],
+                                         {'ref_phase': self.phases[ii]}))
+            elif strategy.startswith('ref:'):
+                attempts.append((strategy, {'ref_phase': strategy[4:]}))
+            elif strategy == 'frozen':
+                if ('aqueous' in self.phases) and self.hyd_phases:
+                    attempts.append((strategy,
+                                     {'ref_phase': 'aqueous',
+                                      'freeze_init': tuple(self.hyd_phases)}))
+            else:
+                raise ValueError(strategy + """ is not a valid strategy.""")
+        return attempts
+
+    def run_attempts(self, compobjs, z, T, P, attempts, stall_iter, tol,
+                     executor, first_converged, kwargs):
+        """Run flash attempts sequentially or on an executor
+
+        Parameters
+        ----------
+        compobjs : list, tuple
+            List of components
+        z : numpy array
+            Molar composition of each component
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+        attempts : list of tuples
+            Output of 'flash_attempts'
+        stall_iter : int
+            Passed to 'main_handler'
+        tol : float
+            Error below which an attempt counts as converged
+        executor : concurrent.futures.Executor or None
+            Executor for concurrent attempts from a snapshot
+        first_converged : bool
+            Flag for stopping at the first converged attempt
+        kwargs : dict
+            Passed to 'main_handler'
+
+        Returns
+        ----------
+        results : list of tuples
+            Strategy, output of 'main_handler', output of 'calc_state',
+            convergence flag and record entry of each completed attempt
+            in the order of 'attempts'. The record of all attempts is
+            stored in 'self.robust_info'.
+
+        Notes
+        ----------
+        On an executor, stopping at the first converged attempt cancels
+        only the attempts that have not started. Those already running
+        cannot be interrupted and complete on their workers, with their
+        results discarded, so the workers stay busy until then.
+        """
+        def converged(out):
+            return (out[4] <= tol) and not (np.isnan(out[0]).any()
+                                            or np.isnan(out[1]).any())
+
+        record = []
+        results = []
+        self.robust_info = {'strategy': None, 'attempts': record}
+        if executor is None:
+            for strategy, attempt_kw in attempts:
+                tstart = time.time()
+                try:
+                    out = self.main_handler(compobjs, z, T, P,
+                                            stall_iter=stall_iter,
+                                            **dict(kwargs, **attempt_kw))
+                except (ValueError, FloatingPointError,
+                        np.linalg.LinAlgError) as err:
+                    record.append({'strategy': strategy, 'error': repr(err),
+                                   'time': time.time() - tstart})
+                    continue
+                record.append({'strategy': strategy, 'error': out[4],
+                               'iterations': out[3],
+                               'time': time.time() - tstart})
+                results.append((strategy, out, self.calc_state(),
+                                converged(out), record[-1]))
+                if first_converged and converged(out):
+                    break
+        else:
+            data = self.snapshot()
+            tstart = time.time()
+            futures = {executor.submit(flash_attempt, data, z, T, P,
+                                       dict(kwargs, stall_iter=stall_iter,
+                                            **attempt_kw)): ii
+                       for ii, (strategy, attempt_kw) in enumerate(attempts)}
+            order = []
+            for future in as_completed(futures):
+                strategy = attempts[futures[future]][0]
+                try:
+                    out, state = future.result()
+                except (ValueError, FloatingPointError,
+                        np.linalg.LinAlgError) as err:
+                    record.append({'strategy': strategy, 'error': repr(err),
+                                   'time': time.time() - tstart})
+                    continue
+                record.append({'strategy': strategy, 'error': out[4],
+                               'iterations': out[3],
+                               'time': time.time() - tstart})
+                results.append((strategy, out, state, converged(out),
+                                record[-1]))
+                order.append(futures[future])
+                if first_converged and converged(out):
+                    break
+            for future in futures:
+                future.cancel()
+            results = [results[ii] for ii in np.argsort(order)]
+        return results
+
+    def cache_solution(self, z, P):
+        """Store the last converged flash as a start for later attempts
+
+        Parameters
+        ----------
+        z : numpy array
+            Molar composition of each component
+        P : float
+            Pressure in bar
+        """
+        self._solution_cache.append((self.T_calc, P, z.copy(),
+                                     self.K_calc.copy(), self.ref_phase))
+        if len(self._solution_cache) > 64:
+            self._solution_cache.pop(0)
+
+    def gibbs_energy(self, P, x=None, alpha=None):
+        """Gibbs energy of the mixture from a flash result
+
+        Parameters
+        ----------
+        P : float
+            Pressure in bar
+        x : numpy array, optional
+            Composition of each component in each phase with size
+            Nc x Np, 'self.x_calc' by default
+        alpha : numpy array, optional
+            Molar phase fraction of each phase with size Np,
+            'self.alpha_calc' by default
+
+        Returns
+        ----------
+        values : list
+            values[0] : float
+                Gibbs energy of the mixture in J per mol of feed
+            values[1] : numpy array
+                Molar gibbs energy of each present phase in J/mol with
+                size Np. Zero for absent phases.
+
+        Notes
+        ----------
+        Uses mu_i = mu_i^0(T) + RT ln f_i, where the standard state is
+        the pure ideal gas at 1 bar for every eos, so that results for the
+        same feed, temperature and pressure are directly comparable. Only
+        the reference phase and phases with alpha > 0 are evaluated, at
+        the temperature of the last flash.
+        """
+        current = x is None
+        if x is None:
+            x = self.x_calc
+        if alpha is None:
+            alpha = self.alpha_calc
+        T = self.T_calc
+        present = alpha > 0
+        present[self.ref_ind] = True
+
+        # Reference phase first, since hydrates use its fugacity.
+        fug = np.ones_like(x)
+        inds = [self.ref_ind] + [ii for ii in np.flatnonzero(present)
+                                 if ii != self.ref_ind]
+        for ii in inds:
+            fug[:, ii] = self.phase_fugacity(ii, T, P, x[:, ii])
+        if current:
+            self.eos_current[inds] = True
+        else:
+            self.eos_current[:] = False
+
+        x_lnf = np.where(x > 0, x*np.log(np.where(x > 0, fug, 1.0)), 0.0)
+        g_phase = np.where(present, cp.R*T*np.sum(x_lnf, axis=0), 0.0)
+        g_phase[alpha <= 0] = 0.0
+        G = np.dot(alpha, g_phase)
+        values = [G, g_phase]
+        return values
+
+    def hydrate_stability(self, T, P, z=None, fug=None):
+        """Stability margin of each hydrate phase without a full flash
+
+        Parameters
+        ----------
+        T : float, numpy array
+            Temperature in Kelvin of each point
+        P : float, numpy array
+            Pressure in bar of each point
+        z : list, numpy array, optional
+            Total composition with size Nc, or one row per point. The
+            fluid fugacities are then taken from an aqueous-vapor flash.
+        fug : numpy array, optional
+            Fugacity of each component in the fluid with size Nc, or one
+            row per point, used instead of a flash of 'z'
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Stability margin ln(f_w,fluid / f_w,hydrate), i.e. the
+                chemical potential difference of water between the fluid
+                and each hydrate divided by RT, with size of the points
+                x number of hydrate phases. A hydrate is stable where the
+                margin is positive.
+            values[1] : list
+                Names of the hydrate phases in the columns of values[0]
+            values[2] : numpy array
+                Fluid fugacity of each component in bar with size of the
+                points x Nc
+
+        Notes
+        ----------
+        Each point costs at most a two phase flash and one hydrate eos
+        evaluation per structure, instead of a flash over all phases.
+        The hydrate eos objects of this controller are reused, so no
+        phase counts as current in 'eos_current' afterwards.
+        """
+        if (z is None) == (fug is None):
+            raise ValueError("""Specify either the composition 'z' or the
+                             fluid fugacity 'fug'.""")
+        hyd_names = list(self.hyd_phases)
+        if fug is not None:
+            fug = np.asarray(fug, dtype=float)
+            rows = fug
+        else:
+            rows = np.asarray(z, dtype=float)
+        shape = np.broadcast(np.asarray(T), np.asarray(P),
+                             rows[..., 0]).shape
+        T_pts = np.broadcast_to(T, shape).ravel()
+        P_pts = np.broadcast_to(P, shape).ravel()
+        rows = np.broadcast_to(rows, shape + (self.Nc,)).reshape(-1, self.Nc)
+
+        fug_pts = np.zeros([len(T_pts), self.Nc])
+        margin = np.zeros([len(T_pts), len(hyd_names)])
+        if hyd_names and (fug is None) and (self._fluid_flash is None):
+            self._fluid_flash = FlashController(self.compname,
+                                                phases=['aqueous', 'vapor'])
+        for ii in range(len(T_pts)):
+            if fug is None:
+                fluid = self._fluid_flash
+                fluid.main_handler(fluid.compobjs, rows[ii], T_pts[ii],
+                                   P_pts[ii])
+                fug_pts[ii] = fluid.calc_fugacity(
+                    T_pts[ii], P_pts[ii], fluid.x_calc)[:, fluid.ref_ind]
+            else:
+                fug_pts[ii] = rows[ii]
+            for jj, hyd_phase in enumerate(hyd_names):
+                fug_hyd = self.fug_list[self.hyd_phases[hyd_phase]].calc(
+                    self.compobjs, T_pts[ii], P_pts[ii], [], fug_pts[ii])
+                margin[ii, jj] = np.log(fug_pts[ii, self.h2oind]
+                                        / fug_hyd[self.h2oind])
+        self.eos_current[:] = False
+
+        values = [margin.reshape(shape + (len(hyd_names),)), hyd_names,
+                  fug_pts.reshape(shape + (self.Nc,))]
+        return values
+
+    def locate_boundary(self, compobjs, state_a, state_b, tol=1e-4,
+                        maxiter=20, alpha_min=1e-8, flash_tol=1e-6,
+                        **kwargs):
+        """Phase boundary on the line between two states
+
+        Parameters
+        ----------
+        compobjs : list, tuple
+            List of components
+        state_a : list, tuple
+            Temperature in Kelvin, pressure in bar and total composition
+            of the first state
+        state_b : list, tuple
+            Temperature, pressure and composition of the second state,
+            which must have a different phase assemblage
+        tol : float
+            Width of the final bracket as a fraction of the line
+        maxiter : int
+            Maximum number of flashes inside the bracket
+        alpha_min : float
+            Phase fraction above which a phase counts as present
+        flash_tol : float
+            Error below which a warm started flash counts as converged
+        kwargs : dict
+            Passed to 'robust_flash' for the two end states
+
+        Returns
+        ----------
+        values : list
+            values[0] : float
+                Temperature in Kelvin at the boundary
+            values[1] : float
+                Pressure in bar at the boundary
+            values[2] : numpy array
+                Total composition at the boundary with size Nc
+            values[3] : numpy array
+                Boolean array of present phases on the side of 'state_a'
+            values[4] : numpy array
+                Boolean array of present phases on the other side
+            values[5] : int
+                Number of flashes, including the two end states
+
+        Notes
+        ----------
+        States on the line are parameterized by s from 0 at 'state_a' to
+        1 at 'state_b'. Each phase that appears or disappears changes
+        sign in alpha - theta, which is positive for present and negative
+        for absent phases. The phase fraction may jump at the boundary,
+        e.g. at an invariant point, but the stability of a phase absent
+        on one side goes to zero there. The bracket is narrowed with the
+        zero of these stabilities extrapolated from the last two flashes
+        on each side, with regula falsi on alpha - theta until two flashes
+        are available and bisection when the bracket shrinks slowly. Each
+        flash is warm started from the bracket end closest to it.
+        When the line crosses several boundaries, the one found is the
+        first from 'state_a' that the bracket converges to. The result of
+        the last flash is left in the '*_calc' attributes.
+        """
+        T_a, P_a, z_a = state_a
+        T_b, P_b, z_b = state_b
+        z_a = np.asarray(z_a, dtype=float)/np.sum(z_a)
+        z_b = np.asarray(z_b, dtype=float)/np.sum(z_b)
+
+        def point(s):
+            z = (1.0 - s)*z_a + s*z_b
+            return T_a + s*(T_b - T_a), P_a + s*(P_b - P_a), z/np.sum(z)
+
+        def evaluate(s, start=None):
+            T, P, z = point(s)
+            out = None
+            if start is not None:
+                out = self.main_handler(compobjs, z, T, P,
+                                        K_init=start['K_calc'],
+                                        alpha_init=start['alpha_calc'],
+                                        theta_init=start['theta_calc'],
+                                        ref_phase=start['ref_phase'],
+                                        stall_iter=20)
+            if (out is None) or (out[4] > flash_tol):
+                self.robust_flash(compobjs, z, T, P, tol=flash_tol, **kwargs)
+            state = self.calc_state()
+            g = state['alpha_calc'] - state['theta_calc']
+            return {'s': s, 'state': state, 'g': g,
+                    'present': state['alpha_calc'] > alpha_min}
+
+        end_a = evaluate(0.0)
+        end_b = evaluate(1.0)
+        nflash = 2
+        if (end_a['present'] == end_b['present']).all():
+            raise ValueError("""Both states have the same phase assemblage.""")
+
+        def crossing(side, other):
+            # Zero of theta of the phases absent on one side, extrapolated
+            # from the last two flashes on that side.
+            if len(side) < 2:
+                return []
+            p0, p1 = side[-2], side[-1]
+            absent = ~p1['present'] & other[-1]['present']
+            d_theta = p1['state']['theta_calc'] - p0['state']['theta_calc']
+            ok = absent & (d_theta != 0)
+            return list(p1['s'] - p1['state']['theta_calc'][ok]
+                        * (p1['s'] - p0['s'])/d_theta[ok])
+
+        def regula_falsi(end_a, end_b):
+            # First sign change of alpha - theta between the bracket ends.
+            changed = end_a['present'] != end_b['present']
+            g_a = end_a['g'][changed]
+            g_b = end_b['g'][changed]
+            sign_change = g_a*g_b < 0
+            if not sign_change.any():
+                return 0.5*(end_a['s'] + end_b['s'])
+            s_cross = end_a['s'] + ((end_b['s'] - end_a['s'])*g_a[sign_change]
+                                    / (g_a[sign_change] - g_b[sign_change]))
+            return np.min(s_cross)
+
+        def estimate(side_a, side_b):
+            s_a, s_b = side_a[-1]['s'], side_b[-1]['s']
+            cands = [s for s in (crossing(side_a, side_b)
+                                 + crossing(side_b, side_a))
+                     if s_a < s < s_b]
+            if cands:
+                return np.mean(cands)
+            return regula_falsi(side_a[-1], side_b[-1])
+
+        # Flashes on either side of the boundary, nearest last.
+        side_a, side_b = [end_a], [end_b]
+        widths = [1.0, 1.0]
+        updated = []
+        while (side_b[-1]['s'] - side_a[-1]['s'] > tol) and (nflash - 2 < maxiter):
+            s_a, s_b = side_a[-1]['s'], side_b[-1]['s']
+            if s_b - s_a > 0.5*widths[-2]:
+                # Slow progress, so bisect.
+                s_new = 0.5*(s_a + s_b)
+            else:
+                s_new = estimate(side_a, side_b)
+                # Step across the boundary when one end is not moving.
+                if updated[-2:] == [0, 0]:
+                    s_new += 0.5*tol
+                elif updated[-2:] == [1, 1]:
+                    s_new -= 0.5*tol
+            margin = 1e-3*(s_b - s_a)
+            s_new = min(max(s_new, s_a + margin), s_b - margin)
+            widths.append(s_b - s_a)
+
+            if s_new - s_a < s_b - s_new:
+                new = evaluate(s_new, side_a[-1]['state'])
+            else:
+                new = evaluate(s_new, side_b[-1]['state'])
+            nflash += 1
+            if (new['present'] == end_a['present']).all():
+                side_a.append(new)
+                updated.append(0)
+            else:
+                side_b.append(new)
+                updated.append(1)
+
+        end_a, end_b = side_a[-1], side_b[-1]
+        T, P, z = point(estimate(side_a, side_b))
+        values = [T, P, z, end_a['present'], end_b['present'], nflash]
+        return values
+
+    def invariant_point(self, phases, T0, P0, z=None, x_init=None,
+                        tol=1e-8, maxiter=50):
+        """Temperature and pressure at which a set of phases coexists
+
+        Parameters
+        ----------
+        phases : list, tuple
+            Names of Nc + 2 phases from 'self.phases', e.g. aqueous,
+            vapor, lhc and s1 for a binary
+        T0 : float
+            Initial temperature in Kelvin
+        P0 : float
+            Initial pressure in bar
+        z : list, numpy array, optional
+            Total composition of a flash at T0 and P0 that provides the
+            initial compositions, equimolar by default
+        x_init : numpy array, optional
+            Initial composition of each non-hydrate phase in 'phases'
+            with size Nc x number of non-hydrate phases, used instead of
+            a flash
+
+        Returns
+        ----------
+        values : list
+            values[0] : float
+                Temperature in Kelvin
+            values[1] : float
+                Pressure in bar
+            values[2] : numpy array
+                Composition of each phase in 'phases' with size
+                Nc x (Nc + 2)
+            values[3] : int
+                Number of iterations required for convergence
+            values[4] : float
+                Maximum absolute residual
+
+        Notes
+        ----------
+        By the phase rule, Nc + 2 phases coexist at isolated points such
+        as quadruple points of binary systems. The unknowns are T, P and
+        the composition of each non-hydrate phase, and the equations are
+        equal log fugacities of each component with the first non-hydrate
+        phase, equal log fugacity of water for each hydrate phase, whose
+        composition follows from that fugacity, and unit sums of the
+        compositions. These are solved by a damped Newton method with the
+        derivatives of the eos objects, in which hydrate phases hold the
+        langmuir constants fixed as in 'newton_system'. A ValueError is
+        raised when two phases with the same eos reach the same
+        composition. No phase counts as current in 'eos_current'
+        afterwards.
+        """
+        inds = []
+        for phase in phases:
+            if phase not in self.phases:
+                raise ValueError("""Phase '{0}' is not one of the phases of
+                                 this controller.""".format(phase))
+            inds.append(self.phases.index(phase))
+        if len(set(inds)) != self.Nc + 2:
+            raise ValueError("""Invariant points require Nc + 2 = {0}
+                             distinct phases.""".format(self.Nc + 2))
+        hyd_inds = [ind for ind in inds if ind in self.hyd_phases.values()]
+        fluid_inds = [ind for ind in inds if ind not in hyd_inds]
+        if not fluid_inds:
+            raise ValueError("""At least one non-hydrate phase is required.""")
+        Nc = self.Nc
+        m = len(fluid_inds)
+        ref = fluid_inds[0]
+
+        if x_init is None:
+            if z is None:
+                z = np.ones(Nc)/Nc
+            self.main_handler(self.compobjs, z, T0, P0)
+            X = self.x_calc[:, fluid_inds].copy()
+        else:
+            X = np.array(x_init, dtype=float).reshape(Nc, m)
+        T = float(T0)
+        P = float(P0)
+
+        n_var = 2 + Nc*m
+        iterations = 0
+        error = np.inf
+        while iterations < maxiter:
+            # Residual and jacobian at the current T, P and compositions.
+            lnf = np.zeros([Nc, m])
+            dlnf = np.zeros([Nc, m, n_var])
+            for jj, ind in enumerate(fluid_inds):
+                eos = self.fug_list[ind]
+                lnf[:, jj] = np.log(self.phase_fugacity(ind, T, P, X[:, jj]))
+                dlnf[:, jj, 0] = eos.dlnf_dT(X[:, jj])
+                dlnf[:, jj, 1] = eos.dlnf_dP(X[:, jj])
+                dlnf[:, jj, 2 + jj*Nc:2 + (jj + 1)*Nc] = eos.dlnf_dx(X[:, jj])
+            self.ref_fug = np.exp(lnf[:, 0])
+
+            res = []
+            jac = []
+            for jj in range(1, m):
+                res.append(lnf[:, jj] - lnf[:, 0])
+                jac.append(dlnf[:, jj] - dlnf[:, 0])
+            for ind in hyd_inds:
+                eos = self.fug_list[ind]
+                lnf_hyd = np.log(self.phase_fugacity(ind, T, P, None))
+                dlnf_hyd = np.matmul(eos.dlnf_dlnfeq(), dlnf[:, 0])
+                dlnf_hyd[:, 0] += eos.dlnf_dT()
+                dlnf_hyd[:, 1] += eos.dlnf_dP()
+                res.append([lnf_hyd[self.h2oind] - lnf[self.h2oind, 0]])
+                jac.append([dlnf_hyd[self.h2oind] - dlnf[self.h2oind, 0]])
+            for jj in range(m):
+                res.append([np.sum(X[:, jj]) - 1.0])
+                row = np.zeros(n_var)
+                row[2 + jj*Nc:2 + (jj + 1)*Nc] = 1.0
+                jac.append([row])
+            res = np.concatenate(res)
+            jac = np.concatenate([np.atleast_2d(block) for block in jac])
+
+            error = np.max(np.abs(res))
+            if error < tol:
+                break
+            step = np.linalg.solve(jac, -res)
+            iterations += 1
+
+            # Limit the step in T and P and keep compositions positive.
+            dX = step[2:].reshape(m, Nc).T
+            lam = min(1.0, 5.0/max(abs(step[0]), 1e-300),
+                      0.2*P/max(abs(step[1]), 1e-300))
+            shrink = dX < 0
+            if shrink.any():
+                lam = min(lam, np.min(0.9*X[shrink]/(-dX[shrink])))
+            T += lam*step[0]
+            P += lam*step[1]
+            X += lam*dX
+
+        for jj in range(m):
+            for kk in range(jj):
+                if ((type(self.fug_list[fluid_inds[jj]])
+                     is type(self.fug_list[fluid_inds[kk]]))
+                        and (np.max(np.abs(X[:, jj] - X[:, kk])) < 1e-6)):
+                    raise ValueError("""Phases '{0}' and '{1}' converged to
+                                     the same composition, try 'x_init'.
+                                     """.format(self.phases[fluid_inds[kk]],
+                                                self.phases[fluid_inds[jj]]))
+
+        x = np.zeros([Nc, len(inds)])
+        for jj, ind in enumerate(inds):
+            if ind in hyd_inds:
+                x[:, jj] = self.fug_list[ind].hyd_comp()
+            else:
+                x[:, jj] = X[:, fluid_inds.index(ind)]
+        self.eos_current[:] = False
+
+        values = [T, P, x, iterations, error]
+        return values
+
+    def calc_state(self):
+        """Copy of the result of the last flash
+
+        Returns
+        ----------
+        state : dict
+            Reference phase and the '*_calc' attributes
+        """
+        state = {'ref_phase': self.ref_phase,
+                 'ref_ind': self.ref_ind,
+                 'completed': self.completed,
+                 'T_calc': self.T_calc,
+                 'K_calc': self.K_calc.copy(),
+                 'x_calc': self.x_calc.copy(),
+                 'alpha_calc': self.alpha_calc.copy(),
+                 'theta_calc': self.theta_calc.copy()}
+        return state
+
+    def restore_calc_state(self, state):
+        """Set the result of a flash from the output of 'calc_state'
+
+        Parameters
+        ----------
+        state : dict
+            Output of 'calc_state'
+
+        Notes
+        ----------
+        The eos objects are not updated, so no phase counts as current
+        in 'eos_current'.
+        """
+        for key, value in state.items():
+            setattr(self, key, value)
+        self.eos_current = np.zeros([self.Np], dtype=bool)
+
+
+    def calc_x(self, z, alpha, theta, K, T, P):
+        """Composition of each component in each phases
+
+        Parameters
+        ----------
+        z : list, numpy array
+            Total composition of each component with size Nc
+        alpha : list, numpy array
+            Molar phase fractions with size Np
+        theta : list, numpy array
+            Stability of phases with size Np
+        K : list, numpy array
+            Partition coefficients for each component
+            in each phase with size Nc x Np
         T : float
             Temperature in Kelvin
         P : float
@@ -1098,7 +2785,9 @@ class FlashController(object):
         fug_mat = self.calc_fugacity(T, P, x_mat)
         K_mat = np.ones_like(x_mat)
         for ii, phase in enumerate(self.phases):
-            if phase != self.ref_phase:
+            if not self.active_phases[ii]:
+                K_mat[:, ii] = self.K_frozen[:, ii]
+            elif phase != self.ref_phase:
                 K_mat[:, ii] = (fug_mat[:, self.ref_ind]/fug_mat[:, ii]
                                 * x_mat[:, ii]/x_mat[:, self.ref_ind])
         K = np.real(np.abs(K_mat))
@@ -1125,32 +2814,58 @@ class FlashController(object):
         """
         fug_out = np.zeros_like(x_mat)
         for ii, phase in enumerate(self.phases):
-            if phase == 'aqueous':
-                fug_out[:,ii] = self.fug_list[ii].calc(self.compobjs,
-                                                       T,
-                                                       P,
-                                                       x_mat[:,ii])
-
-            elif phase == 'vapor' or phase == 'lhc':
-                fug_out[:,ii] = self.fug_list[ii].calc(self.compobjs,
-                                                       T,
-                                                       P,
-                                                       x_mat[:, ii],
-                                                       phase=phase)
+            # Frozen phases are not evaluated.
+            if self.active_phases[ii] and ii not in self.hyd_phases.values():
+                fug_out[:, ii] = self.phase_fugacity(ii, T, P, x_mat[:, ii])
+
         # Update the reference phase fugacity, which cannot be hydrate.
         self.ref_fug = fug_out[:, self.ref_ind]
         self.ref_comp = x_mat[:, self.ref_ind]
 
         # Do this separately because we need the reference phase fugacity.
         for hyd_phase, ind in self.hyd_phases.items():
-            fug_out[:, ind] = self.fug_list[ind].calc(self.compobjs,
-                                                      T,
-                                                      P,
-                                                      [],
-                                                      self.ref_fug)
+            if self.active_phases[ind]:
+                fug_out[:, ind] = self.phase_fugacity(ind, T, P, x_mat[:, ind])
         return fug_out
 
-    def find_alphatheta_min(self, z, alpha0, theta0, K, print_iter_info=False, monitor_calc=False):
+    def phase_fugacity(self, ind, T, P, x):
+        """Fugacity of each component in a single phase
+
+        Parameters
+        ----------
+        ind : int
+            Index of phase in 'self.phases'
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+        x : numpy array
+            Composition of each component in the phase
+
+        Returns
+        ----------
+        fug : numpy array
+            Fugacity of each component in the phase with size Nc
+
+        Notes
+        ----------
+        Hydrate phases use the most recent reference phase fugacity
+        stored in 'self.ref_fug'.
+        """
+        phase = self.phases[ind]
+        if phase == 'aqueous':
+            fug = self.fug_list[ind].calc(self.compobjs, T, P, x)
+        elif phase == 'vapor' or phase == 'lhc':
+            fug = self.fug_list[ind].calc(self.compobjs, T, P, x,
+                                          phase=phase)
+        else:
+            fug = self.fug_list[ind].calc(self.compobjs, T, P, [],
+                                          self.ref_fug)
+        return fug
+
+    def find_alphatheta_min(self, z, alpha0, theta0, K, print_iter_info=False,
+                            monitor_calc=False, jac_update='newton',
+                            stall_ratio=0.5):
         """Algorithm for determining objective function minimization at fixed K
 
         Parameters
@@ -1165,6 +2880,14 @@ class FlashController(object):
             Partition coefficient matrix with size Nc x Np
         print_iter_info : bool
             Flag to print minimization progress
+        jac_update : str
+            Jacobian strategy, 'newton' forms the jacobian on every iteration,
+            'chord' reuses the inverse jacobian from the last refresh and
+            'broyden' applies rank-one updates to it
+        stall_ratio : float
+            For 'chord' and 'broyden', the inverse jacobian is refreshed
+            when the residual is not reduced below this fraction of the
+            previous residual or when the set of present phases changes
 
         Returns
         ----------
@@ -1197,29 +2920,15 @@ class FlashController(object):
         if type(K) != np.ndarray:
             K = np.asarray(K)
 
+        if jac_update not in ('newton', 'chord', 'broyden'):
+            raise ValueError(jac_update + """ is not a valid jacobian update.
+                             Use 'newton', 'chord' or 'broyden'.""")
+
         # Mask arrays to avoid the reference phase.
-        alf_mask = np.ones([2*self.Np], dtype=bool)
-        theta_mask = np.ones([2*self.Np], dtype=bool)
-        arr_mask = np.ones([self.Np], dtype=bool)
-        arrdbl_mask = np.ones([2*self.Np], dtype=bool)
-        mat_mask = np.ones([2*self.Np, 2*self.Np], dtype=bool)
-
-        # Populate masked arrays for 4 different types.
-        # Mask reference phase in alpha array
-        alf_mask[self.ref_ind] = 0
-        alf_mask[self.Np:] = 0
-        # Mask reference phase in theta array
-        theta_mask[0:self.Np] = 0
-        theta_mask[self.ref_ind + self.Np] = 0
-        # Mask reference phase in x array
-        arr_mask[self.ref_ind] = 0
-        arrdbl_mask[self.ref_ind] = 0
-        arrdbl_mask[self.ref_ind + self.Np] = 0
-        # Mask reference phase rows and columns in jacobian matrix
-        mat_mask[self.ref_ind, :] = 0
-        mat_mask[self.ref_ind + self.Np, :] = 0
-        mat_mask[:, self.ref_ind] = 0
-        mat_mask[:, self.ref_ind + self.Np] = 0
+        alf_mask, theta_mask, arr_mask, arrdbl_mask = self.ref_masks()
+        n_mod = np.sum(arr_mask)
+        jac_inv = None
+        self.jac_refresh = 0
 
         # Define 'x' as the concatenation of alpha and theta
 #        x = np.concatenate((alpha0, theta0))
@@ -1242,19 +2951,51 @@ class FlashController(object):
 
             # Solve for change in variables using non-reference phases
             res = objective(z, alpha_old, theta_old, K)
-            J = jacobian(z, alpha_old, theta_old, K)
-            J_mod = J[mat_mask].reshape([2*(self.Np - 1), 2*(self.Np - 1)])
             res_mod = res[arrdbl_mask]
-            # try:
-            #     dx_tmp = -np.linalg.solve(J_mod, res_mod)
-            # except:
-            #     dx_tmp = -np.matmul(np.linalg.pinv(J_mod), res_mod)
-            dx_tmp = -np.matmul(np.linalg.pinv(J_mod), res_mod)
-
-
+            if jac_update == 'newton':
+                jac_alpha, jac_theta, jac_alpha_y, jac_theta_y = jacobian(
+                    z, alpha_old, theta_old, K, blocks=True)
+                sub_mat = np.ix_(arr_mask, arr_mask)
+                d_alpha, d_theta = schur_step(jac_alpha[sub_mat],
+                                              jac_theta[sub_mat],
+                                              jac_alpha_y[arr_mask],
+                                              jac_theta_y[arr_mask],
+                                              res_mod[:n_mod],
+                                              res_mod[n_mod:])
+            else:
+                var_mod = np.concatenate((alpha_old[arr_mask],
+                                          theta_old[arr_mask]))
+                present = alpha_old > 0
+                if ((jac_inv is None)
+                        or (np.linalg.norm(res_mod)
+                            > stall_ratio * np.linalg.norm(res_prev))
+                        or (present != present_prev).any()):
+                    jac_alpha, jac_theta, jac_alpha_y, jac_theta_y = jacobian(
+                        z, alpha_old, theta_old, K, blocks=True)
+                    sub_mat = np.ix_(arr_mask, arr_mask)
+                    jac_inv = schur_inverse(jac_alpha[sub_mat],
+                                            jac_theta[sub_mat],
+                                            jac_alpha_y[arr_mask],
+                                            jac_theta_y[arr_mask])
+                    self.jac_refresh += 1
+                elif jac_update == 'broyden':
+                    # Good Broyden update of the inverse jacobian using the
+                    # step that was actually taken after limiting.
+                    d_var = var_mod - var_prev
+                    jinv_dres = np.matmul(jac_inv, res_mod - res_prev)
+                    denom = np.dot(d_var, jinv_dres)
+                    if abs(denom) > 1e-14:
+                        jac_inv += np.outer(d_var - jinv_dres,
+                                            np.matmul(d_var, jac_inv)) / denom
+                step = -np.matmul(jac_inv, res_mod)
+                d_alpha, d_theta = step[:n_mod], step[n_mod:]
+                var_prev = var_mod
+                res_prev = res_mod
+                present_prev = present
 
             # Populate dx for non-reference phases
-            dx[arrdbl_mask] = dx_tmp
+            dx[alf_mask] = d_alpha
+            dx[theta_mask] = d_theta
 
             # Determine error
             nres = np.linalg.norm(res)
@@ -1311,9 +3052,522 @@ class FlashController(object):
         new_values = [alpha_new, theta_new]
         return new_values
 
+    def fixed_K_split(self, z, K):
+        """Phase split at fixed K without a starting point
+
+        Parameters
+        ----------
+        z : list, numpy array
+            Molar fraction of each component with size Nc
+        K : numpy array
+            Partition coefficient matrix relative to the reference phase
+            with size Nc x Np
+
+        Returns
+        ----------
+        new_values : list or None
+            Same as 'find_alphatheta_min', or None if the split did not
+            converge
+            new_values[0] : numpy array
+                Molar phase fractions with size Np
+            new_values[1] : numpy array
+                Phase stabilities with size Np
+
+        Notes
+        ----------
+        Uses 'rachford_rice.phase_split', which brackets the two-phase
+        root and solves more phases as a convex minimization, instead of
+        the Newton iteration of 'find_alphatheta_min' from alpha = 1/Np.
+        The stabilities are shifted by the stability of the reference
+        phase, limited to 1.5 and treated with the technique of Gupta as
+        in 'find_alphatheta_min'. An absent reference phase thus ends
+        with alpha = theta = 1e-10, after which 'main_handler' changes
+        the reference phase.
+        """
+        alpha, theta, converged = rr.phase_split(z, K)
+        if not converged:
+            return None
+        alpha = alpha/np.sum(alpha)
+        theta = np.minimum(1.5, np.maximum(0, theta - theta[self.ref_ind]))
+        alpha[alpha < 1e-10] = 0
+        theta[theta < 1e-10] = 0
+        change_ind = (alpha == 0) & (theta == 0)
+        alpha[change_ind] = 1e-10
+        theta[change_ind] = 1e-10
+        new_values = [alpha, theta]
+        return new_values
+
+    def newton_system(self, z, alpha, theta, K, x, K_fix):
+        """Residual and jacobian of the simultaneous alpha, theta and ln K system
+
+        Parameters
+        ----------
+        z : numpy array
+            Molar fraction of each component with size Nc
+        alpha : numpy array
+            Molar phase fractions with size Np
+        theta : numpy array
+            Phase stabilities with size Np
+        K : numpy array
+            Partition coefficient matrix with size Nc x Np
+        x : numpy array
+            Composition of each component in each phase from 'calc_x'
+            at alpha, theta and K with size Nc x Np
+        K_fix : numpy array
+            Partition coefficient matrix from 'calc_K' at x with size Nc x Np
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Residual of the objective function for non-reference phases
+                followed by ln(K) - ln(K_fix) for each non-reference phase
+            values[1] : numpy array
+                Jacobian of the residual wrt the non-reference alpha, theta
+                and ln(K), in the same order
+
+        Notes
+        ----------
+        Must be called directly after 'calc_K', such that the eos objects
+        hold the state at x. With w = K*exp(theta) and
+        E = 1 + sum(alpha*(w - 1)), the compositions are the normalized
+        z*w/E and the fixed point ln(K_fix) is
+        ln(phi_ref) - ln(phi_j). Composition derivatives of the fugacity
+        come from 'dlnf_dx' of each eos, and hydrate phases depend on
+        the reference phase fugacity through 'dlnf_dlnfeq' and 'dx_dlnfeq'.
+        Frozen phases are excluded in the same way as the reference phase.
+        """
+        alf_mask, theta_mask, arr_mask, arrdbl_mask = self.ref_masks()
+        phase_inds = np.flatnonzero(arr_mask)
+        n = len(phase_inds)
+        Nc = self.Nc
+        n_var = (2 + Nc)*n
+        identity = np.eye(Nc)
+
+        res = np.concatenate((
+            objective(z, alpha, theta, K)[arrdbl_mask],
+            (np.log(K) - np.log(K_fix))[:, phase_inds].flatten(order='F')))
+
+        # Phase split and stability rows.
+        jac_alpha, jac_theta, jac_alpha_y, jac_theta_y = jacobian(
+            z, alpha, theta, K, blocks=True)
+        K_exp, stability_mat, denominator = phase_split_terms(z, alpha,
+                                                              theta, K)
+        jac_obj = np.zeros([2*n, n_var])
+        sub_mat = np.ix_(arr_mask, arr_mask)
+        jac_obj[:n, :n] = jac_alpha[sub_mat]
+        jac_obj[:n, n:2*n] = jac_theta[sub_mat]
+        jac_obj[n:, :n] = np.diag(jac_alpha_y[arr_mask])
+        jac_obj[n:, n:2*n] = np.diag(jac_theta_y[arr_mask])
+
+        # Derivative of ln(E) wrt each variable.
+        dlnE = np.zeros([Nc, n_var])
+        dlnE[:, :n] = stability_mat[:, phase_inds] / denominator[:, np.newaxis]
+        dlnE[:, n:2*n] = (K_exp[:, phase_inds] * alpha[phase_inds]
+                          / denominator[:, np.newaxis])
+        for jj, ind in enumerate(phase_inds):
+            cols = slice(2*n + jj*Nc, 2*n + (jj + 1)*Nc)
+            dlnE[:, cols] = np.diag(alpha[ind] * K_exp[:, ind] / denominator)
+            jac_obj[:n, cols] = -(stability_mat[:, phase_inds]
+                                  * (z * alpha[ind] * K_exp[:, ind]
+                                     / denominator**2)[:, np.newaxis]).T
+            jac_obj[jj, cols] += z * K_exp[:, ind] / denominator
+
+        def dlnx(dlnx_unnorm, x_phase):
+            # Normalization of the composition
+            return dlnx_unnorm - np.matmul(x_phase, dlnx_unnorm)[np.newaxis, :]
+
+        x_ref = x[:, self.ref_ind]
+        dlnx_ref = dlnx(-dlnE, x_ref)
+        dlnf_dlnx_ref = (self.fug_list[self.ref_ind].dlnf_dx(x_ref)
+                         * x_ref[np.newaxis, :])
+        dlnf_ref = np.matmul(dlnf_dlnx_ref, dlnx_ref)
+        dlnphi_ref = dlnf_ref - dlnx_ref
+        # 'calc_x' finds the hydrate composition before normalizing the
+        # reference composition.
+        dlnf_ref_unnorm = np.matmul(dlnf_dlnx_ref, -dlnE)
+
+        jac_K = np.zeros([Nc*n, n_var])
+        jac_K[:, 2*n:] = np.eye(Nc*n)
+        for jj, ind in enumerate(phase_inds):
+            rows = slice(jj*Nc, (jj + 1)*Nc)
+            if ind in self.hyd_phases.values():
+                eos = self.fug_list[ind]
+                dlnf_hyd = np.matmul(eos.dlnf_dlnfeq(), dlnf_ref)
+                dlnx_hyd = np.matmul(eos.dx_dlnfeq() / x[:, ind][:, np.newaxis],
+                                     dlnf_ref_unnorm)
+                dlnphi = dlnf_hyd - dlnx_hyd
+            else:
+                dlnw = np.zeros([Nc, n_var])
+                dlnw[:, n + jj] = 1.0
+                dlnw[:, 2*n + jj*Nc:2*n + (jj + 1)*Nc] = identity
+                dlnx_phase = dlnx(dlnw - dlnE, x[:, ind])
+                dlnphi = np.matmul(
+                    self.fug_list[ind].dlnf_dx(x[:, ind])
+                    * x[:, ind][np.newaxis, :] - identity,
+                    dlnx_phase)
+            jac_K[rows, :] -= dlnphi_ref - dlnphi
+
+        values = [res, np.concatenate((jac_obj, jac_K), axis=0)]
+        return values
+
+    def newton_flash_step(self, z, alpha, theta, K, x, K_fix):
+        """Simultaneous Newton update of alpha, theta and K
+
+        Parameters
+        ----------
+        z : numpy array
+            Molar fraction of each component with size Nc
+        alpha : numpy array
+            Molar phase fractions with size Np
+        theta : numpy array
+            Phase stabilities with size Np
+        K : numpy array
+            Partition coefficient matrix with size Nc x Np
+        x : numpy array
+            Composition of each component in each phase from 'calc_x'
+            at alpha, theta and K with size Nc x Np
+        K_fix : numpy array
+            Partition coefficient matrix from 'calc_K' at x with size Nc x Np
+
+        Returns
+        ----------
+        new_values : list
+            new_values[0] : numpy array
+                Molar phase fractions with size Np
+            new_values[1] : numpy array
+                Phase stabilities with size Np
+            new_values[2] : numpy array
+                Partition coefficient matrix with size Nc x Np
+
+        Notes
+        ----------
+        Changes in ln(K) are limited to 1. Unlike 'find_alphatheta_min',
+        the steps in alpha and theta are not capped, since the step is only
+        taken close to the solution. alpha is only clipped to [0, 1] and
+        renormalized, and theta is clipped to [0, 1.5], before the
+        technique of Gupta is applied.
+        """
+        alf_mask, theta_mask, arr_mask, arrdbl_mask = self.ref_masks()
+        n = np.sum(arr_mask)
+        res, jac = self.newton_system(z, alpha, theta, K, x, K_fix)
+        dx = -np.matmul(np.linalg.pinv(jac), res)
+
+        alpha_new = alpha.copy()
+        theta_new = theta.copy()
+        K_new = K.copy()
+        alpha_new[arr_mask] = np.minimum(1, np.maximum(0, alpha[arr_mask]
+                                                       + dx[:n]))
+        alpha_new[self.ref_ind] = np.minimum(
+            1, np.maximum(0, 1 - np.sum(alpha_new[arr_mask])))
+        alpha_new *= np.sum(alpha_new)**(-1)
+        theta_new[arr_mask] = np.minimum(1.5, np.maximum(0, theta[arr_mask]
+                                                         + dx[n:2*n]))
+        K_new[:, arr_mask] = K[:, arr_mask] * np.exp(np.clip(
+            dx[2*n:].reshape([self.Nc, n], order='F'), -1.0, 1.0))
+
+        # Use technique of Gupta as in 'find_alphatheta_min'
+        alpha_new[alpha_new < 1e-10] = 0
+        theta_new[theta_new < 1e-10] = 0
+        change_ind = (alpha_new < 1e-10) & (theta_new < 1e-10)
+        change_ind[self.ref_ind] = False
+        alpha_new[change_ind] = 1e-10
+        theta_new[change_ind] = 1e-10
+        new_values = [alpha_new, theta_new, K_new]
+        return new_values
+
+    def sensitivities(self, P):
+        """Derivatives of a converged flash wrt temperature, pressure and feed
+
+        Parameters
+        ----------
+        P : float
+            Pressure in bar of the last call to 'main_handler'
+
+        Returns
+        ----------
+        values : list
+            Derivatives wrt temperature, pressure and the feed fraction
+            of each component in the last axis, in that order, with size
+            2 + Nc
+            values[0] : numpy array
+                Derivative of molar phase fractions with size Np x (2 + Nc)
+            values[1] : numpy array
+                Derivative of compositions with size Nc x Np x (2 + Nc)
+            values[2] : numpy array
+                Derivative of phase stabilities with size Np x (2 + Nc)
+
+        Notes
+        ----------
+        By the implicit function theorem, the derivatives of the
+        alpha, theta and ln K variables of 'newton_system' follow from
+        one linear solve with its jacobian at the converged state, with a
+        right-hand side column per input made of the explicit derivatives
+        of the residual. Feed fractions are treated as independent; the
+        result does not change when the feed is scaled, so combinations
+        with dz summing to zero give the derivatives along normalized
+        feeds. Only phases present at convergence enter the system, in the
+        same way as frozen phases, and absent phases have zero entries.
+        A present phase with the same eos and composition as another one,
+        e.g. a trivial lhc copy of the vapor, is counted with that phase
+        and takes over its composition derivatives. Hydrate rows use
+        'dlnf_dlnfeq' and 'dx_dlnfeq', which hold the langmuir constants
+        fixed, so with several guests the derivatives may be off by a few
+        percent. The derivatives hold as long as the phase assemblage
+        does not change.
+        """
+        T = self.T_calc
+        z = self.feed
+        alpha = self.alpha_calc
+        theta = self.theta_calc
+        K = self.K_calc
+        Nc = self.Nc
+        n_par = 2 + Nc
+        self.active_phases = np.ones([self.Np], dtype=bool)
+
+        # Bring every eos to the converged state.
+        x = self.calc_x(z, alpha, theta, K, T, P)
+        K_fix = self.calc_K(T, P, x)
+        self.eos_current[:] = False
+
+        # Absent phases and duplicates would leave the system singular.
+        present = alpha > 1e-8
+        present[self.ref_ind] = True
+        kept = [self.ref_ind]
+        twins = {}
+        for ii in np.flatnonzero(present):
+            if ii == self.ref_ind:
+                continue
+            for kk in kept:
+                if ((type(self.fug_list[ii]) is type(self.fug_list[kk]))
+                        and (np.max(np.abs(x[:, ii] - x[:, kk])) < 1e-6)):
+                    twins[ii] = kk
+                    present[ii] = False
+                    break
+            else:
+                kept.append(ii)
+        self.active_phases = present
+        res, jac = self.newton_system(z, alpha, theta, K, x, K_fix)
+        alf_mask, theta_mask, arr_mask, arrdbl_mask = self.ref_masks()
+        phase_inds = np.flatnonzero(arr_mask)
+        n = len(phase_inds)
+        K_exp, stability_mat, denominator = phase_split_terms(z, alpha,
+                                                              theta, K)
+
+        def dlnx(dlnx_unnorm, x_phase):
+            # Normalization of the composition
+            return dlnx_unnorm - np.matmul(x_phase, dlnx_unnorm)[np.newaxis, :]
+
+        # Explicit derivatives of ln z, i.e. of each unnormalized x.
+        dlnz = np.zeros([Nc, n_par])
+        dlnz[:, 2:] = np.diag(np.where(z > 0, 1.0/np.where(z > 0, z, 1.0), 0.0))
+
+        def explicit(eos, x_phase):
+            # Derivatives of log fugacity at fixed unnormalized x.
+            dlnf_dlnx = eos.dlnf_dx(x_phase) * x_phase[np.newaxis, :]
+            dlnf_TP = np.zeros([Nc, n_par])
+            dlnf_TP[:, 0] = eos.dlnf_dT(x_phase)
+            dlnf_TP[:, 1] = eos.dlnf_dP(x_phase)
+            return dlnf_dlnx, dlnf_TP
+
+        x_ref = x[:, self.ref_ind]
+        dlnf_dlnx_ref, dlnf_TP_ref = explicit(self.fug_list[self.ref_ind],
+                                              x_ref)
+        dlnx_ref = dlnx(dlnz, x_ref)
+        dlnf_ref = np.matmul(dlnf_dlnx_ref, dlnx_ref) + dlnf_TP_ref
+        dlnf_ref_unnorm = np.matmul(dlnf_dlnx_ref, dlnz) + dlnf_TP_ref
+        dlnphi_ref = dlnf_ref - dlnx_ref
+
+        rhs = np.zeros([len(res), n_par])
+        rhs[:n, 2:] = (stability_mat[:, phase_inds]
+                       / denominator[:, np.newaxis]).T
+        hyd_TP = {}
+        for jj, ind in enumerate(phase_inds):
+            eos = self.fug_list[ind]
+            if ind in self.hyd_phases.values():
+                dlnf_hyd = np.matmul(eos.dlnf_dlnfeq(), dlnf_ref)
+                dlnf_hyd[:, 0] += eos.dlnf_dT()
+                dlnf_hyd[:, 1] += eos.dlnf_dP()
+                hyd_TP[ind] = eos.dx_dTP(self.ref_fug)
+                dx_hyd = np.matmul(eos.dx_dlnfeq(), dlnf_ref_unnorm)
+                dx_hyd[:, 0] += hyd_TP[ind][0]
+                dx_hyd[:, 1] += hyd_TP[ind][1]
+                dlnphi = dlnf_hyd - dx_hyd / x[:, ind][:, np.newaxis]
+            else:
+                dlnf_dlnx, dlnf_TP = explicit(eos, x[:, ind])
+                dlnx_phase = dlnx(dlnz, x[:, ind])
+                dlnphi = (np.matmul(dlnf_dlnx, dlnx_phase) + dlnf_TP
+                          - dlnx_phase)
+            rhs[2*n + jj*Nc:2*n + (jj + 1)*Nc, :] = -(dlnphi_ref - dlnphi)
+
+        dvar = np.linalg.solve(jac, -rhs)
+
+        dalpha = np.zeros([self.Np, n_par])
+        dtheta = np.zeros([self.Np, n_par])
+        dlnK = np.zeros([Nc, self.Np, n_par])
+        dalpha[phase_inds] = dvar[:n]
+        dalpha[self.ref_ind] = -np.sum(dvar[:n], axis=0)
+        dtheta[phase_inds] = dvar[n:2*n]
+        dlnK[:, phase_inds] = np.transpose(
+            dvar[2*n:].reshape([n, Nc, n_par]), (1, 0, 2))
+
+        # Compositions follow from z*K*exp(theta)/E, normalized.
+        dlnw = dlnK + dtheta[np.newaxis, :, :]
+        dlnE = (np.einsum('ij,jp->ip', stability_mat, dalpha)
+                + np.einsum('ij,ijp->ip', alpha*K_exp, dlnw)
+                ) / denominator[:, np.newaxis]
+        dx = np.zeros([Nc, self.Np, n_par])
+        for ind in np.flatnonzero(present):
+            if ind in self.hyd_phases.values():
+                continue
+            dx[:, ind] = x[:, ind][:, np.newaxis] * dlnx(
+                dlnz + dlnw[:, ind] - dlnE, x[:, ind])
+        dlnf_ref_total = (np.matmul(dlnf_dlnx_ref, dlnz - dlnE)
+                          + dlnf_TP_ref)
+        for ind in hyd_TP:
+            dx[:, ind] = np.matmul(self.fug_list[ind].dx_dlnfeq(),
+                                   dlnf_ref_total)
+            dx[:, ind, 0] += hyd_TP[ind][0]
+            dx[:, ind, 1] += hyd_TP[ind][1]
+        for ind, twin in twins.items():
+            dx[:, ind] = dx[:, twin]
+        self.active_phases = np.ones([self.Np], dtype=bool)
+
+        values = [dalpha, dx, dtheta]
+        return values
+
     # Initialize the partition coefficient matrix based on P, T and components
     # Provide the option to specify the feed to predict the appropriate
     # reference phase or the option to specify the reference phase explicitly.
+    def calc_enthalpy(self, T, P):
+        """Enthalpy and heat capacity of each phase after a flash
+
+        Parameters
+        ----------
+        T : float
+            Temperature in Kelvin of the last call to 'main_handler'
+        P : float
+            Pressure in bar of the last call to 'main_handler'
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Molar enthalpy of each phase in J/mol with size Np
+            values[1] : numpy array
+                Molar heat capacity of each phase in J/mol-K with size Np
+            values[2] : float
+                Enthalpy of the mixture in J per mol of feed
+            values[3] : numpy array
+                Dissociation enthalpy of each hydrate phase into water
+                in the aqueous phase and guests in the most abundant
+                hydrocarbon phase in J per mol of hydrate with size Np.
+                Zero for non-hydrate phases.
+
+        Notes
+        ----------
+        Uses the eos states left by the flash so that only phases that
+        were frozen at convergence are re-evaluated. Absent phases are
+        reported at their incipient compositions.
+        """
+        x = self.x_calc
+        for ii in np.where(~self.eos_current)[0]:
+            if ii not in self.hyd_phases.values():
+                self.phase_fugacity(ii, T, P, x[:, ii])
+        for ii in np.where(~self.eos_current)[0]:
+            if ii in self.hyd_phases.values():
+                self.phase_fugacity(ii, T, P, x[:, ii])
+        self.eos_current[:] = True
+
+        h_phase = np.zeros([self.Np])
+        cp_phase = np.zeros([self.Np])
+        h_partial = np.zeros([self.Nc, self.Np])
+        for ii in self.nonhyd_phases:
+            h_partial[:, ii] = self.fug_list[ii].partial_enthalpy(x[:, ii])
+            h_phase[ii] = np.dot(x[:, ii], h_partial[:, ii])
+            cp_phase[ii] = self.fug_list[ii].heat_capacity(x[:, ii])
+        for hyd_phase, ind in self.hyd_phases.items():
+            h_phase[ind] = self.fug_list[ind].enthalpy()
+            cp_phase[ind] = self.fug_list[ind].heat_capacity()
+        h_total = np.dot(self.alpha_calc, h_phase)
+
+        # Hydrate dissociation products.
+        h_diss = np.zeros([self.Np])
+        if self.hyd_phases:
+            if 'aqueous' in self.phases:
+                water_src = self.phases.index('aqueous')
+            else:
+                water_src = self.ref_ind
+            hc_inds = [ii for ii in self.nonhyd_phases
+                       if self.phases[ii] != 'aqueous']
+            if hc_inds:
+                guest_src = hc_inds[np.argmax(self.alpha_calc[hc_inds])]
+            else:
+                guest_src = self.ref_ind
+            h_products = h_partial[:, guest_src].copy()
+            h_products[self.h2oind] = h_partial[self.h2oind, water_src]
+            for hyd_phase, ind in self.hyd_phases.items():
+                x_hyd = self.fug_list[ind].hyd_comp()
+                h_diss[ind] = np.dot(x_hyd, h_products) - h_phase[ind]
+
+        values = [h_phase, cp_phase, h_total, h_diss]
+        return values
+
+    def mixture_enthalpy(self, alpha, x):
+        """Enthalpy and heat capacity of the mixture from the current eos states
+
+        Parameters
+        ----------
+        alpha : numpy array
+            Molar phase fraction of each phase with size Np
+        x : numpy array
+            Composition of each component in each phase with size Nc x Np.
+            Must match the last fugacity calculation of each present phase
+
+        Returns
+        ----------
+        values : list
+            values[0] : float
+                Enthalpy of the mixture in J per mol of feed
+            values[1] : float
+                Heat capacity of the mixture at fixed phase amounts and
+                compositions in J/mol-K
+        """
+        H_mix = 0.0
+        C_mix = 0.0
+        for ii in np.where(alpha > 0)[0]:
+            if ii in self.hyd_phases.values():
+                H_mix += alpha[ii] * self.fug_list[ii].enthalpy()
+                C_mix += alpha[ii] * self.fug_list[ii].heat_capacity()
+            else:
+                H_mix += alpha[ii] * self.fug_list[ii].enthalpy(x[:, ii])
+                C_mix += alpha[ii] * self.fug_list[ii].heat_capacity(x[:, ii])
+        values = [H_mix, C_mix]
+        return values
+
+    def dlnK_dT(self, x):
+        """Temperature derivative of log partition coefficients at fixed x
+
+        Parameters
+        ----------
+        x : numpy array
+            Composition of each component in each phase with size Nc x Np.
+            Must match the last fugacity calculation of each active phase
+
+        Returns
+        ----------
+        dlnK : numpy array
+            Derivative of log K wrt temperature in 1/K with size Nc x Np.
+            Zero for the reference phase, frozen phases and hydrate phases,
+            whose partition coefficients are refreshed by 'calc_K'
+        """
+        dlnK = np.zeros([self.Nc, self.Np])
+        dlnf_ref = self.fug_list[self.ref_ind].dlnf_dT(x[:, self.ref_ind])
+        for ii in self.nonhyd_phases:
+            if (ii != self.ref_ind) and self.active_phases[ii]:
+                dlnK[:, ii] = dlnf_ref - self.fug_list[ii].dlnf_dT(x[:, ii])
+        return dlnK
+
     def make_ideal_K_mat(self, compobjs, T, P, **kwargs):
         """Ideal partition coefficient initialization routine
 
@@ -1321,16 +3575,23 @@ class FlashController(object):
         ----------
         compobjs : list
             List of components
-        T : float
+        T : float, numpy array
             Temperature in Kelvin
-        P : float
+        P : float, numpy array
             Pressure in bar
 
         Returns
         ----------
         K_mat_ref : numpy array
             Ideal partition coefficients for
-            each component in each phase with size Nc x Np
+            each component in each phase with size Nc x Np, or
+            Nc x Np x S for arrays of T and P with broadcast shape S
+
+        Notes
+        ----------
+        Results for scalar T and P are cached per temperature, pressure,
+        reference phase and phases, so repeated initialization at the same
+        conditions does not re-evaluate the correlations.
         """
         if not hasattr(compobjs, '__iter__'):
             compobjs = [compobjs]
@@ -1354,35 +3615,48 @@ class FlashController(object):
         else:
             phase_return = self.phases
 
-        K_all_mat = make_ideal_K_allmat(compobjs, T, P)
-        K_mat_ref = np.zeros([len(compobjs), len(phase_return)])
+        if np.ndim(T) or np.ndim(P):
+            return self.ideal_K_from_allmat(compobjs, T, P, phase_return)
 
-        K_refdict = K_transform[self.ref_phase]
-        for ii, phase in enumerate(phase_return):
-            trans_tuple = K_refdict[phase]
-            if type(trans_tuple) is int:
-                if trans_tuple == 9:
-                    K_mat_ref[:, ii] = 1
-                else:
-                    K_mat_ref[:, ii] = K_all_mat[:, trans_tuple]
-            else:
-                if type(trans_tuple[0]) is int:
-                    if type(trans_tuple[1]) is int:
-                        if trans_tuple[0] == 9:
-                            K_mat_ref[:, ii] = 1/K_all_mat[:, trans_tuple[1]]
-                        else:
-                            K_mat_ref[:, ii] = (K_all_mat[:, trans_tuple[0]]
-                                                / K_all_mat[:, trans_tuple[1]])
-                    else:
-                        K_mat_ref[:, ii] = (
-                                K_all_mat[:, trans_tuple[0]]
-                                / (K_all_mat[:, trans_tuple[1][0]]
-                                   * K_all_mat[:, trans_tuple[1][1]]))
-                else:
-                    K_mat_ref[:, ii] = (
-                            (K_all_mat[:, trans_tuple[0][0]]
-                             * K_all_mat[:, trans_tuple[0][1]])
-                            / K_all_mat[:, trans_tuple[1]])
+        key = (T, P, self.ref_phase, tuple(phase_return),
+               tuple(comp.compname for comp in compobjs))
+        if key not in self._ideal_K_cache:
+            if len(self._ideal_K_cache) >= 256:
+                self._ideal_K_cache.clear()
+            K_mat_ref = self.ideal_K_from_allmat(compobjs, T, P, phase_return)
+            K_mat_ref.setflags(write=False)
+            self._ideal_K_cache[key] = K_mat_ref
+        return self._ideal_K_cache[key].copy()
+
+    def ideal_K_from_allmat(self, compobjs, T, P, phases):
+        """Ideal partition coefficients relative to the reference phase
+
+        Parameters
+        ----------
+        compobjs : list
+            List of components
+        T : float, numpy array
+            Temperature in Kelvin
+        P : float, numpy array
+            Pressure in bar
+        phases : list
+            Phases of the returned partition coefficient matrix
+
+        Returns
+        ----------
+        K_mat_ref : numpy array
+            Ideal partition coefficients for each component in each phase
+            with size Nc x Np, or Nc x Np x S for arrays of T and P with
+            broadcast shape S
+        """
+        K_all_mat = make_ideal_K_allmat(compobjs, T, P)
+        exponents = compile_K_transform(self.ref_phase, phases)
+        new_axes = (1,) * (K_all_mat.ndim - 2)
+        K_mat_ref = np.ones((len(compobjs), len(phases)) + K_all_mat.shape[2:])
+        for col in np.flatnonzero(np.any(exponents != 0, axis=1)):
+            K_mat_ref = K_mat_ref * (
+                K_all_mat[:, col, np.newaxis]
+                ** exponents[col].reshape((len(phases),) + new_axes))
         return K_mat_ref
 
 
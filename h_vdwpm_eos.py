@@ -25,8 +25,8 @@ temperature, and structure.
         Spherical kihara potential
 """
 import numpy as np
-from scipy.integrate import quad
-import pdb
+
+import shared_tables
 
 # Constants
 R = 8.3144621  # universal gas constant in J/mol-K
@@ -103,10 +103,24 @@ class HydrateEos(object):
         Performs that calculates cage occupancies from langmuir constants.
     delta_mu_func :
         Calculates chemical potential difference according to van der Waals.
+    ddelta_mu_dlnf :
+        Derivative of chemical potential difference wrt log guest fugacity.
+    dlnf_dlnfeq :
+        Derivative of log fugacity wrt log equilibrium fugacity.
+    dlnf_dT :
+        Derivative of log fugacity wrt temperature.
+    dlnf_dP :
+        Derivative of log fugacity wrt pressure.
+    dx_dTP :
+        Derivatives of hydrate composition wrt temperature and pressure.
+    enthalpy :
+        Calculates molar enthalpy of hydrate phase.
     fugacity :
         Calculates fugacity of only water in the hydrate phase.
     calc:
         Main calculation for hydrate phase EOS.
+    calc_derivatives :
+        Fugacities and their derivatives for one or many states.
     """
     def __init__(self, comps, T, P, structure='s1'):
         """Hydrate EOS object for fugacity calculations.
@@ -331,6 +345,102 @@ class HydrateEos(object):
         )/self.Hs.Num_h2o
         return delta_mu
 
+    def ddelta_mu_dlnf(self):
+        """Derivative of chemical potential difference wrt log guest fugacity.
+
+        Returns
+        ----------
+        ddelta_mu : numpy array
+            Derivative of 'delta_mu_func' wrt the log of the equilibrium
+            fugacity of each component with size Nc.
+
+        Notes
+        ----------
+        Langmuir constants are held fixed, such that
+        dY_j/dln(f_k) = Y_j*(delta_jk - Y_k) in each cage type and the
+        derivative reduces to -(Nm_small*Y_small + Nm_large*Y_large)/Num_h2o.
+        """
+        ddelta_mu = -(self.Hs.Nm['small']*self.Y_small
+                      + self.Hs.Nm['large']*self.Y_large)/self.Hs.Num_h2o
+        return ddelta_mu
+
+    def dlnf_dlnfeq(self):
+        """Derivative of log fugacity wrt log equilibrium fugacity.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of component i (rows) in hydrate
+            wrt log of equilibrium fugacity of component k (columns) with
+            size Nc x Nc. Guest fugacities equal the equilibrium fugacities.
+
+        Notes
+        ----------
+        Must be called after 'calc' with the same equilibrium fugacity.
+        """
+        dlnf = np.eye(self.num_comps)
+        dlnf[self.water_ind, :] = self.ddelta_mu_dlnf()
+        return dlnf
+
+    def dlnf_dT(self):
+        """Derivative of log fugacity wrt temperature at fixed equilibrium fugacity.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of each component wrt temperature
+            in 1/K with size Nc.
+        """
+        pass
+
+    def dlnf_dP(self):
+        """Derivative of log fugacity wrt pressure at fixed equilibrium fugacity.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of each component wrt pressure
+            in 1/bar with size Nc.
+        """
+        pass
+
+    def dx_dTP(self, eq_fug):
+        """Derivatives of hydrate composition wrt temperature and pressure.
+
+        Parameters
+        ----------
+        eq_fug : numpy array
+            Equilibrium fugacity of each non-water component that will
+            be in equilibrium within some other phase.
+
+        Returns
+        ----------
+        derivs : list of numpy arrays
+            Derivative of molar fraction of each component wrt temperature
+            in 1/K and wrt pressure in 1/bar at fixed equilibrium fugacity.
+        """
+        pass
+
+    def enthalpy(self):
+        """Molar enthalpy of hydrate phase.
+
+        Returns
+        ----------
+        h : float
+            Molar enthalpy of hydrate phase in J/mol.
+
+        Notes
+        ----------
+        Must be called after 'calc'. Uses h = sum(x_i*(h_io - R*T**2*dln(f_i)/dT))
+        with the derivative taken at fixed equilibrium fugacity, which by
+        Gibbs-Duhem equals the derivative at fixed hydrate composition
+        when summed over components.
+        """
+        x = self.hyd_comp()
+        h_io = np.array([comp.enthalpy_ideal(self.T) for comp in self.comps])
+        h = np.dot(x, h_io - R*self.T**2*self.dlnf_dT())
+        return h
+
     def fugacity(self, comps, T, P, x, eq_fug):
         """Calculation of fugacity of water in hydrate.
 
@@ -389,6 +499,67 @@ class HydrateEos(object):
             fug = self.fugacity(comps, T, P, x, eq_fug)
         return fug
 
+    def calc_derivatives(self, comps, T, P, x, eq_fug):
+        """Fugacities and their derivatives for one or many states
+
+        Parameters
+        ----------
+        comps : list
+            List of components as 'Component' objects created with
+            'component_properties.py'.
+        T : float, numpy array
+            Temperature in Kelvin, either a single value or one per state.
+        P : float, numpy array
+            Pressure in bar, either a single value or one per state.
+        x : list, numpy array
+            Dummy list of molar fraction in hydrate phase to maintain
+            argument parallelism with other EOS's.
+        eq_fug : numpy array
+            Equilibrium fugacity of each non-water component with size Nc,
+            or with size m x Nc for m states.
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Fugacity of each component with size (m x) Nc
+            values[1] : numpy array
+                Derivative of log fugacity wrt log equilibrium fugacity
+                with size (m x) Nc x Nc
+            values[2] : numpy array
+                Derivative of log fugacity wrt temperature with size (m x) Nc
+            values[3] : numpy array
+                Derivative of log fugacity wrt pressure with size (m x) Nc
+
+        Notes
+        ----------
+        Hydrate composition follows from the equilibrium fugacity, so
+        derivatives are taken wrt it instead of molar fractions. States
+        are evaluated in order of temperature and pressure, such that
+        'make_constant_mats' is called once per distinct pair.
+        """
+        eq_fug = np.asarray(eq_fug, dtype=float)
+        single = (eq_fug.ndim == 1)
+        eq_fug = np.atleast_2d(eq_fug)
+        n_states = eq_fug.shape[0]
+        T_vec = np.broadcast_to(np.asarray(T, dtype=float), [n_states])
+        P_vec = np.broadcast_to(np.asarray(P, dtype=float), [n_states])
+
+        fug = np.zeros([n_states, self.num_comps])
+        dlnf_dlnfeq = np.zeros([n_states, self.num_comps, self.num_comps])
+        dlnf_dT = np.zeros([n_states, self.num_comps])
+        dlnf_dP = np.zeros([n_states, self.num_comps])
+        for ii in np.lexsort((P_vec, T_vec)):
+            fug[ii] = self.calc(comps, T_vec[ii], P_vec[ii], x, eq_fug[ii])
+            dlnf_dlnfeq[ii] = self.dlnf_dlnfeq()
+            dlnf_dT[ii] = self.dlnf_dT()
+            dlnf_dP[ii] = self.dlnf_dP()
+
+        values = [fug, dlnf_dlnfeq, dlnf_dT, dlnf_dP]
+        if single:
+            values = [value[0] for value in values]
+        return values
+
 class HvdwpmEos(HydrateEos):
     """The child class for this EOS that perform various calculations.
 
@@ -419,14 +590,46 @@ class HvdwpmEos(HydrateEos):
         Setup integrand for calculation of langmuir constant.
     compute_integral_constants :
         Calculate portions of integral that do not depend on composition.
+    set_cage_radii :
+        Scale the radii of each cage shell.
     langmuir_consts :
         Calculate langmuir constants.
+    integrate_langmuir :
+        Numerically integrate langmuir constants at the current cage radii.
+    langmuir_table_name :
+        Name of the shared langmuir constant table of this structure.
+    publish_langmuir_table :
+        Tabulate langmuir constants and publish them for worker processes.
+    langmuir_from_table :
+        Interpolate langmuir constants from a published table.
     activity_func :
         Calculate activity of water in hydrate due to filling of cages.
     fugacity :
         Calculate fugacity of wate rin hydrate.
+    dlnf_dlnfeq :
+        Derivative of log fugacity wrt log equilibrium fugacity.
+    make_derivative_mats :
+        Performs derivative calculations that only depend on pressure and temperature.
+    dlnC_dTP :
+        Temperature and pressure derivatives of log langmuir constants.
+    dlnsize_dT :
+        Temperature derivative of log hydrate volume.
+    dactivity_dkappa :
+        Derivative of water activity wrt compressibility.
+    water_dlnf_dTP :
+        Temperature and pressure derivatives of log fugacity of water.
+    dlnf_dT :
+        Derivative of log fugacity wrt temperature.
+    dlnf_dP :
+        Derivative of log fugacity wrt pressure.
     hyd_comp :
         Conversion of cage occupancies to a hydrate composition.
+    dx_dlnfeq :
+        Derivative of hydrate composition wrt log equilibrium fugacity.
+    dx_dTP :
+        Derivatives of hydrate composition wrt temperature and pressure.
+    heat_capacity :
+        Calculates molar heat capacity of hydrate phase.
 
     Constants
     ----------
@@ -499,6 +702,18 @@ class HvdwpmEos(HydrateEos):
             Repulsive constant in small cages
         epulsive_small : float
             Repulsive constant in large cages
+        derivative_TP : tuple
+            Temperature and pressure of the last 'make_derivative_mats'
+        dgwbeta_dT : float
+            Temperature derivative of 'gwbeta_RT'
+        dgwbeta_dP : float
+            Pressure derivative of 'gwbeta_RT'
+        dgw0_dT : float
+            Temperature derivative of 'gw0_RT'
+        a_factor : float
+            Scaling of cage radii from lattice size, temperature and pressure
+        dlnf_TP_cache : tuple
+            State and result of the last 'water_dlnf_dTP'
         """
 
         # Inherit all properties from HydrateEos
@@ -527,6 +742,12 @@ class HvdwpmEos(HydrateEos):
         self.v_H = None
         self.repulsive_small = None
         self.repulsive_large = None
+        self.derivative_TP = None
+        self.dgwbeta_dT = None
+        self.dgwbeta_dP = None
+        self.dgw0_dT = None
+        self.a_factor = None
+        self.dlnf_TP_cache = (None, None)
 
         # Retrieve information for components and populate within vectors
         for ii, comp in enumerate(comps):
@@ -947,7 +1168,18 @@ class HvdwpmEos(HydrateEos):
             Compressibility of filled hydrate
         """
         Pfactor = self.hydrate_size(T_0, P, 1.0, kappa, dim='linear')
-        a_factor = (lattice_sz/self.Hs.a_norm)*self.lattice_Tfactor*Pfactor
+        self.a_factor = ((lattice_sz/self.Hs.a_norm)
+                         * self.lattice_Tfactor*Pfactor)
+        self.set_cage_radii(self.a_factor)
+
+    def set_cage_radii(self, a_factor):
+        """Scale the radii of each cage shell
+
+        Parameters
+        ----------
+        a_factor : float
+            Scaling of cage radii relative to the normal lattice
+        """
         for ii in range(len(self.Hs.R['sm'])):
             self.R_sm[ii] = self.Hs.R['sm'][ii + 1]*a_factor
         for ii in range(len(self.Hs.R['lg'])):
@@ -981,9 +1213,42 @@ class HvdwpmEos(HydrateEos):
         ----------
         Calculation will perform numerical integration and is numerically
         expensive. Other methods are possible, but not as accurate given
-        the accompanying empirically fit parameter set.
+        the accompanying empirically fit parameter set. When a table was
+        published with 'publish_langmuir_table' and T lies within its
+        temperatures, the constants are interpolated from it instead.
         """
         self.compute_integral_constants(T, P, lattice_sz, kappa)
+        table = shared_tables.get_table(self.langmuir_table_name(comps))
+        if table is not None:
+            C_table = self.langmuir_from_table(table, T, self.a_factor)
+            if C_table is not None:
+                return C_table
+        return self.integrate_langmuir(comps, T)
+
+    def integrate_langmuir(self, comps, T):
+        """Numerically integrate langmuir constants at the current cage radii
+
+        Parameters
+        ----------
+        comps : list
+            List of components as 'Component' objects created with
+            'component_properties.py'
+        T : float
+            Temperature in Kelvin
+
+        Returns
+        ----------
+        C_small : numpy array
+            Langmuir constants for each guest in small cage
+        C_large : numpy array
+            Langmuir constants for each guest in large cage
+
+        Notes
+        ----------
+        scipy is imported here so that importing this module stays cheap.
+        """
+        from scipy.integrate import quad
+
         C_small = np.zeros(self.num_comps)
         C_large = np.zeros(self.num_comps)
         C_const = 1e-10**3*4*np.pi/(k*T)*1e5
@@ -1018,6 +1283,140 @@ class HvdwpmEos(HydrateEos):
 
         return C_small, C_large
 
+    def langmuir_table_name(self, comps):
+        """Name of the shared langmuir constant table of this structure
+
+        Parameters
+        ----------
+        comps : list
+            List of components as 'Component' objects created with
+            'component_properties.py'
+
+        Returns
+        ----------
+        name : str
+            Name of the table in 'shared_tables'
+        """
+        name = 'langmuir_{0}_{1}'.format(
+            self.Hs.hydstruc, '-'.join(comp.compname for comp in comps))
+        return name
+
+    def publish_langmuir_table(self, comps, T_grid,
+                               a_grid=np.linspace(0.84, 1.04, 201),
+                               path=None):
+        """Tabulate langmuir constants and publish them for worker processes
+
+        Parameters
+        ----------
+        comps : list
+            List of components as 'Component' objects created with
+            'component_properties.py'
+        T_grid : list, numpy array
+            Temperatures in Kelvin at which constants are tabulated
+        a_grid : numpy array
+            Evenly spaced scalings of the cage radii, covering the
+            lattice sizes, temperatures and pressures of interest
+        path : str, optional
+            File for a memory-mapped table instead of shared memory
+
+        Returns
+        ----------
+        table : numpy array
+            Read-only table of langmuir constants with size
+            len(T_grid) x len(a_grid) x 2 x Nc, where the third axis
+            holds the small and large cages
+
+        Notes
+        ----------
+        The constants only depend on temperature and the cage radii, so
+        the table serves every composition and pressure of this set of
+        components and structure. Any 'HvdwpmEos' of the same components
+        and structure in this or an attached process uses it in
+        'langmuir_consts' at any temperature within 'T_grid'.
+        """
+        T_grid = np.sort(np.asarray(T_grid, dtype=float))
+        a_grid = np.asarray(a_grid, dtype=float)
+        C_all = np.zeros((len(T_grid), len(a_grid), 2, self.num_comps))
+        for ii, T in enumerate(T_grid):
+            for jj, a_factor in enumerate(a_grid):
+                self.set_cage_radii(a_factor)
+                C_all[ii, jj] = self.integrate_langmuir(comps, T)
+        if self.a_factor is not None:
+            self.set_cage_radii(self.a_factor)
+
+        table = shared_tables.publish(self.langmuir_table_name(comps),
+                                      C_all,
+                                      meta={'T': T_grid, 'a_factor': a_grid},
+                                      path=path)
+        return table
+
+    def langmuir_from_table(self, table, T, a_factor):
+        """Interpolate langmuir constants from a published table
+
+        Parameters
+        ----------
+        table : list
+            Table and metadata as returned by 'shared_tables.get_table'
+        T : float
+            Temperature in Kelvin
+        a_factor : float
+            Scaling of cage radii relative to the normal lattice
+
+        Returns
+        ----------
+        values : list of numpy arrays or None
+            Langmuir constants for each guest in small and large cages,
+            or None if T or a_factor is outside the table
+
+        Notes
+        ----------
+        Log langmuir constants are interpolated with a cubic through
+        the four nearest radii, which on the default grid agrees with
+        the integral to about 1e-7 wherever the constants are significant.
+        Between tabulated temperatures, ln(C*T), which is close to linear
+        in 1/T, is interpolated with a cubic in 1/T through the four
+        nearest temperatures. This adds a relative error below 1e-9 on a
+        1 K grid and of about 2e-8 on a 5 K grid. Tables with fewer
+        temperatures use as many as they have, and a single temperature
+        is only used at that temperature.
+        """
+        def lagrange(x, nodes):
+            # Weights of the polynomial through all nodes, evaluated at x
+            weights = np.ones(len(nodes))
+            for mm in range(len(nodes)):
+                others = np.arange(len(nodes)) != mm
+                weights[mm] = (np.prod(x - nodes[others])
+                               / np.prod(nodes[mm] - nodes[others]))
+            return weights
+
+        C_all, meta = table
+        T_grid = meta['T']
+        a_grid = meta['a_factor']
+        if (T < T_grid[0]) or (T > T_grid[-1]):
+            return None
+        n_T = min(4, len(T_grid))
+        ii = int(np.clip(np.searchsorted(T_grid, T) - n_T//2, 0,
+                         len(T_grid) - n_T))
+        T_nodes = T_grid[ii:ii + n_T]
+        pos = (a_factor - a_grid[0])/(a_grid[1] - a_grid[0])
+        jj = int(np.floor(pos)) - 1
+        if jj < 0 or jj + 3 >= len(a_grid):
+            return None
+
+        # Lagrange weights on the radii jj, ..., jj + 3 and on 1/T
+        weights = lagrange(pos - jj, np.arange(4.0))
+        weights_T = lagrange(1.0/T, 1.0/T_nodes)
+
+        guests = np.arange(self.num_comps) != self.water_ind
+        lnC = np.log(C_all[ii:ii + n_T, jj:jj + 4][:, :, :, guests]
+                     * T_nodes[:, np.newaxis, np.newaxis, np.newaxis])
+        lnC = np.tensordot(weights, lnC, axes=([0], [1]))
+        lnC = np.tensordot(weights_T, lnC, axes=([0], [0]))
+        C = np.zeros((2, self.num_comps))
+        C[:, guests] = np.exp(lnC)/T
+        values = [C[0], C[1]]
+        return values
+
 
     def activity_func(self, T, P, v_H_0):
         """Calculates activity of water between aqueous phase and filled hydrate
@@ -1086,6 +1485,254 @@ class HvdwpmEos(HydrateEos):
         self.fug = fug.copy()
         return fug
 
+    def dlnf_dlnfeq(self):
+        """Derivative of log fugacity wrt log equilibrium fugacity.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of component i (rows) in hydrate
+            wrt log of equilibrium fugacity of component k (columns) with
+            size Nc x Nc.
+
+        Notes
+        ----------
+        Adds the dependence of the water activity on compressibility
+        through the large cage occupancies to the langmuir contribution
+        of 'HydrateEos'. Langmuir constants are held fixed.
+        """
+        try:
+            dlnf = super().dlnf_dlnfeq()
+        except:
+            dlnf = super(HvdwpmEos, self).dlnf_dlnfeq()
+
+        if self.num_comps > 2:
+            dkappa = 3.0*self.Y_large*(self.kappa_vec
+                                       - np.sum(self.kappa_vec*self.Y_large))
+            dlnf[self.water_ind, :] += self.dactivity_dkappa() * dkappa
+        return dlnf
+
+    def make_derivative_mats(self, comps, T, P):
+        """Portion of derivative calculation that only depends on P and T.
+
+        Parameters
+        ----------
+        comps : list
+            List of components as 'Component' objects created with
+            'component_properties.py'.
+        T : float
+            Temperature in Kelvin.
+        P : float
+            Pressure in bar.
+
+        Notes
+        ----------
+        Only called when derivatives are requested. Temperature
+        derivatives of the gibbs energy terms follow from
+        d(g/RT)/dT = -h/(R*T**2).
+        """
+        self.derivative_TP = (T, P)
+        hw_beta = (self.Hs.hw_0beta + self.cp['a0']*(T - T_0)
+                   + self.cp['a1']*(T**2 - T_0**2)/2
+                   + self.cp['a2']*(T**3 - T_0**3)/3
+                   + self.cp['a3']*(T**4 - T_0**4)/4)
+        vol_int = (self.h_vol_Pint(T, P, self.a0_cubed, self.kappa0)
+                   - self.h_vol_Pint(T, P_0, self.a0_cubed, self.kappa0))
+        self.dgwbeta_dT = (-hw_beta/(R*T**2)
+                           + (self.dlnsize_dT(T)/(R*T) - 1.0/(R*T**2))
+                           * vol_int * 1e-1)
+        self.dgwbeta_dP = (self.hydrate_size(T, P, self.a0_cubed, self.kappa0)
+                           * 1e-1 / (R * T))
+        self.dgw0_dT = (-comps[self.water_ind].enthalpy_ideal(T)
+                        / (R * T**2))
+
+    def dlnsize_dT(self, T):
+        """Temperature derivative of log hydrate volume
+
+        Parameters
+        ----------
+        T : float
+            Temperature in Kelvin
+
+        Returns
+        ----------
+        dlnv : float
+            Derivative of the log of 'hydrate_size' (volumetric) wrt
+            temperature in 1/K
+        """
+        dlnv = (self.Hs.alf[1] + 2*self.Hs.alf[2]*(T - T_0)
+                + 3*self.Hs.alf[3]*(T - T_0)**2)
+        return dlnv
+
+    def dlnC_dTP(self, comps, T, P):
+        """Temperature and pressure derivatives of log langmuir constants
+
+        Parameters
+        ----------
+        comps : list
+            List of components as 'Component' objects created with
+            'component_properties.py'
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+
+        Returns
+        ----------
+        derivs : list of numpy arrays
+            Derivatives of log langmuir constants of each component wrt
+            temperature in small and large cages, followed by the
+            derivatives wrt pressure in small and large cages
+
+        Notes
+        ----------
+        Langmuir constants are integrals of the Kihara potential without
+        a closed form, so these are central differences of
+        'langmuir_consts' at the current lattice size and compressibility.
+        Only the integrals are repeated, not the full eos calculation.
+        """
+        kappa = self.kappa_func(self.Y_large)
+        lattice_Tfactor = self.lattice_Tfactor
+        guests = np.arange(self.num_comps) != self.water_ind
+        h_T = 1e-2
+        h_P = 1e-3*P
+
+        self.lattice_Tfactor = self.hydrate_size(T + h_T, P_0, 1.0,
+                                                 self.kappa0, dim='linear')
+        C_small_Tp, C_large_Tp = self.langmuir_consts(comps, T + h_T, P,
+                                                      self.a_0, kappa)
+        self.lattice_Tfactor = self.hydrate_size(T - h_T, P_0, 1.0,
+                                                 self.kappa0, dim='linear')
+        C_small_Tm, C_large_Tm = self.langmuir_consts(comps, T - h_T, P,
+                                                      self.a_0, kappa)
+        self.lattice_Tfactor = lattice_Tfactor
+        C_small_Pp, C_large_Pp = self.langmuir_consts(comps, T, P + h_P,
+                                                      self.a_0, kappa)
+        C_small_Pm, C_large_Pm = self.langmuir_consts(comps, T, P - h_P,
+                                                      self.a_0, kappa)
+        self.compute_integral_constants(T, P, self.a_0, kappa)
+
+        derivs = [np.zeros(self.num_comps) for ii in range(4)]
+        for deriv, plus, minus, h in zip(
+                derivs,
+                (C_small_Tp, C_large_Tp, C_small_Pp, C_large_Pp),
+                (C_small_Tm, C_large_Tm, C_small_Pm, C_large_Pm),
+                (h_T, h_T, h_P, h_P)):
+            deriv[guests] = (np.log(plus[guests])
+                             - np.log(minus[guests]))/(2*h)
+        return derivs
+
+    def dactivity_dkappa(self):
+        """Derivative of water activity wrt compressibility
+
+        Returns
+        ----------
+        dactivity : float
+            Derivative of 'activity_func' wrt compressibility of the
+            filled hydrate
+        """
+        kappa = self.kappa_func(self.Y_large)
+        dvol_dkappa = (
+            self.hydrate_size(self.T, self.P, self.v_H_0, kappa)
+            * ((self.P - P_0)/kappa + 1.0/kappa**2)
+            - self.hydrate_size(self.T, P_0, self.v_H_0, kappa)
+            / kappa**2
+        )
+        dactivity = dvol_dkappa * 1e-1 / (R * self.T)
+        return dactivity
+
+    def water_dlnf_dTP(self):
+        """Temperature and pressure derivatives of log fugacity of water
+
+        Returns
+        ----------
+        derivs : list
+            derivs[0] : float
+                Derivative of log fugacity of water wrt temperature in 1/K
+            derivs[1] : float
+                Derivative of log fugacity of water wrt pressure in 1/bar
+
+        Notes
+        ----------
+        Equilibrium fugacities are held fixed. Occupancies change through
+        the langmuir constants, dY_j = Y_j*(dlnC_j - sum(Y*dlnC)), and
+        the results are cached for the current state.
+        """
+        key = (self.T, self.P, tuple(self.Y_small), tuple(self.Y_large))
+        if self.dlnf_TP_cache[0] == key:
+            return self.dlnf_TP_cache[1]
+        if self.derivative_TP != (self.T, self.P):
+            self.make_derivative_mats(self.comps, self.T, self.P)
+
+        T = self.T
+        P = self.P
+        kappa = self.kappa_func(self.Y_large)
+        vol_int = (self.h_vol_Pint(T, P, self.v_H_0, kappa)
+                   - self.h_vol_Pint(T, P, self.a0_cubed, self.kappa0)
+                   - self.h_vol_Pint(T, P_0, self.v_H_0, kappa)
+                   + self.h_vol_Pint(T, P_0, self.a0_cubed, self.kappa0))
+        dact = [
+            (-(self.v_H_0 - self.a0_cubed) * self.Hs.b_fit / (R * T**2)
+             + (self.dlnsize_dT(T)/(R*T) - 1.0/(R*T**2)) * vol_int) * 1e-1,
+            (self.hydrate_size(T, P, self.v_H_0, kappa)
+             - self.hydrate_size(T, P, self.a0_cubed, self.kappa0))
+            * 1e-1 / (R * T)
+        ]
+        dgw = [self.dgwbeta_dT - self.dgw0_dT, self.dgwbeta_dP]
+
+        dlnC = self.dlnC_dTP(self.comps, T, P)
+        derivs = []
+        for ii in range(2):
+            dlnC_small, dlnC_large = dlnC[2*ii], dlnC[2*ii + 1]
+            dY_large = self.Y_large*(dlnC_large
+                                     - np.sum(self.Y_large*dlnC_large))
+            ddelta_mu = -(self.Hs.Nm['small']*np.sum(self.Y_small*dlnC_small)
+                          + self.Hs.Nm['large']*np.sum(self.Y_large*dlnC_large)
+                          )/self.Hs.Num_h2o
+            deriv = dgw[ii] + dact[ii] + ddelta_mu
+            if self.num_comps > 2:
+                deriv += (self.dactivity_dkappa()
+                          * 3.0*np.sum(self.kappa_vec*dY_large))
+            derivs.append(deriv)
+        self.dlnf_TP_cache = (key, derivs)
+        return derivs
+
+    def dlnf_dT(self):
+        """Derivative of log fugacity wrt temperature at fixed equilibrium fugacity.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of each component wrt temperature
+            in 1/K with size Nc. Guest fugacities equal the equilibrium
+            fugacities and do not change.
+
+        Notes
+        ----------
+        Must be called after 'calc'.
+        """
+        dlnf = np.zeros(self.num_comps)
+        dlnf[self.water_ind] = self.water_dlnf_dTP()[0]
+        return dlnf
+
+    def dlnf_dP(self):
+        """Derivative of log fugacity wrt pressure at fixed equilibrium fugacity.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of each component wrt pressure
+            in 1/bar with size Nc. Guest fugacities equal the equilibrium
+            fugacities and do not change.
+
+        Notes
+        ----------
+        Must be called after 'calc'.
+        """
+        dlnf = np.zeros(self.num_comps)
+        dlnf[self.water_ind] = self.water_dlnf_dTP()[1]
+        return dlnf
+
     # Calcualte hydrate composition
     def hyd_comp(self):
         """Hydrate composition as a molar fraction
@@ -1101,6 +1748,92 @@ class HvdwpmEos(HydrateEos):
         x[self.water_ind] = 1.0 - np.sum(x)
         return x
 
+    def dx_dlnfeq(self):
+        """Derivative of hydrate composition wrt log equilibrium fugacity
+
+        Returns
+        ----------
+        dx : numpy array
+            Derivative of molar fraction of component i (rows) in hydrate
+            wrt log of equilibrium fugacity of component k (columns) with
+            size Nc x Nc.
+
+        Notes
+        ----------
+        Langmuir constants are held fixed, as in 'ddelta_mu_dlnf'.
+        """
+        dx_tmp = (self.Hs.Nm['small']
+                  * (np.diag(self.Y_small)
+                     - np.outer(self.Y_small, self.Y_small))
+                  + self.Hs.Nm['large']
+                  * (np.diag(self.Y_large)
+                     - np.outer(self.Y_large, self.Y_large))) / self.Hs.Num_h2o
+        x_tmp = (self.Hs.Nm['small']*self.Y_small
+                 + self.Hs.Nm['large']*self.Y_large)/self.Hs.Num_h2o
+        total = 1.0 + np.sum(x_tmp)
+        dtotal = np.sum(dx_tmp, axis=0)
+        dx = dx_tmp/total - np.outer(x_tmp, dtotal)/total**2
+        dx[self.water_ind, :] = -np.sum(np.delete(dx, self.water_ind, axis=0),
+                                        axis=0)
+        return dx
+
+    def dx_dTP(self, eq_fug):
+        """Derivatives of hydrate composition wrt temperature and pressure
+
+        Parameters
+        ----------
+        eq_fug : numpy array
+            Equilibrium fugacity of each non-water component used in the
+            last 'calc'
+
+        Returns
+        ----------
+        derivs : list of numpy arrays
+            Derivative of molar fraction of each component wrt temperature
+            in 1/K and wrt pressure in 1/bar with size Nc
+
+        Notes
+        ----------
+        Equilibrium fugacities are held fixed. Occupancies change the
+        lattice size and compressibility, which in turn change the
+        langmuir constants, so these are central differences of the
+        self-consistent 'calc'. The state of the last 'calc' is restored
+        afterwards. Must be called after 'calc'.
+        """
+        comps, T, P = self.comps, self.T, self.P
+        h_T = 1e-2
+        h_P = 1e-2
+        derivs = []
+        for dT, dP, h in ((h_T, 0.0, h_T), (0.0, h_P, h_P)):
+            self.calc(comps, T + dT, P + dP, [], eq_fug)
+            x_plus = self.hyd_comp()
+            self.calc(comps, T - dT, P - dP, [], eq_fug)
+            x_minus = self.hyd_comp()
+            derivs.append((x_plus - x_minus)/(2*h))
+        self.calc(comps, T, P, [], eq_fug)
+        return derivs
+
+    def heat_capacity(self):
+        """Molar heat capacity of hydrate phase at constant pressure.
+
+        Returns
+        ----------
+        cp : float
+            Molar heat capacity of hydrate phase in J/mol-K.
+
+        Notes
+        ----------
+        Must be called after 'calc'. Water contributes the heat capacity
+        of the empty lattice and guests their ideal gas heat capacity; the
+        temperature dependence of the cage filling enthalpy is neglected.
+        """
+        T = self.T
+        x = self.hyd_comp()
+        cp_i = np.array([comp.heat_capacity_ideal(T) for comp in self.comps])
+        cp_i[self.water_ind] = (self.cp['a0'] + self.cp['a1']*T
+                                + self.cp['a2']*T**2 + self.cp['a3']*T**3)
+        return np.dot(x, cp_i)
+
 
 # Properties of each hydrate structure necessary for further calculation.
 class HydrateStructure(object):
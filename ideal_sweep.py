@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Multi-fidelity sweeps with ideal partition coefficients as a first pass
+
+The ideal partition coefficient correlations of 'flashalgorithm' cost
+almost nothing compared to a flash with the equations of state. A sweep
+over temperature, pressure and composition therefore first classifies
+every point with the vectorized phase split of 'rachford_rice' at
+ideal K. Only points whose classification is uncertain, i.e. a phase
+close to appearing or disappearing or a split that did not converge,
+and points next to a predicted boundary are flashed with
+'FlashController'. The remaining points keep the ideal classification.
+A random sample of them is flashed as well to measure how often the
+ideal classification agrees with the full flash.
+
+Phase assemblages are stored as integer labels as in
+'composition_diagram', with label 0 for a point without a result.
+
+    Functions
+    ----------
+    ideal_classify :
+        Phase assemblage of every point of a sweep at ideal K
+    flag_points :
+        Points whose ideal classification is uncertain or near a boundary
+    flash_points :
+        Flash a sequence of points, warm starting from grid neighbours
+    ideal_sweep :
+        Phase assemblage over a sweep with full flashes only where needed
+"""
+import numpy as np
+import time
+
+import flashalgorithm as fc
+import composition_diagram as cd
+import rachford_rice as rr
+
+
+def ideal_classify(flash, z, T, P, alpha_min=1e-8):
+    """Phase assemblage of every point of a sweep at ideal K
+
+    Parameters
+    ----------
+    flash : FlashController
+        Controller whose components and phases are classified
+    z : numpy array
+        Total composition with size S x Nc, where S is the shape of
+        the sweep
+    T : numpy array
+        Temperature in Kelvin with shape S
+    P : numpy array
+        Pressure in bar with shape S
+    alpha_min : float
+        Phase fraction above which a phase counts as present
+
+    Returns
+    ----------
+    values : list
+        values[0] : numpy array
+            Assemblage label of each point with shape S
+        values[1] : numpy array
+            Molar phase fractions with size S x Np
+        values[2] : numpy array
+            Phase stabilities with size S x Np
+        values[3] : numpy array
+            Boolean array of converged points with shape S
+    """
+    shape = np.shape(T)
+    K = flash.make_ideal_K_mat(flash.compobjs, T, P)
+    K = np.moveaxis(K, [0, 1], [-2, -1]).reshape(-1, flash.Nc, flash.Np)
+    alpha, theta, converged = rr.phase_split(np.reshape(z, [-1, flash.Nc]),
+                                             K)
+    labels = np.array([cd.assemblage_label(present)
+                       for present in alpha > alpha_min], dtype=int)
+    values = [labels.reshape(shape),
+              alpha.reshape(shape + (flash.Np,)),
+              theta.reshape(shape + (flash.Np,)),
+              converged.reshape(shape)]
+    return values
+
+
+def flag_points(labels, alpha, theta, converged, alpha_min=1e-8,
+                alpha_margin=0.02, theta_margin=0.25, neighbors=True):
+    """Points whose ideal classification is uncertain or near a boundary
+
+    Parameters
+    ----------
+    labels : numpy array
+        Assemblage label of each point with shape S
+    alpha : numpy array
+        Molar phase fractions with size S x Np
+    theta : numpy array
+        Phase stabilities with size S x Np
+    converged : numpy array
+        Boolean array of converged points with shape S
+    alpha_min : float
+        Phase fraction above which a phase counts as present
+    alpha_margin : float
+        Present phases with a smaller phase fraction are close to
+        disappearing
+    theta_margin : float
+        Absent phases with a smaller stability are close to appearing
+    neighbors : bool
+        Flag for also marking points whose neighbour along any axis of
+        the sweep has a different label
+
+    Returns
+    ----------
+    values : list
+        values[0] : numpy array
+            Boolean array of uncertain points with shape S
+        values[1] : numpy array
+            Boolean array of points next to a predicted boundary
+    """
+    present = alpha > alpha_min
+    uncertain = (~converged
+                 | np.any(present & (alpha < alpha_margin), axis=-1)
+                 | np.any(~present & (theta < theta_margin), axis=-1))
+    boundary = np.zeros(np.shape(labels), dtype=bool)
+    if neighbors:
+        for axis in range(np.ndim(labels)):
+            differ = np.diff(labels, axis=axis) != 0
+            lower = [slice(None)]*np.ndim(labels)
+            upper = [slice(None)]*np.ndim(labels)
+            lower[axis] = slice(None, -1)
+            upper[axis] = slice(1, None)
+            boundary[tuple(lower)] |= differ
+            boundary[tuple(upper)] |= differ
+    values = [uncertain, boundary]
+    return values
+
+
+def flash_points(data, Z, T, P, index, alpha_min=1e-8, tol=1e-6):
+    """Flash a sequence of points, warm starting from grid neighbours
+
+    Parameters
+    ----------
+    data : bytes, FlashController
+        Output of 'FlashController.snapshot', or the controller itself
+    Z : numpy array
+        Total compositions with size m x Nc
+    T : numpy array
+        Temperatures in Kelvin with size m
+    P : numpy array
+        Pressures in bar with size m
+    index : numpy array
+        Grid index of each point with size m x ndim. A point is warm
+        started from the previous one if their indices differ by at
+        most one along every axis.
+    alpha_min : float
+        Phase fraction above which a phase counts as present
+    tol : float
+        Error below which a flash counts as converged
+
+    Returns
+    ----------
+    values : list
+        values[0] : numpy array
+            Assemblage label of each point with size m
+        values[1] : numpy array
+            Molar phase fractions with size m x Np
+        values[2] : numpy array
+            Error of each flash with size m
+
+    Notes
+    ----------
+    Module level so that it can be submitted to a process pool.
+    """
+    if isinstance(data, bytes):
+        flash = fc.FlashController.from_snapshot(data)
+    else:
+        flash = data
+    labels = np.zeros(len(Z), dtype=int)
+    alpha = np.zeros([len(Z), flash.Np])
+    error = np.full(len(Z), np.inf)
+    start = None
+    for ii in range(len(Z)):
+        if (ii > 0) and np.any(np.abs(index[ii] - index[ii - 1]) > 1):
+            start = None
+        state, error[ii] = cd.warm_flash(flash, Z[ii], T[ii], P[ii],
+                                         start, tol)
+        start = None
+        if state is not None and error[ii] <= tol:
+            alpha[ii] = state['alpha_calc']
+            labels[ii] = cd.assemblage_label(alpha[ii] > alpha_min)
+            start = state
+    values = [labels, alpha, error]
+    return values
+
+
+def ideal_sweep(flash, z, T, P, alpha_margin=0.02, theta_margin=0.25,
+                neighbors=True, n_validate=20, seed=0, executor=None,
+                n_chunks=8, alpha_min=1e-8, tol=1e-6):
+    """Phase assemblage over a sweep with full flashes only where needed
+
+    Parameters
+    ----------
+    flash : FlashController
+        Controller used for the full flashes
+    z : list, numpy array
+        Total composition with size Nc, or S x Nc for a composition at
+        every point of the sweep
+    T : float, numpy array
+        Temperature in Kelvin, broadcast against P and z
+    P : float, numpy array
+        Pressure in bar, broadcast against T and z
+    alpha_margin : float
+        Present phases with a smaller ideal phase fraction are close to
+        disappearing, see 'flag_points'
+    theta_margin : float
+        Absent phases with a smaller ideal stability are close to
+        appearing, see 'flag_points'
+    neighbors : bool
+        Flag for flashing points next to a predicted boundary
+    n_validate : int
+        Number of points accepted at ideal K that are flashed as well to
+        measure the agreement of the two classifications
+    seed : int
+        Seed of the random validation sample
+    executor : concurrent.futures.Executor, optional
+        If given, chunks of the points to flash are run concurrently on
+        the executor from a snapshot of 'flash'
+    n_chunks : int
+        Number of contiguous chunks of the points for the executor
+    alpha_min : float
+        Phase fraction above which a phase counts as present
+    tol : float
+        Error below which a flash counts as converged
+
+    Returns
+    ----------
+    sweep : dict
+        Arrays that can be stored with 'numpy.savez':
+        'phases' names of the phases of the label bits,
+        'T', 'P' with the sweep shape S and 'z' with size S x Nc,
+        'ideal_labels', 'ideal_alpha' and 'ideal_theta' of the first pass,
+        'uncertain' and 'near_boundary' masks from 'flag_points',
+        'flashed' mask of points with a full flash, including the
+        validation sample,
+        'labels' and 'alpha' of the full flash where it converged and of
+        the first pass elsewhere, 'error' of the full flashes (NaN where
+        there is none),
+        'validate_index' flat indices of the validation sample,
+        and the scalars 'n_points', 'n_flashed', 'n_avoided',
+        'avoided_fraction', 'agreement' (fraction of the converged
+        flashes of the validation sample with equal labels, NaN without
+        any),
+        'time_ideal', 'time_full' and 'time_avoided', the time of the
+        avoided flashes estimated from the mean time of a full flash.
+    """
+    z = np.asarray(z, dtype=float)
+    shape = np.broadcast_shapes(np.shape(T), np.shape(P), z.shape[:-1])
+    T = np.broadcast_to(np.asarray(T, dtype=float), shape)
+    P = np.broadcast_to(np.asarray(P, dtype=float), shape)
+    z = np.broadcast_to(z/np.sum(z, axis=-1, keepdims=True),
+                        shape + (flash.Nc,))
+
+    tstart = time.time()
+    ideal_labels, ideal_alpha, ideal_theta, converged = ideal_classify(
+        flash, z, T, P, alpha_min)
+    uncertain, near_boundary = flag_points(ideal_labels, ideal_alpha,
+                                           ideal_theta, converged,
+                                           alpha_min, alpha_margin,
+                                           theta_margin, neighbors)
+    time_ideal = time.time() - tstart
+
+    flagged = (uncertain | near_boundary).ravel()
+    accepted = np.flatnonzero(~flagged)
+    rng = np.random.default_rng(seed)
+    validate = np.sort(rng.choice(accepted, min(n_validate, len(accepted)),
+                                  replace=False))
+    flashed = flagged.copy()
+    flashed[validate] = True
+    points = np.flatnonzero(flashed)
+
+    tstart = time.time()
+    index = np.array(np.unravel_index(points, shape), dtype=int).T
+    Z = z.reshape(-1, flash.Nc)
+    items = (Z[points], T.ravel()[points], P.ravel()[points], index)
+    if executor is None:
+        results = [flash_points(flash, *items, alpha_min=alpha_min, tol=tol)]
+    else:
+        data = flash.snapshot()
+        # Contiguous chunks keep neighbouring points on the same worker.
+        chunks = [chunk for chunk in np.array_split(np.arange(len(points)),
+                                                    n_chunks) if len(chunk)]
+        futures = [executor.submit(flash_points, data,
+                                   *[item[chunk] for item in items],
+                                   alpha_min=alpha_min, tol=tol)
+                   for chunk in chunks]
+        results = [future.result() for future in futures]
+    time_full = time.time() - tstart
+
+    labels = ideal_labels.ravel().copy()
+    alpha = ideal_alpha.reshape(-1, flash.Np).copy()
+    error = np.full(labels.shape, np.nan)
+    if len(points):
+        error[points] = np.concatenate([res[2] for res in results])
+        # Failed flashes keep the classification of the first pass.
+        done = error[points] <= tol
+        labels[points[done]] = np.concatenate(
+            [res[0] for res in results])[done]
+        alpha[points[done]] = np.concatenate(
+            [res[1] for res in results])[done]
+    checked = validate[error[validate] <= tol]
+    if len(checked):
+        agreement = np.mean(labels[checked] == ideal_labels.ravel()[checked])
+    else:
+        agreement = np.nan
+
+    n_points = labels.size
+    n_flashed = len(points)
+    sweep = {'phases': np.array(flash.phases),
+             'T': np.array(T),
+             'P': np.array(P),
+             'z': np.array(z),
+             'ideal_labels': ideal_labels,
+             'ideal_alpha': ideal_alpha,
+             'ideal_theta': ideal_theta,
+             'uncertain': uncertain,
+             'near_boundary': near_boundary,
+             'flashed': flashed.reshape(shape),
+             'labels': labels.reshape(shape),
+             'alpha': alpha.reshape(shape + (flash.Np,)),
+             'error': error.reshape(shape),
+             'validate_index': validate,
+             'n_points': n_points,
+             'n_flashed': n_flashed,
+             'n_avoided': n_points - n_flashed,
+             'avoided_fraction': (n_points - n_flashed)/float(n_points),
+             'agreement': agreement,
+             'time_ideal': time_ideal,
+             'time_full': time_full,
+             'time_avoided': (time_full/max(n_flashed, 1)
+                              *(n_points - n_flashed))}
+    return sweep
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Adaptive pressure-temperature phase maps
+
+A uniform grid of flashes spends most of its flashes inside regions of a
+single phase assemblage. The class 'PhaseMap' refines a quadtree of cells
+in temperature and pressure instead. Corners of a cell are flashed, and a
+cell is only subdivided when its corners have different phase
+assemblages or when the phase fractions at its center differ from the
+interpolation of its corners. New corners are warm started from the
+nearest corner of the parent cell. The finished map is queried with
+'query' and its boundary cells are listed with 'boundary_cells'. Corners
+whose flash failed have no assemblage and count as uncertain, so cells
+around them are refined like boundary cells.
+"""
+import numpy as np
+
+
+class PhaseMap(object):
+    """Quadtree phase map of a mixture in temperature and pressure
+
+    Methods
+    ----------
+    build :
+        Refine the quadtree until all cells are resolved
+    needs_split :
+        Whether a cell must be subdivided
+    corner :
+        Flash result at a lattice point, flashed on first use
+    flash_point :
+        Flash at a single temperature and pressure
+    query :
+        Phase assemblage and phase fractions at temperatures and pressures
+    find_cell :
+        Leaf cell that contains a temperature and pressure
+    boundary_cells :
+        Leaf cells whose corners have different phase assemblages
+    """
+    def __init__(self, flash, z, T_range, P_range, max_depth=6,
+                 min_depth=2, alpha_tol=0.05, alpha_min=1e-8, tol=1e-6):
+        """Adaptive phase map of a fixed total composition
+
+        Parameters
+        ----------
+        flash : FlashController
+            Controller used for every flash of the map
+        z : list, numpy array
+            Total composition with size Nc
+        T_range : tuple
+            Lowest and highest temperature in Kelvin
+        P_range : tuple
+            Lowest and highest pressure in bar
+        max_depth : int
+            Number of subdivisions of the finest cells, such that the
+            boundary resolution is the range divided by 2**max_depth
+        min_depth : int
+            Number of subdivisions that are always made
+        alpha_tol : float
+            Largest difference between the phase fractions at the center
+            of a cell and the mean of its corners
+        alpha_min : float
+            Phase fraction above which a phase counts as present
+        tol : float
+            Error below which a flash counts as converged
+
+        Attributes
+        ----------
+        n_lattice : int
+            Number of lattice points along each axis, 2**max_depth + 1
+        T_grid : numpy array
+            Temperature of each lattice point in Kelvin
+        P_grid : numpy array
+            Pressure of each lattice point in bar
+        corners : dict
+            Flash result (values) of each flashed lattice point (keys),
+            with the calc state, phase fractions, present phases and error,
+            where present is None if the flash failed
+        leaves : list
+            Leaf cells as tuples of the lattice indices of the lower left
+            corner and the cell size in lattice steps
+        leaf_set : set
+            Leaf cells for lookup by 'find_cell'
+        n_flash : int
+            Number of flashes made, counting every attempt of
+            'robust_flash'
+        """
+        self.flash = flash
+        self.z = np.asarray(z, dtype=float)/np.sum(z)
+        self.max_depth = max_depth
+        self.min_depth = min(min_depth, max_depth)
+        self.alpha_tol = alpha_tol
+        self.alpha_min = alpha_min
+        self.tol = tol
+        self.n_lattice = 2**max_depth + 1
+        self.T_grid = np.linspace(T_range[0], T_range[1], self.n_lattice)
+        self.P_grid = np.linspace(P_range[0], P_range[1], self.n_lattice)
+        self.corners = {}
+        self.leaves = []
+        self.leaf_set = set()
+        self.n_flash = 0
+
+    def build(self):
+        """Refine the quadtree until all cells are resolved
+
+        Returns
+        ----------
+        leaves : list
+            Leaf cells, see 'self.leaves'
+        """
+        size = 2**(self.max_depth - self.min_depth)
+        queue = [(ii, jj, size, None)
+                 for ii in range(0, self.n_lattice - 1, size)
+                 for jj in range(0, self.n_lattice - 1, size)]
+        self.leaves = []
+        while queue:
+            ii, jj, size, parent = queue.pop()
+            if self.needs_split(ii, jj, size, parent):
+                half = size//2
+                for di in (0, half):
+                    for dj in (0, half):
+                        queue.append((ii + di, jj + dj, half, (ii, jj, size)))
+            else:
+                self.leaves.append((ii, jj, size))
+        self.leaf_set = set(self.leaves)
+        return self.leaves
+
+    def needs_split(self, ii, jj, size, parent=None):
+        """Whether a cell must be subdivided
+
+        Parameters
+        ----------
+        ii : int
+            Temperature index of the lower left corner
+        jj : int
+            Pressure index of the lower left corner
+        size : int
+            Size of the cell in lattice steps
+        parent : tuple, optional
+            Lower left corner and size of the parent cell, whose corners
+            provide the warm starts
+
+        Returns
+        ----------
+        split : bool
+            True if the corners have different phase assemblages, a
+            corner or the center failed, or the center differs from the
+            interpolation of the corners, and the cell is larger than one
+            lattice step
+
+        Notes
+        ----------
+        The corners are flashed for every cell, so that all leaves can
+        be queried.
+        """
+        starts = [(ii + di, jj + dj) for di in (0, size) for dj in (0, size)]
+        if parent is not None:
+            pi, pj, psize = parent
+            starts += [(pi + di, pj + dj) for di in (0, psize)
+                       for dj in (0, psize)]
+        corners = [self.corner(ii + di, jj + dj, starts)
+                   for di in (0, size) for dj in (0, size)]
+        if size == 1:
+            return False
+        if any(c['present'] is None for c in corners):
+            return True
+        present = np.array([c['present'] for c in corners])
+        if not (present == present[0]).all():
+            return True
+
+        half = size//2
+        center = self.corner(ii + half, jj + half, starts)
+        if (center['present'] is None) or not (center['present']
+                                               == present[0]).all():
+            return True
+        alpha_mean = np.mean([c['alpha'] for c in corners], axis=0)
+        return np.max(np.abs(center['alpha'] - alpha_mean)) > self.alpha_tol
+
+    def corner(self, ii, jj, starts=()):
+        """Flash result at a lattice point, flashed on first use
+
+        Parameters
+        ----------
+        ii : int
+            Temperature index
+        jj : int
+            Pressure index
+        starts : list
+            Lattice points whose flash results may serve as a warm
+            start, of which the nearest flashed one is used
+
+        Returns
+        ----------
+        record : dict
+            Calc state, phase fractions, present phases and error
+        """
+        key = (ii, jj)
+        if key not in self.corners:
+            done = [s for s in starts if (s in self.corners)
+                    and (self.corners[s]['present'] is not None)]
+            start = None
+            if done:
+                nearest = min(done, key=lambda s: abs(s[0] - ii)
+                              + abs(s[1] - jj))
+                start = self.corners[nearest]['state']
+            self.corners[key] = self.flash_point(self.T_grid[ii],
+                                                 self.P_grid[jj], start)
+        return self.corners[key]
+
+    def flash_point(self, T, P, start=None):
+        """Flash at a single temperature and pressure
+
+        Parameters
+        ----------
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+        start : dict, optional
+            Output of 'calc_state' of a nearby flash to warm start from
+
+        Returns
+        ----------
+        record : dict
+            Calc state, phase fractions, present phases and error. If
+            the flash raised or did not converge, the state is None, the
+            phase fractions are NaN and present is None.
+
+        Notes
+        ----------
+        A warm start that raises or does not converge is repeated with
+        'robust_flash'.
+        """
+        flash = self.flash
+        out = None
+        if start is not None:
+            try:
+                out = flash.main_handler(flash.compobjs, self.z, T, P,
+                                         K_init=start['K_calc'],
+                                         alpha_init=start['alpha_calc'],
+                                         theta_init=start['theta_calc'],
+                                         ref_phase=start['ref_phase'],
+                                         stall_iter=20)
+            except (ValueError, FloatingPointError, np.linalg.LinAlgError):
+                out = None
+            self.n_flash += 1
+        if (out is None) or (out[4] > self.tol):
+            try:
+                out = flash.robust_flash(flash.compobjs, self.z, T, P,
+                                         strategies=('ideal', 'ref'),
+                                         tol=self.tol)
+            except (ValueError, FloatingPointError, np.linalg.LinAlgError):
+                out = None
+            self.n_flash += len(flash.robust_info['attempts'])
+        if (out is None) or (out[4] > self.tol):
+            record = {'state': None,
+                      'alpha': np.full(flash.Np, np.nan),
+                      'present': None,
+                      'error': np.inf if out is None else out[4]}
+            return record
+        state = flash.calc_state()
+        record = {'state': state,
+                  'alpha': state['alpha_calc'],
+                  'present': state['alpha_calc'] > self.alpha_min,
+                  'error': out[4]}
+        return record
+
+    def query(self, T, P):
+        """Phase assemblage and phase fractions at temperatures and pressures
+
+        Parameters
+        ----------
+        T : float, numpy array
+            Temperature in Kelvin
+        P : float, numpy array
+            Pressure in bar
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Boolean array of present phases with the broadcast shape
+                of T and P followed by Np
+            values[1] : numpy array
+                Molar phase fractions with the same size
+
+        Notes
+        ----------
+        Inside cells with a single assemblage the phase fractions are
+        interpolated bilinearly. In boundary cells the nearest corner is
+        used, skipping failed corners. Points of a cell without any
+        converged corner have no present phases and NaN phase fractions.
+        """
+        shape = np.broadcast(np.asarray(T), np.asarray(P)).shape
+        T_pts = np.broadcast_to(T, shape).ravel()
+        P_pts = np.broadcast_to(P, shape).ravel()
+        Np = self.flash.Np
+        present = np.zeros([len(T_pts), Np], dtype=bool)
+        alpha = np.zeros([len(T_pts), Np])
+        for kk in range(len(T_pts)):
+            ii, jj, size = self.find_cell(T_pts[kk], P_pts[kk])
+            T0, T1 = self.T_grid[ii], self.T_grid[ii + size]
+            P0, P1 = self.P_grid[jj], self.P_grid[jj + size]
+            t = np.clip((T_pts[kk] - T0)/(T1 - T0), 0.0, 1.0)
+            p = np.clip((P_pts[kk] - P0)/(P1 - P0), 0.0, 1.0)
+            corners = {(di, dj): self.corners[(ii + di*size, jj + dj*size)]
+                       for di in (0, 1) for dj in (0, 1)}
+            done = {key: c for key, c in corners.items()
+                    if c['present'] is not None}
+            if (len(done) == 4) and all(
+                    (c['present'] == corners[(0, 0)]['present']).all()
+                    for c in corners.values()):
+                present[kk] = corners[(0, 0)]['present']
+                alpha[kk] = sum(c['alpha']*(t if di else 1.0 - t)
+                                * (p if dj else 1.0 - p)
+                                for (di, dj), c in corners.items())
+            elif done:
+                nearest = done[min(done, key=lambda key: abs(key[0] - t)
+                                   + abs(key[1] - p))]
+                present[kk] = nearest['present']
+                alpha[kk] = nearest['alpha']
+            else:
+                alpha[kk] = np.nan
+
+        values = [present.reshape(shape + (Np,)),
+                  alpha.reshape(shape + (Np,))]
+        return values
+
+    def find_cell(self, T, P):
+        """Leaf cell that contains a temperature and pressure
+
+        Parameters
+        ----------
+        T : float
+            Temperature in Kelvin
+        P : float
+            Pressure in bar
+
+        Returns
+        ----------
+        cell : tuple
+            Lower left lattice indices and size of the leaf cell
+        """
+        if not self.leaves:
+            raise ValueError("""The map has no cells, call 'build' first.""")
+        span = self.n_lattice - 1
+        ii = int(np.clip(np.searchsorted(self.T_grid, T) - 1, 0, span - 1))
+        jj = int(np.clip(np.searchsorted(self.P_grid, P) - 1, 0, span - 1))
+        size = span
+        ci, cj = 0, 0
+        while (ci, cj, size) not in self.leaf_set:
+            size //= 2
+            ci += size*((ii - ci) >= size)
+            cj += size*((jj - cj) >= size)
+        return ci, cj, size
+
+    def boundary_cells(self):
+        """Leaf cells whose corners have different phase assemblages
+
+        Returns
+        ----------
+        cells : list
+            Temperature and pressure ranges of each boundary cell as
+            tuples (T_low, T_high, P_low, P_high). Cells with a failed
+            corner are included as their assemblage is uncertain.
+        """
+        cells = []
+        for ii, jj, size in self.leaves:
+            present = [self.corners[(ii + di, jj + dj)]['present']
+                       for di in (0, size) for dj in (0, size)]
+            if any(p is None for p in present) or not all(
+                    (p == present[0]).all() for p in present):
+                cells.append((self.T_grid[ii], self.T_grid[ii + size],
+                              self.P_grid[jj], self.P_grid[jj + size]))
+        return cells
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Vectorized phase splits at fixed partition coefficients
+
+The first alpha/theta minimization of a flash, and the sweeps of
+'ideal_sweep', solve the phase-split equations at fixed K without any
+equation of state. The solvers here take many feeds at once and return
+the molar phase fractions and the phase stabilities of the alpha/theta
+system of 'flashalgorithm', where present phases have theta = 0 and
+absent phases have alpha = 0.
+
+Partition coefficients may be relative to any common phase, as the
+solution does not depend on the choice of reference phase.
+
+    Functions
+    ----------
+    two_phase :
+        Rachford-Rice solution of two-phase splits with a bracketed root
+    multiphase :
+        Multiphase splits as a convex minimization over phase fractions
+    phase_split :
+        Phase split of one or many feeds with the solver for their size
+"""
+import numpy as np
+
+
+def two_phase(z, K, tol=1e-12, maxiter=100):
+    """Rachford-Rice solution of two-phase splits with a bracketed root
+
+    Parameters
+    ----------
+    z : numpy array
+        Total composition of each feed with size M x Nc
+    K : numpy array
+        Partition coefficients of each feed with size M x Nc x 2
+    tol : float
+        Width of the bracket of the phase fraction at convergence
+    maxiter : int
+        Maximum number of iterations
+
+    Returns
+    ----------
+    values : list
+        values[0] : numpy array
+            Molar phase fractions with size M x 2
+        values[1] : numpy array
+            Phase stabilities with size M x 2
+        values[2] : numpy array
+            Boolean array of converged feeds with size M
+        values[3] : int
+            Number of iterations
+
+    Notes
+    ----------
+    With r = K[:, :, 1]/K[:, :, 0], the fraction beta of the second
+    phase is the root of f(beta) = sum_i z_i (r_i - 1)/(1 + beta (r_i - 1)),
+    which decreases monotonically. If f(0) <= 0 only the first phase is
+    present and if f(1) >= 0 only the second. Otherwise the root lies in
+    [0, 1] and is found by Newton steps that fall back to bisection when
+    they leave the bracket, so every feed converges. Where f is not
+    finite the bracket is bisected without being narrowed, and a feed
+    whose f stays non-finite is left unconverged.
+    """
+    M = len(z)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_minus = K[:, :, 1]/K[:, :, 0] - 1.0
+
+    def rr_func(beta):
+        denominator = 1.0 + beta[:, np.newaxis]*r_minus
+        func = np.sum(z*r_minus/denominator, axis=1)
+        slope = -np.sum(z*r_minus**2/denominator**2, axis=1)
+        return func, slope
+
+    f_low = rr_func(np.zeros(M))[0]
+    f_high = rr_func(np.ones(M))[0]
+    only_first = f_low <= 0.0
+    only_second = ~only_first & (f_high >= 0.0)
+    split = ~only_first & ~only_second
+
+    low = np.zeros(M)
+    high = np.ones(M)
+    beta = np.where(only_second, 1.0, 0.0)
+    beta[split] = (f_low/(f_low - f_high))[split]
+    converged = ~split & np.isfinite(f_low) & np.isfinite(f_high)
+    iteration = 0
+    while (iteration < maxiter) and not (converged | ~split).all():
+        iteration += 1
+        func, slope = rr_func(beta)
+        finite = np.isfinite(func)
+        converged |= split & finite & (np.abs(func) < tol)
+        active = split & ~converged
+        low = np.where(active & finite & (func > 0.0), beta, low)
+        high = np.where(active & finite & (func <= 0.0), beta, high)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            beta_newton = beta - func/slope
+        inside = finite & (beta_newton >= low) & (beta_newton <= high)
+        beta = np.where(active, np.where(inside, beta_newton,
+                                         0.5*(low + high)), beta)
+        converged |= active & (high - low < tol)
+    converged &= np.isfinite(beta)
+
+    alpha = np.stack([1.0 - beta, beta], axis=1)
+    theta = np.zeros([M, 2])
+    with np.errstate(divide='ignore'):
+        theta[:, 1] = np.where(only_first,
+                               -np.log(np.sum(z*(1.0 + r_minus), axis=1)),
+                               0.0)
+        theta[:, 0] = np.where(only_second,
+                               -np.log(np.sum(z/(1.0 + r_minus), axis=1)),
+                               0.0)
+    theta = np.maximum(0.0, theta)
+    values = [alpha, theta, converged, iteration]
+    return values
+
+
+def multiphase(z, K, tol=1e-8, maxiter=100):
+    """Multiphase splits as a convex minimization over phase fractions
+
+    Parameters
+    ----------
+    z : numpy array
+        Total composition of each feed with size M x Nc
+    K : numpy array
+        Partition coefficients of each feed with size M x Nc x Np
+    tol : float
+        Largest derivative of the objective wrt a present phase fraction
+    maxiter : int
+        Maximum number of iterations
+
+    Returns
+    ----------
+    values : list
+        values[0] : numpy array
+            Molar phase fractions with size M x Np
+        values[1] : numpy array
+            Phase stabilities with size M x Np
+        values[2] : numpy array
+            Boolean array of converged feeds with size M
+        values[3] : int
+            Number of iterations
+
+    Notes
+    ----------
+    Minimizes Q = sum_j alpha_j - sum_i z_i ln(sum_j alpha_j K_ij) over
+    alpha >= 0, which is convex, so that no reference phase is needed.
+    At the minimum sum_j alpha_j = 1 and the stability of phase j is
+    theta_j = -ln(sum_i z_i K_ij/E_i) with E_i = sum_j alpha_j K_ij,
+    which is zero for present phases. All feeds take a projected Newton
+    step at once, and feeds leave the iteration once converged or once
+    the line search can no longer decrease Q. The hessian is singular
+    when there are more phases than components, so its diagonal is
+    damped in proportion to the gradient, capped at one. The line
+    search only accepts steps with a finite and decreasing Q, which
+    keeps every E_i positive.
+    """
+    M, Nc, Np = K.shape
+    alpha = np.full([M, Np], 1.0/Np)
+    identity = np.eye(Np)
+    active = np.ones(M, dtype=bool)
+
+    def cost(z_act, K_act, alpha_try):
+        E_try = np.einsum('mij,mj->mi', K_act, alpha_try)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (np.sum(alpha_try, axis=1)
+                    - np.sum(z_act*np.log(E_try), axis=1))
+
+    iteration = 0
+    while active.any() and (iteration < maxiter):
+        iteration += 1
+        # Only feeds that are still iterating are evaluated.
+        ind = np.flatnonzero(active)
+        z_act, K_act, alpha_act = z[ind], K[ind], alpha[ind]
+        E = np.einsum('mij,mj->mi', K_act, alpha_act)
+        grad = 1.0 - np.einsum('mij,mi->mj', K_act, z_act/E)
+        free = (alpha_act > 0) | (grad < 0)
+        grad_free = np.where(free, grad, 0.0)
+        done = np.max(np.abs(grad_free), axis=1) < tol
+
+        hess = np.einsum('mij,mik,mi->mjk', K_act, K_act, z_act/E**2)
+        hess = np.where(free[:, :, np.newaxis] & free[:, np.newaxis, :],
+                        hess, 0.0)
+        diagonal = np.diagonal(hess, axis1=1, axis2=2)
+        damping = (np.minimum(np.max(np.abs(grad_free), axis=1), 1.0)
+                   [:, np.newaxis]*diagonal
+                   + 1e-12*np.max(diagonal, axis=1)[:, np.newaxis])
+        hess += identity*(~free + damping)[:, :, np.newaxis]
+        hess[~np.isfinite(hess)] = 0.0
+        step = -np.linalg.solve(hess, grad_free[:, :, np.newaxis])[:, :, 0]
+
+        # Projected backtracking line search with an Armijo condition.
+        cost_old = cost(z_act, K_act, alpha_act)
+        t = np.ones(len(ind))
+        for ls in range(30):
+            alpha_try = np.maximum(alpha_act + t[:, np.newaxis]*step, 0.0)
+            cost_try = cost(z_act, K_act, alpha_try)
+            # Decreases of Q below its rounding error are accepted.
+            accept = np.isfinite(cost_try) & (
+                cost_try <= cost_old + 1e-14*np.abs(cost_old)
+                + 1e-4*np.sum(grad*(alpha_try - alpha_act), axis=1))
+            if accept.all():
+                break
+            t = np.where(accept, t, 0.5*t)
+        alpha[ind] = np.where((done | ~accept)[:, np.newaxis],
+                              alpha_act, alpha_try)
+        # Feeds without a decrease of Q are at the rounding limit.
+        active[ind] = ~done & accept
+
+    E = np.einsum('mij,mj->mi', K, alpha)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grad = 1.0 - np.einsum('mij,mi->mj', K, z/E)
+        theta = np.where(alpha > 0, 0.0,
+                         np.maximum(0.0, -np.log(1.0 - grad)))
+    converged = np.max(np.abs(np.where((alpha > 0) | (grad < 0), grad, 0.0)),
+                       axis=1) < tol
+    values = [alpha, theta, converged, iteration]
+    return values
+
+
+def phase_split(z, K, tol=1e-8, maxiter=100):
+    """Phase split of one or many feeds with the solver for their size
+
+    Parameters
+    ----------
+    z : list, numpy array
+        Total composition with size Nc, or M x Nc for many feeds
+    K : numpy array
+        Partition coefficients with size Nc x Np, or M x Nc x Np
+    tol : float
+        Tolerance of the solver
+    maxiter : int
+        Maximum number of iterations
+
+    Returns
+    ----------
+    values : list
+        values[0] : numpy array
+            Molar phase fractions with size Np, or M x Np
+        values[1] : numpy array
+            Phase stabilities with size Np, or M x Np
+        values[2] : bool, numpy array
+            Whether each feed converged
+
+    Notes
+    ----------
+    Two phases use 'two_phase' and more phases use 'multiphase'.
+    """
+    z = np.asarray(z, dtype=float)
+    K = np.asarray(K, dtype=float)
+    single = (z.ndim == 1)
+    if single:
+        z = z[np.newaxis]
+        K = K[np.newaxis]
+    z = z/np.sum(z, axis=1, keepdims=True)
+    Np = K.shape[2]
+    if Np == 1:
+        alpha = np.ones([len(z), 1])
+        theta = np.zeros([len(z), 1])
+        converged = np.ones(len(z), dtype=bool)
+    elif Np == 2:
+        alpha, theta, converged = two_phase(z, K, 1e-4*tol, maxiter)[:3]
+    else:
+        alpha, theta, converged = multiphase(z, K, tol, maxiter)[:3]
+
+    if single:
+        values = [alpha[0], theta[0], bool(converged[0])]
+    else:
+        values = [alpha, theta, converged]
+    return values
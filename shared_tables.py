@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Registry of read-only lookup tables shared across worker processes
+
+Large read-only arrays, such as tabulated langmuir constants, are
+published once by the parent process through shared memory or a
+memory-mapped file. Worker processes attach to them without copying the
+data, so memory does not grow with the number of workers. The eos and
+flash code look tables up by name with 'get_table' and fall back to
+their own calculation when a table is not registered.
+
+A typical parallel sweep publishes its tables before creating the pool
+and passes 'table_specs()' to the pool initializer:
+
+    pool = multiprocessing.Pool(initializer=attach_tables,
+                                initargs=(table_specs(),))
+
+    Functions
+    ----------
+    publish :
+        Publish an array under a name in shared memory or a memory-mapped file
+    table_specs :
+        Picklable description of all published tables
+    attach_tables :
+        Attach to tables published by another process without copying
+    attach_untracked :
+        Attach to a shared memory segment without registering it for cleanup
+    get_table :
+        Retrieve a registered table and its metadata by name
+    release :
+        Close and, for the publishing process, free registered tables
+"""
+import threading
+
+import numpy as np
+
+"""Registered tables by name. Each entry holds the read-only array, its
+metadata, its spec and the handle keeping the memory alive"""
+table_registry = {}
+
+"""Lock held while shared memory segments are created or attached, as
+'attach_untracked' replaces the register function of the resource
+tracker meanwhile"""
+tracker_lock = threading.Lock()
+
+
+def publish(name, array, meta=None, path=None):
+    """Publish an array under a name in shared memory or a memory-mapped file
+
+    Parameters
+    ----------
+    name : str
+        Name of the table in the registry
+    array : numpy array
+        Data of the table, which is copied once into shared memory
+    meta : dict, optional
+        Small picklable information needed to interpret the table,
+        e.g. the grids it was evaluated on
+    path : str, optional
+        File to store the table as a memory-mapped '.npy' file instead
+        of a shared memory segment
+
+    Returns
+    ----------
+    table : numpy array
+        Read-only view of the published table
+
+    Notes
+    ----------
+    Publishing an existing name releases the previous table first.
+    """
+    if name in table_registry:
+        release(name)
+    array = np.ascontiguousarray(array)
+    if path is not None:
+        np.save(path, array)
+        spec = {'kind': 'file', 'location': path,
+                'shape': array.shape, 'dtype': array.dtype.str,
+                'meta': meta}
+        table_registry[name] = {'spec': spec, 'handle': None, 'owner': False}
+        table = np.load(path, mmap_mode='r')
+    else:
+        from multiprocessing import shared_memory
+
+        with tracker_lock:
+            shm = shared_memory.SharedMemory(create=True,
+                                             size=max(array.nbytes, 1))
+        table = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        table[...] = array
+        table.flags.writeable = False
+        spec = {'kind': 'shm', 'location': shm.name,
+                'shape': array.shape, 'dtype': array.dtype.str,
+                'meta': meta}
+        table_registry[name] = {'spec': spec, 'handle': shm, 'owner': True}
+    table_registry[name]['table'] = table
+    return table
+
+
+def table_specs():
+    """Picklable description of all published tables
+
+    Returns
+    ----------
+    specs : dict
+        Location, shape, dtype and metadata (values) of each table (keys)
+    """
+    specs = {name: entry['spec'] for name, entry in table_registry.items()}
+    return specs
+
+
+def attach_tables(specs):
+    """Attach to tables published by another process without copying
+
+    Parameters
+    ----------
+    specs : dict
+        Output of 'table_specs' in the publishing process
+
+    Notes
+    ----------
+    Intended as the initializer of a worker pool created by the
+    publishing process. Tables already attached under the same name and
+    location are kept.
+    """
+    for name, spec in specs.items():
+        entry = table_registry.get(name)
+        if entry is not None and entry['spec']['location'] == spec['location']:
+            continue
+        if spec['kind'] == 'file':
+            handle = None
+            table = np.load(spec['location'], mmap_mode='r')
+        else:
+            from multiprocessing import shared_memory
+
+            try:
+                handle = shared_memory.SharedMemory(name=spec['location'],
+                                                    track=False)
+            except TypeError:
+                handle = attach_untracked(spec['location'])
+            table = np.ndarray(spec['shape'], dtype=np.dtype(spec['dtype']),
+                               buffer=handle.buf)
+            table.flags.writeable = False
+        table_registry[name] = {'spec': spec, 'handle': handle,
+                                'owner': False, 'table': table}
+
+
+def attach_untracked(location):
+    """Attach to a shared memory segment without registering it for cleanup
+
+    Parameters
+    ----------
+    location : str
+        Name of the shared memory segment
+
+    Returns
+    ----------
+    handle : multiprocessing.shared_memory.SharedMemory
+        Attached segment
+
+    Notes
+    ----------
+    Before Python 3.13, which added 'track=False', attaching registers
+    the segment with the resource tracker. A worker with its own tracker
+    would then unlink the table of the publishing process when it exits.
+    Unregistering after attaching is not safe either, since workers
+    started by the publishing process share its tracker and would remove
+    the registration of the publisher. The registration is therefore
+    skipped while attaching, under 'tracker_lock' so that a segment
+    created by 'publish' in another thread meanwhile is still
+    registered.
+    """
+    from multiprocessing import resource_tracker, shared_memory
+
+    with tracker_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            handle = shared_memory.SharedMemory(name=location)
+        finally:
+            resource_tracker.register = register
+    return handle
+
+
+def get_table(name):
+    """Retrieve a registered table and its metadata by name
+
+    Parameters
+    ----------
+    name : str
+        Name of the table in the registry
+
+    Returns
+    ----------
+    values : list or None
+        Read-only table and its metadata, or None if no table of that
+        name is registered
+    """
+    entry = table_registry.get(name)
+    if entry is None:
+        return None
+    values = [entry['table'], entry['spec']['meta']]
+    return values
+
+
+def release(name=None):
+    """Close and, for the publishing process, free registered tables
+
+    Parameters
+    ----------
+    name : str, optional
+        Name of the table to release; all tables are released if omitted
+
+    Notes
+    ----------
+    Views returned by 'get_table' or 'publish' must not be used after
+    their table is released.
+    """
+    names = list(table_registry) if name is None else [name]
+    for table_name in names:
+        entry = table_registry.pop(table_name, None)
+        if entry is None or entry['handle'] is None:
+            continue
+        del entry['table']
+        try:
+            entry['handle'].close()
+        except BufferError:
+            # Views still held elsewhere keep the mapping open until exit
+            pass
+        if entry['owner']:
+            entry['handle'].unlink()
@@ -0,0 +1,663 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Surrogate flash results with a certified fallback to the full flash
+
+A coupled simulator asks for phase assemblages and phase fractions far
+more often than a flash can answer. The class 'FlashSurrogate' stores
+flash results of 'FlashController' and answers queries in temperature,
+pressure and composition from them. The assemblage is a distance
+weighted vote of the nearest stored results and the phase fractions are
+a weighted linear fit of the nearest results with the same assemblage.
+Each prediction carries its own uncertainty: the share of the vote, the
+leave-one-out residual of the fit, the distance to the nearest stored
+result and the distance to the centre of the neighbours. A query whose
+prediction is not trusted is answered by a full flash, which can be
+stored to improve later predictions.
+
+Stored results are kept as arrays that can be saved with 'save' and
+retrained from with 'load', 'add_results' and 'fit', e.g. from the
+output of 'ideal_sweep' or 'composition_diagram'.
+
+Phase assemblages are stored as integer labels as in
+'composition_diagram', with label 0 for a point without a result.
+
+    Functions
+    ----------
+    flash_samples :
+        Flash independent points
+"""
+import numpy as np
+import time
+
+import flashalgorithm as fc
+import composition_diagram as cd
+
+
+class FlashSurrogate(object):
+    """Nearest neighbour surrogate of flash results with a fallback
+
+    Methods
+    ----------
+    add_results :
+        Store flash results for training
+    generate :
+        Flash random points and store the results
+    fit :
+        Prepare the stored results for predictions
+    features :
+        Scaled features of temperatures, pressures and compositions
+    neighbors :
+        Nearest stored results of each query
+    predict :
+        Assemblage and phase fractions with their uncertainty
+    query :
+        Predictions where trusted and full flashes elsewhere
+    full_flash :
+        Flash points with the controller
+    benchmark :
+        Accuracy, fallback rate and throughput against full flashes
+    save :
+        Store the training results in a numpy .npz file
+    load :
+        Surrogate from results stored with 'save'
+    """
+    def __init__(self, flash, k=12, confidence_min=0.9, alpha_tol=0.02,
+                 distance_factor=3.0, offset_max=0.4, alpha_min=1e-8,
+                 tol=1e-6):
+        """Surrogate of the flash results of a controller
+
+        Parameters
+        ----------
+        flash : FlashController
+            Controller used for training flashes and the fallback
+        k : int
+            Number of nearest stored results used by a prediction
+        confidence_min : float
+            Smallest share of the weighted vote of the neighbours for
+            the predicted assemblage of a trusted prediction
+        alpha_tol : float
+            Largest uncertainty of the phase fractions of a trusted
+            prediction
+        distance_factor : float
+            Largest distance to the nearest stored result of a trusted
+            prediction, relative to the median distance between
+            neighbouring stored results
+        offset_max : float
+            Largest distance of a trusted prediction to the weighted
+            centre of its neighbours, relative to the distance to the
+            k-th neighbour, which rejects extrapolation at the edges of
+            the stored results
+        alpha_min : float
+            Phase fraction above which a phase counts as present
+        tol : float
+            Error below which a flash counts as converged
+
+        Attributes
+        ----------
+        T : numpy array
+            Temperature in Kelvin of each stored result with size N
+        P : numpy array
+            Pressure in bar of each stored result with size N
+        z : numpy array
+            Total composition of each stored result with size N x Nc
+        labels : numpy array
+            Assemblage label of each stored result with size N
+        alpha : numpy array
+            Molar phase fractions of each stored result with size N x Np
+        lower : numpy array
+            Smallest value of each feature (T, P and z) of the stored
+            results, set by 'fit'
+        span : numpy array
+            Range of each feature of the stored results, with features
+            that do not vary left out, set by 'fit'
+        X : numpy array
+            Scaled features of the stored results with size
+            N x (2 + Nc), set by 'fit'
+        spacing : float
+            Median distance between a stored result and its nearest
+            neighbour in scaled features, set by 'fit'
+        fitted : bool
+            Whether 'fit' was called after results were added
+        stats : dict
+            Number of queries, of fallback flashes and the time spent
+            in predictions and in fallback flashes
+        """
+        self.flash = flash
+        self.k = k
+        self.confidence_min = confidence_min
+        self.alpha_tol = alpha_tol
+        self.distance_factor = distance_factor
+        self.offset_max = offset_max
+        self.alpha_min = alpha_min
+        self.tol = tol
+        self.T = np.zeros(0)
+        self.P = np.zeros(0)
+        self.z = np.zeros([0, flash.Nc])
+        self.labels = np.zeros(0, dtype=int)
+        self.alpha = np.zeros([0, flash.Np])
+        self.lower = None
+        self.span = None
+        self.X = None
+        self.spacing = None
+        self.fitted = False
+        self.stats = {'queries': 0, 'fallback': 0, 'time_predict': 0.0,
+                      'time_fallback': 0.0}
+
+    def add_results(self, T, P, z, alpha, labels=None):
+        """Store flash results for training
+
+        Parameters
+        ----------
+        T : float, numpy array
+            Temperature in Kelvin with size N
+        P : float, numpy array
+            Pressure in bar with size N
+        z : numpy array
+            Total composition with size Nc or N x Nc
+        alpha : numpy array
+            Molar phase fractions with size N x Np
+        labels : numpy array, optional
+            Assemblage labels with size N, from 'alpha' by default.
+            Results with label 0 are not stored.
+        """
+        alpha = np.atleast_2d(np.asarray(alpha, dtype=float))
+        N = len(alpha)
+        T = np.broadcast_to(np.asarray(T, dtype=float), (N,))
+        P = np.broadcast_to(np.asarray(P, dtype=float), (N,))
+        z = np.broadcast_to(np.asarray(z, dtype=float), (N, self.flash.Nc))
+        if labels is None:
+            labels = np.array([cd.assemblage_label(present)
+                               for present in alpha > self.alpha_min],
+                              dtype=int)
+        keep = np.asarray(labels) > 0
+        self.T = np.concatenate((self.T, T[keep]))
+        self.P = np.concatenate((self.P, P[keep]))
+        self.z = np.concatenate((self.z, z[keep]))
+        self.labels = np.concatenate((self.labels,
+                                      np.asarray(labels, dtype=int)[keep]))
+        self.alpha = np.concatenate((self.alpha, alpha[keep]))
+        self.fitted = False
+
+    def generate(self, n, T_range, P_range, z_samples, seed=0,
+                 executor=None, n_chunks=8):
+        """Flash random points and store the results
+
+        Parameters
+        ----------
+        n : int
+            Number of points
+        T_range : tuple
+            Lowest and highest temperature in Kelvin
+        P_range : tuple
+            Lowest and highest pressure in bar
+        z_samples : numpy array
+            Total compositions with size m x Nc, of which one is drawn
+            at random for each point, or with size Nc for a fixed one
+        seed : int
+            Seed of the random points
+        executor : concurrent.futures.Executor, optional
+            If given, chunks of points are flashed concurrently on the
+            executor from a snapshot of the controller
+        n_chunks : int
+            Number of chunks of the points for the executor
+
+        Returns
+        ----------
+        labels : numpy array
+            Assemblage label of each point with size n, 0 if no flash
+            converged
+        """
+        rng = np.random.default_rng(seed)
+        T = rng.uniform(T_range[0], T_range[1], n)
+        P = rng.uniform(P_range[0], P_range[1], n)
+        z_samples = np.atleast_2d(np.asarray(z_samples, dtype=float))
+        z = z_samples[rng.integers(0, len(z_samples), n)]
+        if executor is None:
+            labels, alpha = self.full_flash(T, P, z)[:2]
+        else:
+            data = self.flash.snapshot()
+            chunks = [chunk for chunk in np.array_split(np.arange(n),
+                                                        n_chunks)
+                      if len(chunk)]
+            futures = [executor.submit(flash_samples, data, T[chunk],
+                                       P[chunk], z[chunk], self.alpha_min,
+                                       self.tol)
+                       for chunk in chunks]
+            results = [future.result() for future in futures]
+            labels = np.concatenate([res[0] for res in results])
+            alpha = np.concatenate([res[1] for res in results])
+        self.add_results(T, P, z, alpha, labels)
+        return labels
+
+    def fit(self):
+        """Prepare the stored results for predictions
+
+        Notes
+        ----------
+        Features are scaled to [0, 1] by the range of the stored
+        results, so that temperature, pressure and composition weigh
+        alike in the distances. The predictions themselves need no
+        training, so refitting after new results only rescales.
+        """
+        if len(self.labels) <= self.k:
+            raise ValueError("""At least k + 1 stored results are needed
+                             for a surrogate.""")
+        raw = np.column_stack((self.T, self.P, self.z))
+        self.lower = np.min(raw, axis=0)
+        span = np.max(raw, axis=0) - self.lower
+        self.span = np.where(span > 0, span, np.inf)
+        self.X = self.features(self.T, self.P, self.z)
+        self.fitted = True
+        distance = self.neighbors(self.X, 2)[1]
+        self.spacing = max(np.median(distance[:, 1]), 1e-12)
+
+    def features(self, T, P, z):
+        """Scaled features of temperatures, pressures and compositions
+
+        Parameters
+        ----------
+        T : numpy array
+            Temperature in Kelvin with size M
+        P : numpy array
+            Pressure in bar with size M
+        z : numpy array
+            Total composition with size M x Nc
+
+        Returns
+        ----------
+        X : numpy array
+            Features with size M x (2 + Nc), in which features that do
+            not vary among the stored results are zero
+        """
+        raw = np.column_stack((T, P, z))
+        X = (raw - self.lower)/self.span
+        return X
+
+    def neighbors(self, X, k=None, chunk=2048):
+        """Nearest stored results of each query
+
+        Parameters
+        ----------
+        X : numpy array
+            Scaled features of the queries with size M x D
+        k : int, optional
+            Number of neighbours, 'self.k' by default
+        chunk : int
+            Number of queries per block of the distance matrix
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Indices of the stored results with size M x k, nearest
+                first
+            values[1] : numpy array
+                Distances in scaled features with size M x k
+        """
+        k = self.k if k is None else k
+        norm_train = np.sum(self.X**2, axis=1)
+        index = np.zeros([len(X), k], dtype=int)
+        distance = np.zeros([len(X), k])
+        for start in range(0, len(X), chunk):
+            block = X[start:start + chunk]
+            dist2 = (np.sum(block**2, axis=1)[:, np.newaxis] + norm_train
+                     - 2.0*np.matmul(block, self.X.T))
+            part = np.argpartition(dist2, k - 1, axis=1)[:, :k]
+            part_dist = np.take_along_axis(dist2, part, axis=1)
+            order = np.argsort(part_dist, axis=1)
+            index[start:start + chunk] = np.take_along_axis(part, order,
+                                                            axis=1)
+            distance[start:start + chunk] = np.sqrt(np.maximum(
+                np.take_along_axis(part_dist, order, axis=1), 0.0))
+        values = [index, distance]
+        return values
+
+    def predict(self, T, P, z):
+        """Assemblage and phase fractions with their uncertainty
+
+        Parameters
+        ----------
+        T : float, numpy array
+            Temperature in Kelvin with size M
+        P : float, numpy array
+            Pressure in bar with size M
+        z : numpy array
+            Total composition with size Nc or M x Nc
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Assemblage label with size M
+            values[1] : numpy array
+                Molar phase fractions with size M x Np
+            values[2] : numpy array
+                Share of the weighted vote for the label with size M
+            values[3] : numpy array
+                Uncertainty of the phase fractions with size M
+            values[4] : numpy array
+                Distance to the nearest stored result relative to
+                'self.spacing' with size M
+            values[5] : numpy array
+                Distance to the weighted centre of the neighbours
+                relative to the distance to the k-th neighbour with size M
+            values[6] : numpy array
+                Boolean array of trusted predictions with size M
+
+        Notes
+        ----------
+        Neighbours are weighted by exp(-(d/h)**2), where h is the
+        distance to the k-th neighbour. The phase fractions are a
+        weighted linear fit over the neighbours with the predicted
+        label, or their weighted mean if there are too few of them.
+        The uncertainty is the largest weighted RMS of the leave-one-out
+        residuals of the fit over the phases.
+        """
+        if not self.fitted:
+            self.fit()
+        tstart = time.time()
+        M = max(np.size(T), np.size(P), len(np.atleast_2d(z)))
+        T = np.broadcast_to(np.asarray(T, dtype=float), (M,))
+        P = np.broadcast_to(np.asarray(P, dtype=float), (M,))
+        z = np.broadcast_to(np.asarray(z, dtype=float), (M, self.flash.Nc))
+        X = self.features(T, P, z)
+        index, distance = self.neighbors(X)
+        h = np.maximum(distance[:, -1:], 1e-12)
+        weight = np.exp(-(distance/h)**2)
+
+        # Weighted vote of the neighbour labels.
+        neighbor_labels = self.labels[index]
+        votes = np.zeros([M, self.k])
+        for jj in range(self.k):
+            votes[:, jj] = np.sum(weight*(neighbor_labels
+                                          == neighbor_labels[:, jj:jj + 1]),
+                                  axis=1)
+        best = np.argmax(votes, axis=1)
+        labels = neighbor_labels[np.arange(M), best]
+        confidence = votes[np.arange(M), best]/np.sum(weight, axis=1)
+
+        # Weighted linear fit over the neighbours with the same label.
+        same = neighbor_labels == labels[:, np.newaxis]
+        w_fit = weight*same
+        dX = self.X[index] - X[:, np.newaxis, :]
+        varies = np.isfinite(self.span)
+        dX = dX[:, :, varies]
+        basis = np.concatenate((np.ones([M, self.k, 1]), dX), axis=2)
+        n_basis = basis.shape[2]
+        linear = np.sum(same, axis=1) > n_basis
+        basis[~linear, :, 1:] = 0.0
+        gram = np.einsum('mk,mki,mkj->mij', w_fit, basis, basis)
+        gram += 1e-10*np.eye(n_basis)*np.maximum(
+            np.trace(gram, axis1=1, axis2=2), 1e-300)[:, np.newaxis,
+                                                       np.newaxis]
+        gram[~linear, 1:, 1:] = np.eye(n_basis - 1)
+        Y = self.alpha[index]
+        rhs = np.einsum('mk,mki,mkp->mip', w_fit, basis, Y)
+        coef = np.linalg.solve(gram, rhs)
+        # Leave-one-out residuals from the leverage of each neighbour.
+        leverage = w_fit*np.einsum('mki,mki->mk', basis,
+                                   np.linalg.solve(gram, basis.transpose(
+                                       0, 2, 1)).transpose(0, 2, 1))
+        residual = ((Y - np.einsum('mki,mip->mkp', basis, coef))
+                    / np.maximum(1.0 - leverage, 1e-2)[:, :, np.newaxis])
+        w_sum = np.maximum(np.sum(w_fit, axis=1), 1e-300)
+        uncertainty = np.max(np.sqrt(np.einsum('mk,mkp->mp', w_fit,
+                                               residual**2)
+                                     / w_sum[:, np.newaxis]), axis=1)
+
+        present = ((labels[:, np.newaxis] >> np.arange(self.flash.Np)) & 1
+                   ).astype(bool)
+        alpha = np.where(present, np.clip(coef[:, 0, :], 0.0, 1.0), 0.0)
+        alpha /= np.maximum(np.sum(alpha, axis=1, keepdims=True), 1e-300)
+        nearest = distance[:, 0]/self.spacing
+        centre = (np.einsum('mk,mkd->md', weight, self.X[index])
+                  / np.sum(weight, axis=1)[:, np.newaxis])
+        offset = np.linalg.norm(X - centre, axis=1)/h[:, 0]
+        trusted = ((confidence >= self.confidence_min)
+                   & (uncertainty <= self.alpha_tol)
+                   & (nearest <= self.distance_factor)
+                   & (offset <= self.offset_max))
+        self.stats['time_predict'] += time.time() - tstart
+        values = [labels, alpha, confidence, uncertainty, nearest, offset,
+                  trusted]
+        return values
+
+    def query(self, T, P, z, learn=False):
+        """Predictions where trusted and full flashes elsewhere
+
+        Parameters
+        ----------
+        T : float, numpy array
+            Temperature in Kelvin with size M
+        P : float, numpy array
+            Pressure in bar with size M
+        z : numpy array
+            Total composition with size Nc or M x Nc
+        learn : bool
+            Flag for storing the results of the fallback flashes
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Assemblage label with size M, 0 where the full flash
+                did not converge
+            values[1] : numpy array
+                Molar phase fractions with size M x Np, zero where the
+                full flash did not converge
+            values[2] : numpy array
+                Boolean array of queries answered by a full flash
+            values[3] : numpy array
+                Boolean array of queries whose full flash did not
+                converge
+        """
+        labels, alpha, trusted = [self.predict(T, P, z)[ii]
+                                  for ii in (0, 1, 6)]
+        M = len(labels)
+        T = np.broadcast_to(np.asarray(T, dtype=float), (M,))
+        P = np.broadcast_to(np.asarray(P, dtype=float), (M,))
+        z = np.broadcast_to(np.asarray(z, dtype=float), (M, self.flash.Nc))
+        fallback = ~trusted
+        failed = np.zeros(M, dtype=bool)
+        if fallback.any():
+            tstart = time.time()
+            flash_labels, flash_alpha = self.full_flash(
+                T[fallback], P[fallback], z[fallback])[:2]
+            labels[fallback] = flash_labels
+            alpha[fallback] = flash_alpha
+            failed[fallback] = flash_labels == 0
+            self.stats['time_fallback'] += time.time() - tstart
+            if learn:
+                self.add_results(T[fallback], P[fallback], z[fallback],
+                                 flash_alpha, flash_labels)
+        self.stats['queries'] += M
+        self.stats['fallback'] += int(np.sum(fallback))
+        values = [labels, alpha, fallback, failed]
+        return values
+
+    def full_flash(self, T, P, z):
+        """Flash points with the controller
+
+        Parameters
+        ----------
+        T : numpy array
+            Temperature in Kelvin with size M
+        P : numpy array
+            Pressure in bar with size M
+        z : numpy array
+            Total composition with size M x Nc
+
+        Returns
+        ----------
+        values : list
+            Output of 'flash_samples'
+        """
+        values = flash_samples(self.flash, T, P, z, self.alpha_min, self.tol)
+        return values
+
+    def benchmark(self, T, P, z, labels=None, alpha=None,
+                  confidence_levels=(0.5, 0.7, 0.8, 0.9, 0.95, 1.0)):
+        """Accuracy, fallback rate and throughput against full flashes
+
+        Parameters
+        ----------
+        T : numpy array
+            Temperature in Kelvin of the test points with size M
+        P : numpy array
+            Pressure in bar of the test points with size M
+        z : numpy array
+            Total composition with size Nc or M x Nc
+        labels : numpy array, optional
+            Assemblage labels of full flashes of the test points, which
+            are flashed if not given
+        alpha : numpy array, optional
+            Molar phase fractions of full flashes with size M x Np
+        confidence_levels : tuple
+            Values of 'confidence_min' to evaluate
+
+        Returns
+        ----------
+        report : dict
+            'time_predict' and 'time_flash' per point in seconds, and
+            for each confidence level in 'levels' a dict with the
+            fraction of trusted points, the label accuracy and largest
+            phase fraction error of trusted points, and the throughput
+            in points per second including the fallback flashes.
+
+        Notes
+        ----------
+        Test points without a converged full flash are left out. The
+        throughput assumes that each fallback costs the mean time of a
+        full flash of the test points.
+        """
+        M = max(np.size(T), np.size(P), len(np.atleast_2d(z)))
+        T = np.broadcast_to(np.asarray(T, dtype=float), (M,))
+        P = np.broadcast_to(np.asarray(P, dtype=float), (M,))
+        z = np.broadcast_to(np.asarray(z, dtype=float), (M, self.flash.Nc))
+        tstart = time.time()
+        if labels is None:
+            labels, alpha = self.full_flash(T, P, z)[:2]
+        time_flash = (time.time() - tstart)/M
+
+        tstart = time.time()
+        pred_labels, pred_alpha, confidence, uncertainty, nearest, offset = \
+            self.predict(T, P, z)[:6]
+        time_predict = (time.time() - tstart)/M
+
+        valid = np.asarray(labels) > 0
+        report = {'n_points': int(np.sum(valid)),
+                  'time_predict': time_predict,
+                  'time_flash': time_flash,
+                  'levels': {}}
+        for level in confidence_levels:
+            trusted = (valid & (confidence >= level)
+                       & (uncertainty <= self.alpha_tol)
+                       & (nearest <= self.distance_factor)
+                       & (offset <= self.offset_max))
+            n_trusted = np.sum(trusted)
+            level_report = {'trusted': n_trusted/max(np.sum(valid), 1),
+                            'accuracy': np.nan,
+                            'alpha_error': np.nan}
+            if n_trusted:
+                level_report['accuracy'] = np.mean(
+                    pred_labels[trusted] == np.asarray(labels)[trusted])
+                if alpha is not None:
+                    level_report['alpha_error'] = np.max(np.abs(
+                        pred_alpha[trusted] - np.asarray(alpha)[trusted]))
+            level_report['throughput'] = 1.0/(
+                time_predict + (1.0 - level_report['trusted'])*time_flash)
+            report['levels'][level] = level_report
+        return report
+
+    def save(self, path):
+        """Store the training results in a numpy .npz file
+
+        Parameters
+        ----------
+        path : str
+            File name
+        """
+        np.savez(path, compname=np.array(self.flash.compname),
+                 phases=np.array(self.flash.phases), T=self.T, P=self.P,
+                 z=self.z, labels=self.labels, alpha=self.alpha)
+
+    @classmethod
+    def load(cls, path, flash, **kwargs):
+        """Surrogate from results stored with 'save'
+
+        Parameters
+        ----------
+        path : str
+            File name
+        flash : FlashController
+            Controller with the same components and phases as the
+            stored results
+        kwargs : dict
+            Passed to the constructor
+
+        Returns
+        ----------
+        surrogate : FlashSurrogate
+            Fitted surrogate of the stored results
+        """
+        with np.load(path) as data:
+            if ((list(data['compname']) != list(flash.compname))
+                    or (list(data['phases']) != list(flash.phases))):
+                raise ValueError("""The stored results do not match the
+                                 components and phases of the
+                                 controller.""")
+            surrogate = cls(flash, **kwargs)
+            surrogate.add_results(data['T'], data['P'], data['z'],
+                                  data['alpha'], data['labels'])
+        surrogate.fit()
+        return surrogate
+
+
+def flash_samples(data, T, P, z, alpha_min=1e-8, tol=1e-6):
+    """Flash independent points
+
+    Parameters
+    ----------
+    data : bytes, FlashController
+        Output of 'FlashController.snapshot', or the controller itself
+    T : numpy array
+        Temperature in Kelvin with size M
+    P : numpy array
+        Pressure in bar with size M
+    z : numpy array
+        Total composition with size M x Nc
+    alpha_min : float
+        Phase fraction above which a phase counts as present
+    tol : float
+        Error below which a flash counts as converged
+
+    Returns
+    ----------
+    values : list
+        values[0] : numpy array
+            Assemblage label of each point with size M, 0 if no flash
+            converged
+        values[1] : numpy array
+            Molar phase fractions with size M x Np
+        values[2] : numpy array
+            Error of each flash with size M
+
+    Notes
+    ----------
+    Module level so that it can be submitted to a process pool.
+    """
+    if isinstance(data, bytes):
+        flash = fc.FlashController.from_snapshot(data)
+    else:
+        flash = data
+    labels = np.zeros(len(T), dtype=int)
+    alpha = np.zeros([len(T), flash.Np])
+    error = np.full(len(T), np.inf)
+    for ii in range(len(T)):
+        state, error[ii] = cd.warm_flash(flash, z[ii], T[ii], P[ii],
+                                         None, tol)
+        if state is not None and error[ii] <= tol:
+            alpha[ii] = state['alpha_calc']
+            labels[ii] = cd.assemblage_label(alpha[ii] > alpha_min)
+    values = [labels, alpha, error]
+    return values
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Round trip of flash requests through a 'FlashServer' on a Unix socket
+
+The server runs on a background thread with the controllers of the
+server, and a 'FlashClient' sends all requests of a batch at once.
+
+Run with 'python -m pytest test_flash_server.py'.
+"""
+import json
+import os
+import socket
+
+import numpy as np
+import pytest
+
+import flash_server as fs
+
+
+"""Temperature in K, pressure in bar and phase fractions in the order
+aqueous, vapor, lhc, s1, s2 of water/methane with z = [0.9, 0.1]"""
+points = [
+    (276.0, 70.0, [0.2806, 0.0, 0.0, 0.7194, 0.0]),
+    (280.0, 120.0, [0.29176, 0.0, 0.0, 0.70824, 0.0]),
+    (290.0, 70.0, None),
+]
+
+
+@pytest.fixture
+def server(tmp_path):
+    path = str(tmp_path / 'flash.sock')
+    server = fs.FlashServer({'wm': {'components': ['water', 'methane']}})
+    server.start_thread(path)
+    yield server, path
+    server.stop_thread()
+
+
+def test_flash_batch(server):
+    server, path = server
+    requests = [{'system': 'wm', 'T': T, 'P': P, 'z': [0.9, 0.1]}
+                for T, P, alpha in points]
+    with fs.FlashClient(path) as client:
+        responses = client.flash_many(requests)
+        systems = client.command('systems')['systems']
+        stats = client.command('stats')['stats']
+
+    assert list(systems) == ['wm']
+    for (T, P, alpha), response in zip(points, responses):
+        assert response['converged']
+        assert response['error'] < 1e-6
+        if alpha is not None:
+            np.testing.assert_allclose(response['alpha'], alpha, atol=1e-3)
+    assert stats['flashes'] == len(points)
+    assert stats['failed'] == 0
+
+    server.stop_thread()
+    assert not os.path.exists(path)
+
+
+def test_line_too_long(server):
+    server, path = server
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(60.0)
+    sock.connect(path)
+    with sock, sock.makefile('rwb') as stream:
+        stream.write(b' '*2**17 + b'\n')
+        stream.flush()
+        response = json.loads(stream.readline())
+        assert response['id'] is None
+        assert 'error_message' in response
+        assert stream.readline() == b''
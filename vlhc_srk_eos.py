@@ -30,8 +30,28 @@ class SrkEos(object):
         Performs calculations that only depend on pressure and temperature.
     fugacity :
         Calculates fugacity of each component in the aqueous phase.
+    dlnf_dx :
+        Calculates composition derivatives of log fugacity.
+    dlnf_dT :
+        Calculates temperature derivatives of log fugacity.
+    dlnf_dP :
+        Calculates pressure derivatives of log fugacity.
+    partial_enthalpy :
+        Calculates partial molar enthalpy of each component.
+    enthalpy :
+        Calculates molar enthalpy of phase.
+    heat_capacity :
+        Calculates molar heat capacity of phase.
+    a_mat_dT :
+        Calculates temperature derivative of 'a_mat'.
     calc:
         Main calculation for aqueous phase EOS.
+    calc_derivatives :
+        Fugacities and their derivatives for one or many states.
+    envelope_system :
+        Residual and jacobian of a point on the phase envelope.
+    phase_envelope :
+        Dew and bubble curves of a hydrocarbon mixture.
     """
     def __init__(self, comps, T, P):
         """Vapor and liquid hydrocarbon EOS object for fugacity calculations.
@@ -69,6 +89,11 @@ class SrkEos(object):
             Pre-allocated array for variable 'a' derived from a_vec.
         alf_vec : numpy array
             Pre-allocated array for variable 'alpha'.
+        dlnalf_dT_vec : numpy array
+            Pre-allocated array for temperature derivative of log 'alpha'.
+        d2sqrtalf_dT2_vec : numpy array
+            Pre-allocated array for second temperature derivative of
+            sqrt('alpha') divided by sqrt('alpha').
         Tr_vec : numpy array
             Pre-allocated array reduced temperature.
         Pr_vec : numpy array
@@ -96,6 +121,8 @@ class SrkEos(object):
         self.b_vec = np.zeros(self.num_comps)
         self.a_mat = np.zeros([self.num_comps, self.num_comps])
         self.alf_vec = np.zeros(self.num_comps)
+        self.dlnalf_dT_vec = np.zeros(self.num_comps)
+        self.d2sqrtalf_dT2_vec = np.zeros(self.num_comps)
         self.Tr_vec = np.zeros(self.num_comps)
         self.Pr_vec = np.zeros(self.num_comps)
         self.A = None
@@ -141,6 +168,16 @@ class SrkEos(object):
                  + comp.SRK['S2'] * (1.0 - np.sqrt(self.Tr_vec[ii]))
                  / np.sqrt(self.Tr_vec[ii]))**2
             )
+            self.dlnalf_dT_vec[ii] = (
+                -(self.s1_vec[ii] * np.sqrt(self.Tr_vec[ii])
+                  + comp.SRK['S2'] / np.sqrt(self.Tr_vec[ii]))
+                / (T * np.sqrt(self.alf_vec[ii]))
+            )
+            self.d2sqrtalf_dT2_vec[ii] = (
+                (self.s1_vec[ii] * np.sqrt(self.Tr_vec[ii])
+                 + 3.0 * comp.SRK['S2'] / np.sqrt(self.Tr_vec[ii]))
+                / (4.0 * T**2 * np.sqrt(self.alf_vec[ii]))
+            )
 
             # Potential change from not fitting lhc-hydrate
             # self.alf_vec[ii] = (
@@ -212,7 +249,127 @@ class SrkEos(object):
                         * np.log(1.0 + self.B/self.Z))
                )
         return fug
-        
+
+    def dlnphi_dparams(self, dA, dB, da_frac, db_frac):
+        """Change in log fugacity coefficient for changes in the mixture parameters.
+
+        Parameters
+        ----------
+        dA : numpy array
+            Change in 'A' for each of m perturbations with size m.
+        dB : numpy array
+            Change in 'B' for each of m perturbations with size m.
+        da_frac : numpy array
+            Change in 'a_frac' with size Nc x m.
+        db_frac : numpy array
+            Change in 'b_frac' with size Nc x m.
+
+        Returns
+        ----------
+        dlnphi : numpy array
+            Change in log fugacity coefficient with size Nc x m.
+
+        Notes
+        ----------
+        Uses the state of the last call to 'calc'. The change in Z
+        follows from the cubic equation of state, dZ = -(F_A*dA + F_B*dB)/F_Z.
+        """
+        A_B = self.A / self.B
+        F_Z = 3.0*self.Z**2 - 2.0*self.Z + self.A - self.B - self.B**2
+        F_A = self.Z - self.B
+        F_B = -self.Z - 2.0*self.B*self.Z - self.A
+        dZ = -(F_A*dA + F_B*dB) / F_Z
+        log_term = np.log(1.0 + self.B/self.Z)
+        dlog_term = (dB*self.Z - self.B*dZ) / (self.Z*(self.Z + self.B))
+        dA_B = A_B * (dA/self.A - dB/self.B)
+        mix_frac = 2.0*self.a_frac - self.b_frac
+
+        dlnphi = (db_frac*(self.Z - 1.0)
+                  + np.outer(self.b_frac, dZ)
+                  - ((dZ - dB) / (self.Z - self.B))[np.newaxis, :]
+                  - np.outer(mix_frac, dA_B)*log_term
+                  - A_B*(2.0*da_frac - db_frac)*log_term
+                  - A_B*np.outer(mix_frac, dlog_term))
+        return dlnphi
+
+    def dlnf_dx(self, x):
+        """Derivative of log fugacity of each component wrt molar fractions 'x'.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of component i (rows) wrt molar
+            fraction of component k (columns) with size Nc x Nc.
+
+        Notes
+        ----------
+        Molar fractions are treated as independent variables.
+        """
+        x = np.asarray(x, dtype=float)
+        a = np.dot(x, self.a_x_sum)
+        dlnf = self.dlnphi_dparams(
+            2.0*self.A*self.a_frac,
+            self.B*self.b_frac,
+            self.a_mat/a - 2.0*np.outer(self.a_frac, self.a_frac),
+            -np.outer(self.b_frac, self.b_frac))
+        with np.errstate(divide='ignore'):
+            dlnf[np.diag_indices_from(dlnf)] += 1.0 / x
+        return dlnf
+
+    def dlnf_dT(self, x):
+        """Derivative of log fugacity of each component wrt temperature.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of each component wrt temperature
+            in 1/K with size Nc.
+        """
+        x = np.asarray(x, dtype=float)
+        a = np.dot(x, self.a_x_sum)
+        a_x_sum_T = np.matmul(self.a_mat_dT(), x)
+        a_T = np.dot(x, a_x_sum_T)
+        dlnf = self.dlnphi_dparams(
+            np.array([self.A*(a_T/a - 2.0/self.T)]),
+            np.array([-self.B/self.T]),
+            (a_x_sum_T/a - self.a_frac*a_T/a)[:, np.newaxis],
+            np.zeros([self.num_comps, 1]))
+        return dlnf[:, 0]
+
+    def dlnf_dP(self, x):
+        """Derivative of log fugacity of each component wrt pressure.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        dlnf : numpy array
+            Derivative of log fugacity of each component wrt pressure
+            in 1/bar with size Nc.
+        """
+        dlnf = self.dlnphi_dparams(
+            np.array([self.A/self.P]),
+            np.array([self.B/self.P]),
+            np.zeros([self.num_comps, 1]),
+            np.zeros([self.num_comps, 1]))
+        return dlnf[:, 0] + 1.0/self.P
+
     @property
     def volume(self):
         """Volume of phase.
@@ -225,8 +382,110 @@ class SrkEos(object):
         v = self.Z*R*self.T/self.P
         return v
         
-# TODO    Write this function!
-# def enthalpy(self, Z):
+    def partial_enthalpy(self, x):
+        """Partial molar enthalpy of each component.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        h : numpy array
+            Partial molar enthalpy of each component in J/mol, relative
+            to the same reference as 'Component.enthalpy_ideal'.
+
+        Notes
+        ----------
+        Follows from h_i = h_io - R*T**2*dln(f_i)/dT at fixed P and x.
+        """
+        h_io = np.array([comp.enthalpy_ideal(self.T) for comp in self.comps])
+        h = h_io - R*1e-1*self.T**2*self.dlnf_dT(x)
+        return h
+
+    def enthalpy(self, x):
+        """Molar enthalpy of phase.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        h : float
+            Molar enthalpy of phase in J/mol.
+
+        Notes
+        ----------
+        Ideal gas enthalpy plus the SRK departure,
+        RT(Z - 1) + (T*da/dT - a)/b*ln(1 + B/Z).
+        """
+        x = np.asarray(x, dtype=float)
+        h_io = np.array([comp.enthalpy_ideal(self.T) for comp in self.comps])
+        a = np.dot(x, self.a_x_sum)
+        a_T = np.dot(x, np.matmul(self.a_mat_dT(), x))
+        h_res = (R*self.T*(self.Z - 1.0)
+                 + (self.T*a_T - a)/self.b_tot(x)*np.log(1.0 + self.B/self.Z))
+        h = np.dot(x, h_io) + h_res*1e-1
+        return h
+
+    def heat_capacity(self, x):
+        """Molar heat capacity of phase at constant pressure.
+
+        Parameters
+        ----------
+        x : list, numpy array
+            Molar fractions of each components indexed in the same order
+            as comps. Must be the molar fractions of the last call to 'calc'.
+
+        Returns
+        ----------
+        cp : float
+            Molar heat capacity of phase in J/mol-K.
+
+        Notes
+        ----------
+        Temperature derivative of 'enthalpy' at fixed P and x, where
+        the change in Z follows from the cubic equation of state.
+        """
+        x = np.asarray(x, dtype=float)
+        T = self.T
+        cp_io = np.array([comp.heat_capacity_ideal(T) for comp in self.comps])
+        a = np.dot(x, self.a_x_sum)
+        b = self.b_tot(x)
+        a_T = np.dot(x, np.matmul(self.a_mat_dT(), x))
+        a_TT = np.dot(x, np.matmul(
+            self.a_mat*(self.d2sqrtalf_dT2_vec[:, np.newaxis]
+                        + self.d2sqrtalf_dT2_vec[np.newaxis, :]
+                        + np.outer(self.dlnalf_dT_vec, self.dlnalf_dT_vec)/2.0),
+            x))
+        dA = self.A*(a_T/a - 2.0/T)
+        dB = -self.B/T
+        F_Z = 3.0*self.Z**2 - 2.0*self.Z + self.A - self.B - self.B**2
+        dZ = -((self.Z - self.B)*dA
+               + (-self.Z - 2.0*self.B*self.Z - self.A)*dB) / F_Z
+        log_term = np.log(1.0 + self.B/self.Z)
+        dlog_term = (dB*self.Z - self.B*dZ) / (self.Z*(self.Z + self.B))
+        cp_res = (R*(self.Z - 1.0) + R*T*dZ + T*a_TT/b*log_term
+                  + (T*a_T - a)/b*dlog_term)
+        cp = np.dot(x, cp_io) + cp_res*1e-1
+        return cp
+
+    def a_mat_dT(self):
+        """Temperature derivative of 'a_mat'.
+
+        Returns
+        ----------
+        a_mat_T : numpy array
+            Temperature derivative of 'a_mat' with size Nc x Nc.
+        """
+        a_mat_T = self.a_mat*(self.dlnalf_dT_vec[:, np.newaxis]
+                              + self.dlnalf_dT_vec[np.newaxis, :])/2.0
+        return a_mat_T
 
     def calc(self, comps, T, P, x, phase='general'):
         """Main calculation for the EOS which returns array of fugacities
@@ -292,3 +551,254 @@ class SrkEos(object):
                 
             fug = self.fugacity(x)
         return fug
+
+    def calc_derivatives(self, comps, T, P, x, phase='general'):
+        """Fugacities and their derivatives for one or many states
+
+        Parameters
+        ----------
+        comps : list
+            List of components as 'Component' classes.
+        T : float, numpy array
+            Temperature in Kelvin, either a single value or one per state.
+        P : float, numpy array
+            Pressure in bar, either a single value or one per state.
+        x : list, numpy array
+            Molar fractions of each components with size Nc, or with
+            size m x Nc for m states.
+        phase : str, optional
+            Specific phase for the calculation (liquid or vapor).
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Fugacity of each component with size (m x) Nc
+            values[1] : numpy array
+                Derivative of log fugacity wrt molar fractions
+                with size (m x) Nc x Nc
+            values[2] : numpy array
+                Derivative of log fugacity wrt temperature with size (m x) Nc
+            values[3] : numpy array
+                Derivative of log fugacity wrt pressure with size (m x) Nc
+
+        Notes
+        ----------
+        States are evaluated in order of temperature and pressure, such
+        that 'make_constant_mats' is called once per distinct pair.
+        """
+        x = np.asarray(x, dtype=float)
+        single = (x.ndim == 1)
+        x = np.atleast_2d(x)
+        n_states = x.shape[0]
+        T_vec = np.broadcast_to(np.asarray(T, dtype=float), [n_states])
+        P_vec = np.broadcast_to(np.asarray(P, dtype=float), [n_states])
+
+        fug = np.zeros([n_states, self.num_comps])
+        dlnf_dx = np.zeros([n_states, self.num_comps, self.num_comps])
+        dlnf_dT = np.zeros([n_states, self.num_comps])
+        dlnf_dP = np.zeros([n_states, self.num_comps])
+        for ii in np.lexsort((P_vec, T_vec)):
+            fug[ii] = self.calc(comps, T_vec[ii], P_vec[ii], x[ii],
+                                phase=phase)
+            dlnf_dx[ii] = self.dlnf_dx(x[ii])
+            dlnf_dT[ii] = self.dlnf_dT(x[ii])
+            dlnf_dP[ii] = self.dlnf_dP(x[ii])
+
+        values = [fug, dlnf_dx, dlnf_dT, dlnf_dP]
+        if single:
+            values = [value[0] for value in values]
+        return values
+
+    def envelope_system(self, comps, z, v, other):
+        """Residual and jacobian of a point on the phase envelope.
+
+        Parameters
+        ----------
+        comps : list
+            List of components as 'Component' classes.
+        z : numpy array
+            Molar fractions of the feed, which is the existing phase.
+        v : numpy array
+            Log partition coefficients ln(z/x) of each component of the
+            incipient phase x, log temperature and log pressure with
+            size Nc + 2.
+        other : SrkEos
+            Second eos object used for the incipient phase.
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Residual of equal fugacities followed by sum(x) - 1
+                with size Nc + 1.
+            values[1] : numpy array
+                Jacobian of the residual wrt v with size (Nc + 1) x (Nc + 2).
+            values[2] : numpy array
+                Molar fractions of the incipient phase.
+
+        Notes
+        ----------
+        The phase with the larger co-volume 'b' takes the liquid root and
+        the other phase the vapor root.
+        """
+        Nc = self.num_comps
+        lnK = v[:Nc]
+        T = np.exp(v[Nc])
+        P = np.exp(v[Nc + 1])
+        x = z*np.exp(-lnK)
+        if np.dot(self.b_vec, x - z) >= 0:
+            phase_z, phase_x = 'vapor', 'lhc'
+        else:
+            phase_z, phase_x = 'lhc', 'vapor'
+        fug_z = self.calc(comps, T, P, z, phase=phase_z)
+        fug_x = other.calc(comps, T, P, x, phase=phase_x)
+
+        res = np.zeros(Nc + 1)
+        res[:Nc] = np.log(fug_x) - np.log(fug_z)
+        res[Nc] = np.sum(x) - 1.0
+        jac = np.zeros([Nc + 1, Nc + 2])
+        jac[:Nc, :Nc] = -other.dlnf_dx(x)*x[np.newaxis, :]
+        jac[:Nc, Nc] = T*(other.dlnf_dT(x) - self.dlnf_dT(z))
+        jac[:Nc, Nc + 1] = P*(other.dlnf_dP(x) - self.dlnf_dP(z))
+        jac[Nc, :Nc] = -x
+        values = [res, jac, x]
+        return values
+
+    def phase_envelope(self, comps, z, P_start=1.0, max_points=500,
+                       step_max=0.3, tol=1e-10, maxiter=10):
+        """Dew and bubble curves of a hydrocarbon mixture.
+
+        Parameters
+        ----------
+        comps : list
+            List of components as 'Component' classes.
+        z : list, numpy array
+            Molar fractions of the mixture.
+        P_start : float, optional
+            Pressure in bar of the first and last point of the envelope.
+        max_points : int, optional
+            Maximum number of points.
+        step_max : float, optional
+            Maximum step in the specified variable between points.
+        tol : float, optional
+            Residual below which a point counts as converged.
+        maxiter : int, optional
+            Maximum number of Newton iterations per point.
+
+        Returns
+        ----------
+        values : list
+            values[0] : numpy array
+                Temperature in Kelvin of each point.
+            values[1] : numpy array
+                Pressure in bar of each point.
+            values[2] : numpy array
+                Partition coefficients z/x of each component between the
+                mixture and its incipient phase with size points x Nc.
+            values[3] : tuple or None
+                Temperature and pressure of the critical point, or None if
+                the envelope ended before it.
+
+        Notes
+        ----------
+        The trace starts on the dew curve at 'P_start' from Wilson
+        partition coefficients, passes the critical point, where the
+        mixture and the incipient phase swap roots, and follows the bubble
+        curve back to 'P_start'. Each point is solved by Newton's method in
+        ln K, ln T and ln P with the variable of largest sensitivity held
+        fixed. The sensitivities from the converged jacobian give a linear
+        prediction of the next point, and the step grows after quick
+        convergence and shrinks after slow or failed convergence. Changes
+        the state of this eos object.
+        """
+        z = np.asarray(z, dtype=float)
+        z = z/np.sum(z)
+        Nc = self.num_comps
+        other = SrkEos(comps, self.T, self.P)
+        Tc = np.array([comp.Tc for comp in comps])
+        Pc = np.array([comp.Pc for comp in comps])
+        omega = np.array([comp.SRK['omega'] for comp in comps])
+
+        def wilson_lnK(T, P):
+            return np.log(Pc/P) + 5.373*(1.0 + omega)*(1.0 - Tc/T)
+
+        # Dew temperature from Wilson coefficients, sum(z/K) = 1.
+        T_lo, T_hi = 0.3*np.min(Tc), 3.0*np.max(Tc)
+        for ii in range(100):
+            T = np.sqrt(T_lo*T_hi)
+            if np.sum(z*np.exp(-wilson_lnK(T, P_start))) > 1.0:
+                T_lo = T
+            else:
+                T_hi = T
+        v = np.concatenate([wilson_lnK(T, P_start), [np.log(T),
+                                                      np.log(P_start)]])
+
+        def solve(v, spec):
+            # Newton iterations at fixed v[spec].
+            for iteration in range(maxiter):
+                try:
+                    res, jac, x = self.envelope_system(comps, z, v, other)
+                    jac_full = np.vstack([jac, np.eye(Nc + 2)[spec]])
+                    if np.max(np.abs(res)) < tol:
+                        return v, jac_full, iteration
+                    dv = np.linalg.solve(jac_full, -np.append(res, 0.0))
+                except (np.linalg.LinAlgError, TypeError):
+                    # Singular jacobian or no real root of the cubic.
+                    break
+                v = v + dv/max(1.0, np.max(np.abs(dv[:Nc]))/2.0)
+                if not np.isfinite(v).all():
+                    break
+            return None, None, maxiter
+
+        spec = Nc + 1
+        step = 0.05
+        points = []
+        critical = None
+        v_conv, jac_full, iterations = solve(v, spec)
+        while (v_conv is not None) and (len(points) < max_points):
+            points.append(v_conv)
+            if (len(points) > 1) and (critical is None):
+                # The phases swap their roots at the critical point.
+                side_old = np.dot(self.b_vec, z*np.exp(-points[-2][:Nc]) - z)
+                side_new = np.dot(self.b_vec, z*np.exp(-v_conv[:Nc]) - z)
+                if side_old*side_new < 0:
+                    frac = side_old/(side_old - side_new)
+                    v_crit = points[-2] + frac*(v_conv - points[-2])
+                    critical = (np.exp(v_crit[Nc]), np.exp(v_crit[Nc + 1]))
+            if ((len(points) > 2) and (v_conv[Nc + 1] < np.log(P_start))
+                    and (critical is not None)):
+                break
+
+            # The tangent of the envelope, oriented along the last step or
+            # towards higher pressure at the start, sets the next variable.
+            rhs = np.zeros(Nc + 2)
+            rhs[-1] = 1.0
+            tangent = np.linalg.solve(jac_full, rhs)
+            if len(points) > 1:
+                orientation = np.dot(tangent, v_conv - points[-2])
+            else:
+                orientation = tangent[Nc + 1]
+            tangent = tangent*np.sign(orientation)
+            spec = int(np.argmax(np.abs(tangent)))
+            tangent = tangent/np.abs(tangent[spec])
+            if iterations <= 2:
+                step = min(1.5*step, step_max)
+            elif iterations > 4:
+                step = 0.5*step
+
+            # Predict the next point and retry with smaller steps on failure.
+            while step > 1e-6:
+                v_new, jac_new, iterations = solve(v_conv + step*tangent,
+                                                   spec)
+                if v_new is not None:
+                    break
+                step = 0.5*step
+            if v_new is None:
+                break
+            v_conv, jac_full = v_new, jac_new
+
+        points = np.array(points)
+        values = [np.exp(points[:, Nc]), np.exp(points[:, Nc + 1]),
+                  np.exp(points[:, :Nc]), critical]
+        return values